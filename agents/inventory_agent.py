@@ -1,19 +1,25 @@
+import asyncio
 from typing import Dict, List, Optional, Any, Deque
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import os
 import logging
+import threading
+import time
+from uuid import uuid4
 from langchain.chains import LLMChain
 from langchain.chains.base import Chain
 from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain.vectorstores.base import VectorStore
 from langchain_community.vectorstores import FAISS
-from langchain.pydantic_v1 import BaseModel, Field
+from langchain.pydantic_v1 import BaseModel, Field, PrivateAttr
 from tools.inventory_tools import InventoryTools
 from langchain_community.docstore.in_memory import InMemoryDocstore
 import faiss
-from chatbot import SentenceBERTEmbeddings  # 导入统一的嵌入模型
+from chatbot import get_shared_embeddings  # 导入统一的嵌入模型
+from config.metrics import AGENT_ERRORS, AGENT_RUN_SECONDS, INVENTORY_TASK_SECONDS, VECTOR_SEARCH_SECONDS, timer
+from config.tracing import bind_context, span
+from tools.llm_client import get_chat_model
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -66,6 +72,15 @@ class ExecutionChain(LLMChain):
         )
         return cls(prompt=prompt, llm=llm, verbose=verbose)
 
+# 固定任务列表，depends_on为需要其结果作为上下文的任务，tools为执行该任务使用的分析工具（结果带缓存），
+# 没有指定工具的任务交给执行链处理
+FIXED_TASKS = [
+    {"task_id": 1, "task_name": "分析天气和节假日影响", "depends_on": [], "tools": ["weather", "events"]},
+    {"task_id": 2, "task_name": "评估社交媒体趋势", "depends_on": [], "tools": ["trends"]},
+    {"task_id": 3, "task_name": "制定库存策略建议", "depends_on": [1, 2], "tools": []}
+]
+
+
 class InventoryAGI(Chain):
     """基于BabyAGI的库存管理智能代理"""
     
@@ -77,6 +92,8 @@ class InventoryAGI(Chain):
     tools: InventoryTools = Field(...)
     task_list: Deque = Field(default_factory=deque)
     task_id_counter: int = Field(default=1)
+    max_concurrency: int = Field(default=3)  # 同一阶段内并发执行的任务数上限，1为串行
+    _vectorstore_lock: Any = PrivateAttr(default_factory=threading.Lock)  # 同一实例被多个请求共享时串行写入向量存储
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -90,76 +107,159 @@ class InventoryAGI(Chain):
         return []
 
     def _call(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
-        """执行主循环"""
+        """执行主循环
+
+        固定任务按依赖关系分阶段执行：互不依赖的分析任务并发执行（并发数由max_concurrency控制），
+        只有依赖前序结果的策略任务会等待它们完成后再执行。
+        """
         objective = inputs["objective"]
-        first_task = inputs.get("first_task", "评估产品库存需求")
+        bypass_cache = inputs.get("bypass_cache", False)
         all_results = []
-        
-        # 设定固定任务列表
-        fixed_tasks = [
-            {"task_id": 1, "task_name": "分析天气和节假日影响"},
-            {"task_id": 2, "task_name": "评估社交媒体趋势"},
-            {"task_id": 3, "task_name": "制定库存策略建议"}
+
+        # 按依赖关系分阶段执行固定任务列表
+        results: Dict[int, str] = {}
+        pending = list(FIXED_TASKS)
+        while pending:
+            ready, pending = self._next_stage(pending, results)
+            if not ready:
+                break
+
+            for task, result in zip(ready, self._run_stage(objective, ready, results, bypass_cache)):
+                self._record_result(task, result, results, all_results)
+
+        return {"results": all_results}
+
+    async def _acall(self, inputs: Dict[str, Any], run_manager=None) -> Dict[str, Any]:
+        """异步执行主循环，阶段划分与_call相同，同一阶段的任务以协程并发执行"""
+        objective = inputs["objective"]
+        bypass_cache = inputs.get("bypass_cache", False)
+        all_results = []
+
+        results: Dict[int, str] = {}
+        pending = list(FIXED_TASKS)
+        while pending:
+            ready, pending = self._next_stage(pending, results)
+            if not ready:
+                break
+
+            stage_results = await self._arun_stage(objective, ready, results, bypass_cache)
+            for task, result in zip(ready, stage_results):
+                # 写入向量存储需要编码文本，放到线程中执行，不阻塞事件循环
+                await asyncio.to_thread(self._record_result, task, result, results, all_results)
+
+        return {"results": all_results}
+
+    @staticmethod
+    def _next_stage(pending: List[Dict], results: Dict[int, str]):
+        """从待执行任务中取出依赖已全部完成的任务，返回(本阶段任务, 剩余任务)"""
+        ready = [
+            t for t in pending
+            if all(dep in results for dep in t["depends_on"])
         ]
-        
-        # 执行固定任务列表
-        for task in fixed_tasks:
-            self._print_next_task(task)
-            
-            # 执行任务
-            result = self._execute_task(
-                objective=objective,
-                task=task["task_name"]
-            )
-            self._print_task_result(result)
-            
-            # 存储结果
-            if result and not result.startswith("任务执行出错"):
-                all_results.append(result)
+        if not ready:
+            logger.error(f"任务依赖无法满足: {[t['task_name'] for t in pending]}")
+        return ready, [t for t in pending if t not in ready]
+
+    def _record_result(self, task: Dict, result: str, results: Dict[int, str], all_results: List[str]):
+        self._print_task_result(result)
+        results[task["task_id"]] = result
+
+        # 存储结果（向量存储不是线程安全的，同一请求在阶段结束后按顺序写入，不同请求之间由锁串行化）
+        # 同一代理会处理多次分析，id需要唯一，否则FAISS拒绝写入已存在的id
+        if result and not result.startswith("任务执行出错"):
+            all_results.append(result)
+            with span("vectorstore.add", store="faiss"), self._vectorstore_lock:
                 self.vectorstore.add_texts(
                     texts=[result],
                     metadatas=[{"task": task["task_name"]}],
-                    ids=[f"result_{task['task_id']}"]
+                    ids=[f"result_{task['task_id']}_{uuid4().hex}"]
                 )
-                
-        return {"results": all_results}
 
-    def _execute_task(self, objective: str, task: str) -> str:
-        """执行单个任务"""
+    @staticmethod
+    def _dependency_results(task: Dict, results: Dict[int, str]) -> List[str]:
+        return [
+            results[dep] for dep in task["depends_on"]
+            if not results[dep].startswith("任务执行出错")
+        ]
+
+    def _run_stage(self, objective: str, tasks: List[Dict], results: Dict[int, str],
+                   bypass_cache: bool = False) -> List[str]:
+        """并发执行同一阶段内互不依赖的任务，按任务顺序返回结果"""
+        def run(task: Dict) -> str:
+            self._print_next_task(task)
+            with span("inventory.task", task_id=task["task_id"], task=task["task_name"]), \
+                    timer(INVENTORY_TASK_SECONDS, task=task["task_name"]):
+                return self._execute_task(
+                    objective=objective,
+                    task=task["task_name"],
+                    dependency_results=self._dependency_results(task, results),
+                    tools=task.get("tools"),
+                    bypass_cache=bypass_cache
+                )
+
+        if self.max_concurrency <= 1 or len(tasks) == 1:
+            return [run(task) for task in tasks]
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(tasks)),
+            thread_name_prefix="inventory-task"
+        ) as pool:
+            # 线程池中的任务沿用当前的追踪上下文
+            return list(pool.map(bind_context(run), tasks))
+
+    async def _arun_stage(self, objective: str, tasks: List[Dict], results: Dict[int, str],
+                          bypass_cache: bool = False) -> List[str]:
+        """_run_stage的异步版本，并发数同样受max_concurrency限制"""
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def run(task: Dict) -> str:
+            async with semaphore:
+                self._print_next_task(task)
+                with span("inventory.task", task_id=task["task_id"], task=task["task_name"]), \
+                        timer(INVENTORY_TASK_SECONDS, task=task["task_name"]):
+                    return await self._aexecute_task(
+                        objective=objective,
+                        task=task["task_name"],
+                        dependency_results=self._dependency_results(task, results),
+                        tools=task.get("tools"),
+                        bypass_cache=bypass_cache
+                    )
+
+        return list(await asyncio.gather(*(run(task) for task in tasks)))
+
+    def _select_tools(self, tools: Optional[List[str]], product_name: str):
+        """把任务指定的工具名转换为(结果前缀, 工具方法名, 参数)列表；任务没有指定工具时返回空列表"""
+        calls = {
+            "weather": ("天气分析结果", "get_weather_impact", {
+                "product": product_name,
+                "location": "全国主要城市",
+                "season": self._get_current_season(),
+            }),
+            "events": ("节日影响分析", "get_seasonal_events", {"product": product_name, "timeframe": "3个月"}),
+            "trends": ("社交趋势分析", "get_social_trends", {"product": product_name}),
+        }
+        return [calls[tool] for tool in tools or []]
+
+    def _execute_task(self, objective: str, task: str, dependency_results: Optional[List[str]] = None,
+                      tools: Optional[List[str]] = None, bypass_cache: bool = False) -> str:
+        """执行单个任务，bypass_cache为True时不使用分析工具的缓存结果"""
         try:
-            # 初始化上下文
-            context = []
+            # 初始化上下文，前序任务的结果优先
+            context = list(dependency_results or [])
             product_name = objective.split()[0]
             task_result = ""
             
             # 如果向量存储中有数据，尝试获取相关任务
             if self.vectorstore.index.ntotal > 0:
                 try:
-                    context = self._get_top_tasks(query=objective)
+                    context.extend(self._get_top_tasks(query=objective))
                 except Exception as e:
                     logger.warning(f"获取历史任务失败: {str(e)}")
             
             # 使用工具执行具体分析
-            if "天气分析" in task.lower():
-                weather_impact = self.tools.get_weather_impact(
-                    product=product_name,
-                    location="全国主要城市",
-                    season=self._get_current_season()
-                )
-                task_result = f"天气分析结果：{weather_impact}"
-                
-            elif "社交趋势" in task.lower():
-                social_trends = self.tools.get_social_trends(
-                    product=product_name
-                )
-                task_result = f"社交趋势分析：{social_trends}"
-                
-            elif "节日影响" in task.lower():
-                events = self.tools.get_seasonal_events(
-                    product=product_name,
-                    timeframe="3个月"
-                )
-                task_result = f"节日影响分析：{events}"
+            task_result = "\n".join(
+                f"{prefix}：{getattr(self.tools, method)(**kwargs, bypass_cache=bypass_cache)}"
+                for prefix, method, kwargs in self._select_tools(tools, product_name)
+            )
             
             # 使用执行链处理任务
             if not task_result:  # 如果没有使用特定工具
@@ -179,6 +279,45 @@ class InventoryAGI(Chain):
             logger.error(f"任务执行失败: {str(e)}", exc_info=True)
             return f"任务执行出错: {str(e)}"
 
+    async def _aexecute_task(self, objective: str, task: str, dependency_results: Optional[List[str]] = None,
+                             tools: Optional[List[str]] = None, bypass_cache: bool = False) -> str:
+        """_execute_task的异步版本：LLM调用走异步客户端，嵌入和FAISS检索放到线程中执行"""
+        try:
+            context = list(dependency_results or [])
+            product_name = objective.split()[0]
+            task_result = ""
+
+            if self.vectorstore.index.ntotal > 0:
+                try:
+                    context.extend(await asyncio.to_thread(bind_context(self._get_top_tasks), objective))
+                except Exception as e:
+                    logger.warning(f"获取历史任务失败: {str(e)}")
+
+            # 同一任务的多个工具并发调用
+            calls = self._select_tools(tools, product_name)
+            outputs = await asyncio.gather(*(
+                getattr(self.tools, "a" + method)(**kwargs, bypass_cache=bypass_cache)
+                for _, method, kwargs in calls
+            ))
+            task_result = "\n".join(f"{prefix}：{output}" for (prefix, _, _), output in zip(calls, outputs))
+
+            if not task_result:
+                chain_response = await self.execution_chain.arun(
+                    objective=objective,
+                    task=task,
+                    context="\n".join(context) if context else "暂无相关上下文"
+                )
+                task_result = str(chain_response)
+
+            if not task_result:
+                task_result = "任务执行完成，但未产生具体结果"
+
+            return task_result
+
+        except Exception as e:
+            logger.error(f"任务执行失败: {str(e)}", exc_info=True)
+            return f"任务执行出错: {str(e)}"
+
     def _get_next_tasks(self, result: str, task_description: str, objective: str) -> List[Dict]:
         """生成新任务"""
         try:
@@ -233,7 +372,10 @@ class InventoryAGI(Chain):
 
     def _get_top_tasks(self, query: str, k: int = 5) -> List[str]:
         """获取相关任务历史"""
-        results = self.vectorstore.similarity_search_with_score(query, k=k)
+        with span("vectorstore.search", store="faiss", k=k) as current, \
+                timer(VECTOR_SEARCH_SECONDS, store="faiss"):
+            results = self.vectorstore.similarity_search_with_score(query, k=k)
+            current.set_attribute("results", len(results))
         return [str(item.metadata["task"]) for item, _ in results]
 
     def _get_current_season(self) -> str:
@@ -249,17 +391,15 @@ class InventoryAGI(Chain):
 
     def _print_task_list(self):
         """打印任务列表"""
-        print("\n=== 当前任务列表 ===")
-        for t in self.task_list:
-            print(f"{t['task_id']}: {t['task_name']}")
+        logger.debug("当前任务列表: " + "; ".join(f"{t['task_id']}: {t['task_name']}" for t in self.task_list))
 
     def _print_next_task(self, task: Dict):
         """打印下一个任务"""
-        print(f"\n=== 执行任务 ===\n{task['task_id']}: {task['task_name']}")
+        logger.debug(f"执行任务 {task['task_id']}: {task['task_name']}")
 
     def _print_task_result(self, result: str):
         """打印任务结果"""
-        print(f"\n=== 执行结果 ===\n{result}")
+        logger.debug(f"执行结果: {result}")
 
     def add_task(self, task: Dict):
         """添加任务到任务列表"""
@@ -267,36 +407,54 @@ class InventoryAGI(Chain):
             self.task_list = deque()
         self.task_list.append(task)
 
-    def execute_strategy(self, product: str, city: str = "全国") -> Dict:
-        """执行完整的库存管理策略"""
+    def execute_strategy(self, product: str, city: str = "全国", bypass_cache: bool = False) -> Dict:
+        """执行完整的库存管理策略，bypass_cache为True时强制重新调用LLM分析"""
+        started = time.perf_counter()
         try:
-            print(f"\n{'='*50}")
-            print(f"开始分析 {city} 地区的 {product} 库存策略")
-            print(f"{'='*50}\n")
+            logger.info(f"开始分析 {city} 地区的 {product} 库存策略")
             
             # 执行分析
-            result = self.invoke(
-                input={
-                    "objective": f"为{city}地区的{product}制定库存策略"
-                }
-            )
-            
-            # 整理结果
-            analysis_results = []
-            strategy_results = []
-            logistics_results = []
-            weather_impact = {}
-            social_trends = {}
-            seasonal_events = []
+            with span("inventory.agent_run", product=product, city=city, bypass_cache=bypass_cache):
+                result = self.invoke(input=self._strategy_input(product, city, bypass_cache))
+            return self._summarize_results(result, city, started)
             
+        except Exception as e:
+            return self._strategy_error(e)
+
+    async def aexecute_strategy(self, product: str, city: str = "全国", bypass_cache: bool = False) -> Dict:
+        """execute_strategy的异步版本，各分析任务的LLM调用通过异步客户端并发发出"""
+        started = time.perf_counter()
+        try:
+            logger.info(f"开始分析 {city} 地区的 {product} 库存策略")
+            with span("inventory.agent_run", product=product, city=city, bypass_cache=bypass_cache):
+                result = await self.ainvoke(input=self._strategy_input(product, city, bypass_cache))
+            return self._summarize_results(result, city, started)
+
+        except Exception as e:
+            return self._strategy_error(e)
+
+    @staticmethod
+    def _strategy_input(product: str, city: str, bypass_cache: bool) -> Dict:
+        return {
+            "objective": f"为{city}地区的{product}制定库存策略",
+            "bypass_cache": bypass_cache
+        }
+
+    def _summarize_results(self, result: Dict, city: str, started: float) -> Dict:
+        """把各任务的结果整理为结构化数据"""
+        analysis_results = []
+        strategy_results = []
+        logistics_results = []
+        weather_impact = {}
+        social_trends = {}
+        seasonal_events = []
+        
+        with span("inventory.parse_results", results=len(result.get("results") or [])):
             if isinstance(result.get("results"), list):
                 for r in result["results"]:
                     r_str = str(r)
-                    print(f"\n分析结果:")
-                    print(f"{'-'*30}")
-                    print(r_str)
-                    print(f"{'-'*30}")
-                    
+                    logger.debug(f"分析结果: {r_str}")
+
                     if "天气分析" in r_str:
                         weather_impact = self._parse_weather_result(r_str)
                     elif "社交趋势" in r_str:
@@ -310,41 +468,41 @@ class InventoryAGI(Chain):
                     else:
                         analysis_results.append(r_str)
 
-            print(f"\n{'='*50}")
-            print("库存策略分析完成")
-            print(f"{'='*50}\n")
-            
-            # 返回结构化数据
-            return {
-                "weather_impact": weather_impact or {
-                    "impact": "暂无天气影响分析",
-                    "behavior_changes": "",
-                    "demand_forecast": "",
-                    "recommendations": ""
-                },
-                "social_trends": social_trends or {
-                    "market_heat": "暂无社交趋势分析",
-                    "discussion_focus": "",
-                    "reputation_trend": "",
-                    "related_topics": ""
-                },
-                "seasonal_events": seasonal_events or [],
-                "strategy": self._format_strategy_result(strategy_results, city),
-                "logistics": self._format_logistics_result(logistics_results, city),
-                "status": "success"
-            }
-            
-        except Exception as e:
-            print(f"\n策略执行失败: {str(e)}")
-            logger.error(f"策略执行失败: {str(e)}", exc_info=True)
-            return {
-                "weather_impact": {},
-                "social_trends": {},
-                "seasonal_events": [],
-                "strategy": {},
-                "logistics": {},
-                "status": "error"
-            }
+        logger.info("库存策略分析完成")
+        AGENT_RUN_SECONDS.observe(time.perf_counter() - started, agent="inventory", operation="analyze")
+        
+        # 返回结构化数据
+        return {
+            "weather_impact": weather_impact or {
+                "impact": "暂无天气影响分析",
+                "behavior_changes": "",
+                "demand_forecast": "",
+                "recommendations": ""
+            },
+            "social_trends": social_trends or {
+                "market_heat": "暂无社交趋势分析",
+                "discussion_focus": "",
+                "reputation_trend": "",
+                "related_topics": ""
+            },
+            "seasonal_events": seasonal_events or [],
+            "strategy": self._format_strategy_result(strategy_results, city),
+            "logistics": self._format_logistics_result(logistics_results, city),
+            "status": "success"
+        }
+
+    @staticmethod
+    def _strategy_error(error: Exception) -> Dict:
+        logger.error(f"策略执行失败: {str(error)}", exc_info=error)
+        AGENT_ERRORS.inc(agent="inventory", operation="analyze")
+        return {
+            "weather_impact": {},
+            "social_trends": {},
+            "seasonal_events": [],
+            "strategy": {},
+            "logistics": {},
+            "status": "error"
+        }
 
     def _parse_weather_result(self, text: str) -> Dict:
         """解析天气分析结果"""
@@ -420,9 +578,12 @@ class InventoryAGI(Chain):
         )
     
     @staticmethod
-    def create_default_agent():
-        """创建默认配置的库存AGI代理"""
-        embeddings = SentenceBERTEmbeddings()
+    def create_default_agent(max_concurrency: int = 3):
+        """创建默认配置的库存AGI代理
+
+        max_concurrency为互不依赖的分析任务的并发上限，设为1时退化为串行执行
+        """
+        embeddings = get_shared_embeddings()
         
         # 初始化向量存储
         vectorstore = FAISS.from_texts(
@@ -431,15 +592,13 @@ class InventoryAGI(Chain):
             metadatas=[{"task": "init"}]
         )
         
-        llm = ChatOpenAI(
-            model=os.environ["LLM_MODELEND"],
-            temperature=0.3  # 降低随机性
-        )
+        llm = get_chat_model("inventory", temperature=0.3)  # 降低随机性
         
         return InventoryAGI.from_llm(
             llm=llm,
             vectorstore=vectorstore,
             tools=InventoryTools(llm=llm),
-            max_iterations=3  # 减少迭代次数
+            max_iterations=3,  # 减少迭代次数
+            max_concurrency=max_concurrency
         )
 
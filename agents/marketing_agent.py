@@ -1,5 +1,6 @@
-import os
-from typing import List, Dict
+import logging
+import time
+from typing import AsyncIterator, List, Dict, Iterator, Optional
 from langchain_openai import ChatOpenAI
 from langchain.prompts.chat import SystemMessagePromptTemplate
 from langchain.schema import (
@@ -8,17 +9,64 @@ from langchain.schema import (
     SystemMessage,
     BaseMessage,
 )
+from config.metrics import AGENT_ERRORS, AGENT_RUN_SECONDS
+from tools.llm_client import get_chat_model
+
+logger = logging.getLogger(__name__)
+
+_encodings = {}
+
+
+def get_token_encoding(model_name: str):
+    """获取模型对应的tiktoken编码，未知模型使用cl100k_base；tiktoken不可用时返回None"""
+    if model_name not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model_name] = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                _encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"加载tiktoken编码失败，按字符数估算token: {str(e)}")
+            _encodings[model_name] = None
+    return _encodings[model_name]
+
 
 class MarketingCAMELAgent:
-    def __init__(self, system_message: SystemMessage, model: ChatOpenAI) -> None:
+    """CAMEL对话代理
+
+    max_context_tokens为发送给模型的上下文token预算：系统消息始终保留，
+    其余消息按从新到旧的顺序装入预算，超出预算的旧回合被丢弃；
+    summarize为True时，被丢弃的回合会由模型压缩为一段备忘录附在系统消息之后。
+    每一步实际发送的prompt token数记录在prompt_token_counts中。
+    """
+
+    # 每条消息的格式开销（role等），与OpenAI的计数方式一致
+    TOKENS_PER_MESSAGE = 4
+
+    def __init__(
+        self,
+        system_message: SystemMessage,
+        model: ChatOpenAI,
+        max_context_tokens: Optional[int] = None,
+        summarize: bool = False,
+        summary_max_tokens: int = 300,
+    ) -> None:
         self.system_message = system_message
         self.model = model
+        self.max_context_tokens = max_context_tokens
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+        self.encoding = get_token_encoding(getattr(model, "model_name", ""))
         self.dialog_history = []  # 添加对话历史记录
         self.init_messages()
 
     def init_messages(self) -> None:
         self.stored_messages = [self.system_message]
         self.dialog_history = []  # 重置对话历史
+        self.memo = ""  # 已被压缩的早期回合摘要
+        self.summarized_until = 0  # 历史消息（不含系统消息）中下标小于该值的已并入摘要
+        self.prompt_token_counts = []  # 每一步发送给模型的prompt token数
 
     def update_messages(self, message: BaseMessage) -> List[BaseMessage]:
         self.stored_messages.append(message)
@@ -35,28 +83,172 @@ class MarketingCAMELAgent:
             })
         return self.stored_messages
 
+    def count_tokens(self, messages: List[BaseMessage]) -> int:
+        """统计消息列表的token数"""
+        total = 0
+        for message in messages:
+            content = message.content
+            total += self.TOKENS_PER_MESSAGE + (
+                len(self.encoding.encode(content)) if self.encoding else len(content)
+            )
+        return total + 2  # 回复的起始标记
+
+    def build_context(self) -> List[BaseMessage]:
+        """构建发送给模型的上下文：系统消息 + 摘要备忘录 + 预算内最近的消息"""
+        if not self.max_context_tokens:
+            return list(self.stored_messages)
+        kept, to_summarize = self._trim_history()
+        if to_summarize:
+            self._update_memo(to_summarize)
+        return self._assemble_context(kept)
+
+    async def abuild_context(self) -> List[BaseMessage]:
+        """build_context的异步版本，压缩历史时通过异步客户端调用模型"""
+        if not self.max_context_tokens:
+            return list(self.stored_messages)
+        kept, to_summarize = self._trim_history()
+        if to_summarize:
+            await self._aupdate_memo(to_summarize)
+        return self._assemble_context(kept)
+
+    def _trim_history(self):
+        """按token预算选出保留的历史消息，返回(保留的消息, 需要新并入备忘录的消息)
+
+        已并入备忘录的消息不再放回上下文：预算只在其后的消息中分配，即使之后的回合较短、预算又能装下更早的消息。
+        """
+        candidates = self.stored_messages[1 + self.summarized_until:]
+        budget = self.max_context_tokens - self.count_tokens([self.system_message])
+        if self.summarize:
+            budget -= self.summary_max_tokens
+
+        # 从最新的消息往前装入预算，当前输入消息总是保留
+        kept = []
+        used = 0
+        for message in reversed(candidates):
+            cost = self.count_tokens([message]) - 2
+            if kept and used + cost > budget:
+                break
+            kept.insert(0, message)
+            used += cost
+        # 保持问答成对，不以孤立的回答开头
+        while len(kept) > 1 and isinstance(kept[0], AIMessage):
+            kept.pop(0)
+
+        to_summarize = []
+        if self.summarize:
+            to_summarize = candidates[:len(candidates) - len(kept)]
+            self.summarized_until += len(to_summarize)
+        return kept, to_summarize
+
+    def _assemble_context(self, kept: List[BaseMessage]) -> List[BaseMessage]:
+        context = [self.system_message]
+        if self.summarize and self.memo:
+            context.append(SystemMessage(content=f"此前对话的要点备忘：\n{self.memo}"))
+        return context + kept
+
+    def _update_memo(self, messages: List[BaseMessage]) -> None:
+        """将新丢弃的回合并入摘要备忘录"""
+        try:
+            memo = self.model.invoke([HumanMessage(content=self._memo_prompt(messages))]).content
+        except Exception as e:
+            logger.warning(f"压缩对话历史失败，保留原备忘录: {str(e)}")
+            return
+        self._set_memo(memo)
+
+    async def _aupdate_memo(self, messages: List[BaseMessage]) -> None:
+        try:
+            memo = (await self.model.ainvoke([HumanMessage(content=self._memo_prompt(messages))])).content
+        except Exception as e:
+            logger.warning(f"压缩对话历史失败，保留原备忘录: {str(e)}")
+            return
+        self._set_memo(memo)
+
+    def _memo_prompt(self, messages: List[BaseMessage]) -> str:
+        transcript = "\n".join(
+            f"{'决策者' if isinstance(m, HumanMessage) else '专家'}：{m.content}"
+            for m in messages
+        )
+        return (
+            f"请将以下营销方案讨论压缩为不超过{self.summary_max_tokens}字的备忘录，"
+            f"保留已确定的方案要点、数据、预算和约束条件。\n\n"
+            f"已有备忘录：\n{self.memo or '无'}\n\n新增对话：\n{transcript}"
+        )
+
+    def _set_memo(self, memo: str) -> None:
+        # 摘要超出预留的token数时截断，保证上下文不超预算
+        if self.encoding:
+            tokens = self.encoding.encode(memo)
+            memo = self.encoding.decode(tokens[:self.summary_max_tokens])
+        else:
+            memo = memo[:self.summary_max_tokens]
+        self.memo = memo
+
+    def _prepare_prompt(self, input_message: HumanMessage) -> List[BaseMessage]:
+        self.update_messages(input_message)
+        context = self.build_context()
+        self.prompt_token_counts.append(self.count_tokens(context))
+        return context
+
+    async def _aprepare_prompt(self, input_message: HumanMessage) -> List[BaseMessage]:
+        self.update_messages(input_message)
+        context = await self.abuild_context()
+        self.prompt_token_counts.append(self.count_tokens(context))
+        return context
+
     def step(self, input_message: HumanMessage) -> AIMessage:
-        messages = self.update_messages(input_message)
+        messages = self._prepare_prompt(input_message)
         output_message = self.model(messages)
         self.update_messages(output_message)
-        
-        # 添加控制台打印
-        print(f"\n{'='*50}")
-        print(f"输入消息: {input_message.content}")
-        print(f"输出消息: {output_message.content}")
-        print(f"{'='*50}\n")
-        
+        self._log_step(input_message, output_message)
         return output_message
 
+    def stream_step(self, input_message: HumanMessage) -> Iterator[str]:
+        """流式执行一轮对话，逐个产出回复的文本增量，结束后写入对话历史"""
+        messages = self._prepare_prompt(input_message)
+        chunks = []
+        for chunk in self.model.stream(messages):
+            if chunk.content:
+                chunks.append(chunk.content)
+                yield chunk.content
+        output_message = AIMessage(content="".join(chunks))
+        self.update_messages(output_message)
+        self._log_step(input_message, output_message)
+
+    async def astep(self, input_message: HumanMessage) -> AIMessage:
+        messages = await self._aprepare_prompt(input_message)
+        output_message = await self.model.ainvoke(messages)
+        self.update_messages(output_message)
+        self._log_step(input_message, output_message)
+        return output_message
+
+    async def astream_step(self, input_message: HumanMessage) -> AsyncIterator[str]:
+        """stream_step的异步版本"""
+        messages = await self._aprepare_prompt(input_message)
+        chunks = []
+        async for chunk in self.model.astream(messages):
+            if chunk.content:
+                chunks.append(chunk.content)
+                yield chunk.content
+        output_message = AIMessage(content="".join(chunks))
+        self.update_messages(output_message)
+        self._log_step(input_message, output_message)
+
+    def _log_step(self, input_message: HumanMessage, output_message: AIMessage) -> None:
+        # 完整消息只在DEBUG级别输出，避免高并发下大量同步写控制台
+        logger.debug(
+            f"输入消息: {input_message.content}\n输出消息: {output_message.content}\n"
+            f"prompt tokens: {self.prompt_token_counts[-1]}"
+        )
+
     def get_dialog_history(self) -> List[Dict]:
         return self.dialog_history
 
 class MarketingAgent:
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            model=os.environ["LLM_MODELEND"],
-            temperature=0.7
-        )
+    def __init__(self, max_context_tokens: Optional[int] = 3000, summarize_history: bool = False):
+        """max_context_tokens和summarize_history为每个对话代理的上下文管理策略，见MarketingCAMELAgent"""
+        self.llm = get_chat_model("marketing", temperature=0.7)
+        self.max_context_tokens = max_context_tokens
+        self.summarize_history = summarize_history
         
         # 设置角色提示
         self.assistant_role_name = "营销策划专家"
@@ -125,110 +317,204 @@ class MarketingAgent:
         
         return assistant_msg, user_msg
 
+    def _create_agent(self, system_message: SystemMessage) -> MarketingCAMELAgent:
+        return MarketingCAMELAgent(
+            system_message,
+            self.llm,
+            max_context_tokens=self.max_context_tokens,
+            summarize=self.summarize_history
+        )
+
     def generate_marketing_plan(self, product: str, target: str, goal: str) -> Dict:
-        try:
-            print(f"\n开始生成营销方案...")
-            print(f"产品: {product}")
-            print(f"目标受众: {target}")
-            print(f"营销目标: {goal}\n")
+        """生成完整的营销方案，所有回合结束后一次性返回"""
+        result = {"status": "error", "error": "营销方案生成未完成", "conversation": []}
+        for event in self.stream_marketing_plan(product, target, goal):
+            if event["event"] in ("done", "error"):
+                result = event["data"]
+        return result
+
+    async def agenerate_marketing_plan(self, product: str, target: str, goal: str) -> Dict:
+        """generate_marketing_plan的异步版本"""
+        result = {"status": "error", "error": "营销方案生成未完成", "conversation": []}
+        async for event in self.astream_marketing_plan(product, target, goal):
+            if event["event"] in ("done", "error"):
+                result = event["data"]
+        return result
+
+    def _plan_dialog(self, product: str, target: str, goal: str):
+        """创建生成营销方案的对话代理，返回(代理, 任务上下文, 各回合的问题)"""
+        # 创建任务描述
+        task_description = f"为产品「{product}」制定针对「{target}」的营销方案，目标是「{goal}」"
+
+        # 初始化营销专家和决策者代理
+        assistant_sys_msg = SystemMessage(content=self.assistant_inception_prompt.format(
+            assistant_role_name=self.assistant_role_name,
+            user_role_name=self.user_role_name,
+            task=task_description
+        ))
+        
+        assistant_agent = self._create_agent(assistant_sys_msg)
+
+        # 开始多轮对话
+        dialog_turns = [
+            # 第一轮：提出初步方案
+            f"请为{product}制定初步的营销方案框架。考虑目标受众是{target}，主要目标是{goal}。",
             
-            # 创建任务描述
-            task_description = f"为产品「{product}」制定针对「{target}」的营销方案，目标是「{goal}」"
-
-            # 初始化营销专家和决策者代理
-            assistant_sys_msg = SystemMessage(content=self.assistant_inception_prompt.format(
-                assistant_role_name=self.assistant_role_name,
-                user_role_name=self.user_role_name,
-                task=task_description
-            ))
+            # 第二轮：细化执行计划
+            "请详细说明这个方案的具体执行步骤、时间表和预算分配。",
             
-            assistant_agent = MarketingCAMELAgent(assistant_sys_msg, self.llm)
+            # 第三轮：讨论风险和应对
+            "这个方案可能存在哪些风险？我们应该如何预防和应对？",
+            
+            # 第四轮：评估和优化
+            "请说明如何评估方案效果，以及根据反馈进行优化的机制。"
+        ]
 
-            # 开始多轮对话
-            dialog_turns = [
-                # 第一轮：提出初步方案
-                f"请为{product}制定初步的营销方案框架。考虑目标受众是{target}，主要目标是{goal}。",
-                
-                # 第二轮：细化执行计划
-                "请详细说明这个方案的具体执行步骤、时间表和预算分配。",
-                
-                # 第三轮：讨论风险和应对
-                "这个方案可能存在哪些风险？我们应该如何预防和应对？",
-                
-                # 第四轮：评估和优化
-                "请说明如何评估方案效果，以及根据反馈进行优化的机制。"
-            ]
+        context = {
+            "product": product,
+            "target": target,
+            "goal": goal
+        }
+        return assistant_agent, context, dialog_turns
+
+    def stream_marketing_plan(self, product: str, target: str, goal: str) -> Iterator[Dict]:
+        """流式生成营销方案
+
+        依次产出以下事件（dict，包含event和data）：
+        - start：对话开始，包含任务上下文和回合数
+        - round_start：一个回合开始，包含该回合的问题
+        - delta：当前回合回答的文本增量
+        - round：一个回合完成，包含完整的问题和回答
+        - done / error：全部完成（结构与generate_marketing_plan的返回值一致，
+          usage.prompt_tokens为每个回合发送的prompt token数）或出错
+        """
+        started = time.perf_counter()
+        try:
+            logger.info(f"开始生成营销方案: 产品={product}, 目标受众={target}, 营销目标={goal}")
+            assistant_agent, context, dialog_turns = self._plan_dialog(product, target, goal)
+            yield {"event": "start", "data": {"context": context, "rounds": len(dialog_turns)}}
 
             conversation = []
             for i, turn in enumerate(dialog_turns, 1):
-                print(f"\n=== 对话回合 {i} ===")
-                print(f"问题: {turn}")
-                response = assistant_agent.step(HumanMessage(content=turn))
-                print(f"{'='*30}")
+                logger.debug(f"对话回合 {i}: {turn}")
+                round_no = len(conversation) // 2 + 1
+                yield {"event": "round_start", "data": {"round": round_no, "index": i, "question": turn}}
+                answer = []
+                for delta in assistant_agent.stream_step(HumanMessage(content=turn)):
+                    answer.append(delta)
+                    yield {"event": "delta", "data": {"round": round_no, "index": i, "content": delta}}
                 
                 conversation.append({
-                    "round": len(conversation) // 2 + 1,
+                    "round": round_no,
                     "question": turn,
-                    "answer": response.content
+                    "answer": "".join(answer)
                 })
+                yield self._round_event(i, assistant_agent, conversation)
 
-            print("\n营销方案生成完成！")
-            # 返回结构化的对话记录
-            return {
-                "status": "success",
-                "context": {
-                    "product": product,
-                    "target": target,
-                    "goal": goal
-                },
-                "conversation": conversation
-            }
+            yield self._plan_done(assistant_agent, context, conversation, started)
             
         except Exception as e:
-            print(f"\n生成营销方案时出错: {str(e)}")
-            logger.error(f"生成营销方案时出错: {str(e)}")
-            return {
-                "status": "error",
-                "error": str(e),
-                "conversation": []
-            }
+            yield self._plan_error(e)
 
-    def refine_plan(self, initial_plan: str, feedback: str) -> Dict:
-        """基于反馈优化营销方案"""
+    async def astream_marketing_plan(self, product: str, target: str, goal: str) -> AsyncIterator[Dict]:
+        """stream_marketing_plan的异步版本，事件格式相同"""
+        started = time.perf_counter()
         try:
-            print(f"\n开始优化营销方案...")
-            print(f"收到反馈: {feedback}\n")
+            logger.info(f"开始生成营销方案: 产品={product}, 目标受众={target}, 营销目标={goal}")
+            assistant_agent, context, dialog_turns = self._plan_dialog(product, target, goal)
+            yield {"event": "start", "data": {"context": context, "rounds": len(dialog_turns)}}
+
+            conversation = []
+            for i, turn in enumerate(dialog_turns, 1):
+                logger.debug(f"对话回合 {i}: {turn}")
+                round_no = len(conversation) // 2 + 1
+                yield {"event": "round_start", "data": {"round": round_no, "index": i, "question": turn}}
+                answer = []
+                async for delta in assistant_agent.astream_step(HumanMessage(content=turn)):
+                    answer.append(delta)
+                    yield {"event": "delta", "data": {"round": round_no, "index": i, "content": delta}}
+
+                conversation.append({
+                    "round": round_no,
+                    "question": turn,
+                    "answer": "".join(answer)
+                })
+                yield self._round_event(i, assistant_agent, conversation)
+
+            yield self._plan_done(assistant_agent, context, conversation, started)
+
+        except Exception as e:
+            yield self._plan_error(e)
+
+    @staticmethod
+    def _round_event(index: int, assistant_agent: MarketingCAMELAgent, conversation: List[Dict]) -> Dict:
+        return {"event": "round", "data": {
+            "index": index,
+            "prompt_tokens": assistant_agent.prompt_token_counts[-1],
+            **conversation[-1]
+        }}
+
+    @staticmethod
+    def _plan_done(assistant_agent: MarketingCAMELAgent, context: Dict, conversation: List[Dict],
+                   started: float) -> Dict:
+        logger.info("营销方案生成完成")
+        AGENT_RUN_SECONDS.observe(time.perf_counter() - started, agent="marketing", operation="generate")
+        # 返回结构化的对话记录
+        return {"event": "done", "data": {
+            "status": "success",
+            "context": context,
+            "conversation": conversation,
+            "usage": {"prompt_tokens": assistant_agent.prompt_token_counts}
+        }}
+
+    @staticmethod
+    def _plan_error(error: Exception) -> Dict:
+        logger.error(f"生成营销方案时出错: {str(error)}")
+        AGENT_ERRORS.inc(agent="marketing", operation="generate")
+        return {"event": "error", "data": {
+            "status": "error",
+            "error": str(error),
+            "conversation": []
+        }}
+
+    def _refine_dialog(self, feedback: str):
+        """创建优化营销方案的对话代理，返回(代理, 各回合的问题)"""
+        # 创建优化任务描述
+        task_description = f"基于以下反馈优化营销方案：\n{feedback}"
+
+        # 初始化代理
+        assistant_sys_msg = SystemMessage(content=self.assistant_inception_prompt.format(
+            assistant_role_name=self.assistant_role_name,
+            user_role_name=self.user_role_name,
+            task=task_description
+        ))
+        
+        assistant_agent = self._create_agent(assistant_sys_msg)
+
+        # 优化对话流程
+        dialog_turns = [
+            # 分析反馈
+            f"请分析以下反馈的关键点：\n{feedback}",
             
-            # 创建优化任务描述
-            task_description = f"基于以下反馈优化营销方案：\n{feedback}"
-
-            # 初始化代理
-            assistant_sys_msg = SystemMessage(content=self.assistant_inception_prompt.format(
-                assistant_role_name=self.assistant_role_name,
-                user_role_name=self.user_role_name,
-                task=task_description
-            ))
+            # 提出优化方案
+            "基于这些反馈，请提出具体的优化建议。",
             
-            assistant_agent = MarketingCAMELAgent(assistant_sys_msg, self.llm)
+            # 完善细节
+            "请详细说明如何落实这些优化建议。"
+        ]
+        return assistant_agent, dialog_turns
 
-            # 优化对话流程
-            dialog_turns = [
-                # 分析反馈
-                f"请分析以下反馈的关键点：\n{feedback}",
-                
-                # 提出优化方案
-                "基于这些反馈，请提出具体的优化建议。",
-                
-                # 完善细节
-                "请详细说明如何落实这些优化建议。"
-            ]
+    def refine_plan(self, initial_plan: str, feedback: str) -> Dict:
+        """基于反馈优化营销方案"""
+        started = time.perf_counter()
+        try:
+            logger.info(f"开始优化营销方案，反馈: {feedback}")
+            assistant_agent, dialog_turns = self._refine_dialog(feedback)
 
             conversation = []
             for i, turn in enumerate(dialog_turns, 1):
-                print(f"\n=== 优化回合 {i} ===")
-                print(f"问题: {turn}")
+                logger.debug(f"优化回合 {i}: {turn}")
                 response = assistant_agent.step(HumanMessage(content=turn))
-                print(f"{'='*30}")
                 
                 conversation.append({
                     "round": len(conversation) // 2 + 1,
@@ -236,21 +522,55 @@ class MarketingAgent:
                     "answer": response.content
                 })
 
-            print("\n营销方案优化完成！")
-            return {
-                "status": "success",
-                "context": {
-                    "original_plan": initial_plan,
-                    "feedback": feedback
-                },
-                "conversation": conversation
-            }
+            return self._refine_done(assistant_agent, initial_plan, feedback, conversation, started)
             
         except Exception as e:
-            print(f"\n优化营销方案时出错: {str(e)}")
-            logger.error(f"优化营销方案时出错: {str(e)}")
-            return {
-                "status": "error",
-                "error": str(e),
-                "conversation": []
-            }
+            return self._refine_error(e)
+
+    async def arefine_plan(self, initial_plan: str, feedback: str) -> Dict:
+        """refine_plan的异步版本"""
+        started = time.perf_counter()
+        try:
+            logger.info(f"开始优化营销方案，反馈: {feedback}")
+            assistant_agent, dialog_turns = self._refine_dialog(feedback)
+
+            conversation = []
+            for i, turn in enumerate(dialog_turns, 1):
+                logger.debug(f"优化回合 {i}: {turn}")
+                response = await assistant_agent.astep(HumanMessage(content=turn))
+
+                conversation.append({
+                    "round": len(conversation) // 2 + 1,
+                    "question": turn,
+                    "answer": response.content
+                })
+
+            return self._refine_done(assistant_agent, initial_plan, feedback, conversation, started)
+
+        except Exception as e:
+            return self._refine_error(e)
+
+    @staticmethod
+    def _refine_done(assistant_agent: MarketingCAMELAgent, initial_plan: str, feedback: str,
+                     conversation: List[Dict], started: float) -> Dict:
+        logger.info("营销方案优化完成")
+        AGENT_RUN_SECONDS.observe(time.perf_counter() - started, agent="marketing", operation="refine")
+        return {
+            "status": "success",
+            "context": {
+                "original_plan": initial_plan,
+                "feedback": feedback
+            },
+            "conversation": conversation,
+            "usage": {"prompt_tokens": assistant_agent.prompt_token_counts}
+        }
+
+    @staticmethod
+    def _refine_error(error: Exception) -> Dict:
+        logger.error(f"优化营销方案时出错: {str(error)}")
+        AGENT_ERRORS.inc(agent="marketing", operation="refine")
+        return {
+            "status": "error",
+            "error": str(error),
+            "conversation": []
+        }
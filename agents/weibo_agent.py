@@ -5,17 +5,13 @@ from tools.search_tool import get_UID
 from langchain.prompts import PromptTemplate
 from langchain.agents import initialize_agent, Tool
 from langchain.agents import AgentType
-from langchain_openai import ChatOpenAI
-import os
+from tools.llm_client import get_chat_model
 
 
 # 通过LangChain代理找到UID的函数
 def lookup_V(category: str):
     # 初始化大模型
-    llm = ChatOpenAI(
-        model=os.environ["LLM_MODELEND"],
-        temperature=0.7,  # 提高温度增加多样性
-    )
+    llm = get_chat_model("weibo", temperature=0.7)  # 提高温度增加多样性
 
     # 优化搜索提示模板
     template = """请帮我找到在{category}领域最有影响力的微博KOL或大V。
@@ -1,23 +1,127 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+from config.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    HTTP_REQUEST_ERRORS,
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUESTS,
+    render as render_metrics,
+    start_flusher,
+)
+from config.tracing import record_exception, setup_tracing, start_span, end_span
 from findbigV import find_bigV
 from chatbot import ChatbotWithRetrieval
 import json
+import logging
+import time
+import uuid
 from agents.marketing_agent import MarketingAgent
 from agents.inventory_agent import InventoryAGI
+from tools.model_registry import embedding_model_name, warm_up, startup_timer
+from tools.job_queue import STALE_ERROR, JobQueue
+from database.db import JobStore
 from flask_cors import CORS
 
+logger = logging.getLogger(__name__)
+
+# 按环境变量TRACING_EXPORTER启用追踪，必须在创建各组件之前调用，LLM回调在构造时绑定
+setup_tracing()
+# 设置了METRICS_DIR（多进程部署）时定期把本进程的指标写入共享目录，由/metrics汇总
+start_flusher()
+
 # 实例化Flask应用
 app = Flask(__name__)
 CORS(app)  # 启用跨域支持
 
+# 后台预加载共享的嵌入模型，各组件首次使用时复用同一份
+warm_up([embedding_model_name()], background=True)
+
 # 初始化聊天机器人
-bot = ChatbotWithRetrieval("docs")
+with startup_timer("ChatbotWithRetrieval"):
+    bot = ChatbotWithRetrieval("docs")
 
 # 初始化营销助手
-marketing_agent = MarketingAgent()
+with startup_timer("MarketingAgent"):
+    marketing_agent = MarketingAgent()
 
 # 使用工厂方法初始化库存代理
-inventory_agi = InventoryAGI.create_default_agent()
+with startup_timer("InventoryAGI"):
+    inventory_agi = InventoryAGI.create_default_agent()
+
+
+def run_find_bigV(category: str) -> dict:
+    """查找大V并生成合作邮件"""
+    return json.loads(find_bigV(category=category))
+
+
+CHAT_SESSION_COOKIE = "chat_session"
+CHAT_SESSION_MAX_AGE = 30 * 24 * 3600
+
+
+def resolve_chat_session(data: dict, headers, cookies):
+    """确定/chat请求所属的会话，依次取请求体的session_id、X-Session-ID请求头和会话cookie
+
+    都没有时生成新的会话ID，返回(会话ID, 是否为新会话)，新会话需要在响应中设置cookie。
+    """
+    session_id = data.get("session_id") or headers.get("X-Session-ID") or cookies.get(CHAT_SESSION_COOKIE)
+    if session_id:
+        return str(session_id)[:64], False
+    return uuid.uuid4().hex, True
+
+
+def parse_bool(value) -> bool:
+    """解析JSON或表单中的布尔参数，字符串只有1/true/yes（不区分大小写）为真"""
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def run_inventory_analysis(product: str, city: str = "全国", bypass_cache: bool = False) -> dict:
+    """执行库存分析并整理为接口返回的结构"""
+    # 使用AGI执行完整的库存分析策略，传入城市参数
+    result = inventory_agi.execute_strategy(
+        product=product,
+        city=city,
+        bypass_cache=parse_bool(bypass_cache)
+    )
+    return format_inventory_result(result)
+
+
+def format_inventory_result(result: dict) -> dict:
+    """把InventoryAGI.execute_strategy的结果整理为接口返回的结构"""
+    if not result:
+        raise RuntimeError("策略执行失败")
+
+    # 确保返回结构化数据；分析失败时保留error状态，后台任务据此记为失败
+    formatted = {
+        "factors": {
+            "weather_impact": result.get("weather_impact", {}),
+            "social_trends": result.get("social_trends", {}),
+            "seasonal_events": result.get("seasonal_events", [])
+        },
+        "strategy": result.get("strategy", {}),
+        "logistics": result.get("logistics", {}),
+        "status": result.get("status", "success")
+    }
+    if formatted["status"] == "error":
+        formatted["error"] = "分析库存时出现错误"
+    return formatted
+
+
+# 后台任务队列：长耗时接口可以异步提交，立即返回任务ID，结果保留1小时
+job_queue = JobQueue(result_ttl=3600)
+job_queue.register("process", run_find_bigV, max_concurrency=2)
+job_queue.register("marketing_generate", marketing_agent.generate_marketing_plan, max_concurrency=2)
+job_queue.register("inventory_analyze", run_inventory_analysis, max_concurrency=2)
+
+# 任务状态订阅连接的最长保持时间（秒）
+JOB_EVENTS_TIMEOUT = 60
+
+# 各类任务的必填参数和可选参数
+JOB_PARAMS = {
+    "process": (["category"], []),
+    "marketing_generate": (["product", "target", "goal"], []),
+    "inventory_analyze": (["product"], ["city", "bypass_cache"]),
+}
 
 # 主页路由，返回index.html模板
 @app.route("/")
@@ -33,13 +137,11 @@ def process():
         if not category:
             return jsonify({"error": "类目不能为空"}), 400
             
-        response_str = find_bigV(category=category)
-        response = json.loads(response_str)
-
-        return jsonify(response)
+        return jsonify(run_find_bigV(category))
         
     except Exception as e:
-        print(f"Error in process: {str(e)}")
+        logger.exception(f"Error in process: {str(e)}")
+        record_exception(e)
         return jsonify({
             "error": "服务器处理请求时出现错误",
             "details": str(e)
@@ -50,15 +152,23 @@ def process():
 @app.route("/chat", methods=["POST"])
 def chat():
     try:
-        message = request.json.get("message", "")
+        data = request.json
+        message = data.get("message", "")
         if not message:
             return jsonify({"error": "消息不能为空"}), 400
-            
-        response = bot.get_response(message)
-        return jsonify({"response": response})
+
+        session_id, new_session = resolve_chat_session(data, request.headers, request.cookies)
+        response = bot.get_response(message, session_id=session_id)
+        # 只返回本轮的回答，对话历史按会话保存在服务端
+        result = jsonify({"response": response, "session_id": session_id})
+        if new_session:
+            result.set_cookie(CHAT_SESSION_COOKIE, session_id, max_age=CHAT_SESSION_MAX_AGE,
+                              httponly=True, samesite="Lax")
+        return result
         
     except Exception as e:
-        print(f"Chat error: {str(e)}")
+        logger.exception(f"Chat error: {str(e)}")
+        record_exception(e)
         return jsonify({"error": "服务器处理请求时出现错误"}), 500
 
 
@@ -84,13 +194,64 @@ def generate_marketing_plan():
         return jsonify(result)
         
     except Exception as e:
-        print(f"Error in generate_marketing_plan: {str(e)}")
+        logger.exception(f"Error in generate_marketing_plan: {str(e)}")
+        record_exception(e)
         return jsonify({
             "status": "error",
             "error": str(e),
             "conversation": []
         }), 500
 
+def sse_response(events):
+    """将事件迭代器包装为server-sent events响应"""
+    def generate():
+        for event in events:
+            data = json.dumps(event["data"], ensure_ascii=False)
+            yield f"event: {event['event']}\ndata: {data}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 关闭nginx等反向代理的缓冲
+        },
+    )
+
+
+@app.route("/chat/stream", methods=["POST"])
+def stream_chat():
+    """流式回答客服问题：先推送路由和计划步骤，回答的文本边生成边推送，最后推送完整回答"""
+    data = request.json or {}
+    message = data.get("message", "")
+    if not message:
+        return jsonify({"error": "消息不能为空"}), 400
+
+    session_id, new_session = resolve_chat_session(data, request.headers, request.cookies)
+    result = sse_response(bot.stream_response(message, session_id=session_id))
+    if new_session:
+        result.set_cookie(CHAT_SESSION_COOKIE, session_id, max_age=CHAT_SESSION_MAX_AGE,
+                          httponly=True, samesite="Lax")
+    return result
+
+
+@app.route("/marketing/generate/stream", methods=["POST"])
+def stream_marketing_plan():
+    """流式生成营销方案，每个回答的文本增量和每个完成的回合都会立即推送"""
+    data = request.json
+    product = data.get("product")
+    target = data.get("target")
+    goal = data.get("goal")
+
+    if not all([product, target, goal]):
+        return jsonify({"error": "缺少必要参数"}), 400
+
+    return sse_response(marketing_agent.stream_marketing_plan(
+        product=product,
+        target=target,
+        goal=goal
+    ))
+
 @app.route("/marketing/refine", methods=["POST"])
 def refine_marketing_plan():
     try:
@@ -111,7 +272,8 @@ def refine_marketing_plan():
         return jsonify(result)
         
     except Exception as e:
-        print(f"Error in refine_marketing_plan: {str(e)}")
+        logger.exception(f"Error in refine_marketing_plan: {str(e)}")
+        record_exception(e)
         return jsonify({
             "status": "error",
             "error": str(e),
@@ -125,33 +287,24 @@ def analyze_inventory():
         data = request.json
         product = data.get("product")
         city = data.get("city", "全国")  # 添加城市参数，默认为"全国"
+        bypass_cache = parse_bool(data.get("bypass_cache", False))  # 为True时忽略缓存，强制重新分析
         
         if not product:
             return jsonify({"error": "缺少必要参数"}), 400
             
-        # 使用AGI执行完整的库存分析策略，传入城市参数
-        result = inventory_agi.execute_strategy(
+        result = run_inventory_analysis(
             product=product,
-            city=city
+            city=city,
+            bypass_cache=bypass_cache
         )
-        
-        if not result:
-            return jsonify({"error": "策略执行失败"}), 500
-            
-        # 确保返回结构化数据
-        return jsonify({
-            "factors": {
-                "weather_impact": result.get("weather_impact", {}),
-                "social_trends": result.get("social_trends", {}),
-                "seasonal_events": result.get("seasonal_events", [])
-            },
-            "strategy": result.get("strategy", {}),
-            "logistics": result.get("logistics", {}),
-            "status": "success"
-        })
+        if result.get("error"):
+            g.request_failed = True
+        return jsonify(result)
         
     except Exception as e:
-        print(f"Error in analyze_inventory: {str(e)}")
+        logger.exception(f"Error in analyze_inventory: {str(e)}")
+        record_exception(e)
+        g.request_failed = True  # 以200返回错误信息，单独计入错误数
         return jsonify({
             "error": "分析库存时出现错误",
             "factors": {
@@ -164,6 +317,76 @@ def analyze_inventory():
         }), 200  # 返回200以确保前端能处理错误
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus格式的指标：LLM调用、嵌入、检索、数据库、后台任务和各接口的请求统计"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route("/jobs/<kind>", methods=["POST"])
+def submit_job(kind):
+    """异步提交长耗时任务，参数与对应的同步接口相同"""
+    if not job_queue.has_kind(kind):
+        return jsonify({"error": f"未知的任务类型: {kind}"}), 404
+
+    data = request.get_json(silent=True) or request.form.to_dict()
+    required, optional = JOB_PARAMS[kind]
+    if not all(data.get(key) for key in required):
+        return jsonify({"error": "缺少必要参数"}), 400
+
+    payload = {key: data[key] for key in required + optional if key in data}
+    job_id, deduplicated = job_queue.submit(kind, payload)
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "deduplicated": deduplicated,  # 为True表示合并到了相同输入的进行中任务
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events"
+    }), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """轮询任务状态，完成后result为对应同步接口的返回值"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "任务不存在或结果已过期"}), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """以server-sent events订阅任务状态，任务结束或超过JOB_EVENTS_TIMEOUT秒后关闭连接
+
+    超时时发送timeout事件，客户端可以重新订阅或改为轮询/jobs/<job_id>。
+    """
+    def events():
+        last_status = None
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        while True:
+            job = job_queue.get(job_id)
+            if not job:
+                yield {"event": "error", "data": {"error": "任务不存在或结果已过期"}}
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield {"event": "status", "data": job}
+            if job["status"] not in JobStore.ACTIVE_STATUSES:
+                return
+            if job_queue.is_stale(job):
+                # 所在进程已退出的任务不会再更新，不再继续等待
+                yield {"event": "error", "data": {"error": STALE_ERROR}}
+                return
+            if time.monotonic() >= deadline:
+                # 订阅连接占用服务端线程/连接，不随任务无限期保持
+                yield {"event": "timeout", "data": {"job_id": job_id, "status": last_status,
+                                                     "status_url": f"/jobs/{job_id}"}}
+                return
+            time.sleep(1)
+
+    return sse_response(events())
+
+
 # 添加全局错误处理
 @app.errorhandler(Exception)
 def handle_error(error):
@@ -183,6 +406,45 @@ def before_request():
             return jsonify({"error": "缺少API密钥"}), 401
 
 
+@app.before_request
+def start_request_span():
+    g.request_started = time.perf_counter()
+    # 每个请求一个根span，请求内的LLM调用、嵌入、检索和数据库操作都挂在它下面
+    g.request_span = start_span(
+        "http.request",
+        **{
+            "http.method": request.method,
+            "http.route": request.url_rule.rule if request.url_rule else request.path,
+        }
+    )
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    handle = g.get("request_span")
+    if handle is not None:
+        handle[0].set_attribute("http.status_code", response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request_span(error=None):
+    # 流式响应在数据全部发送后才会执行teardown，span和耗时覆盖整个流
+    end_span(g.pop("request_span", None), error=error)
+
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    # 按路由模板而不是实际路径统计，避免/jobs/<job_id>等路径产生大量标签
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    status = g.get("response_status", 500)
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    if error is not None or status >= 500 or g.get("request_failed"):
+        HTTP_REQUEST_ERRORS.inc(endpoint=endpoint)
+
+
 # 判断是否是主程序运行，并设置Flask应用的host和debug模式
 if __name__ == "__main__":
     app.run(
@@ -0,0 +1,392 @@
+"""ASGI（FastAPI）入口，提供与app.py相同的路由
+
+各代理的LLM调用通过异步客户端（ainvoke/astream）发出，等待模型响应时不占用线程，
+一个进程可以同时挂起数百个LLM请求；仍是同步实现的查找大V流程（微博爬取、SerpAPI）放到线程池中执行。
+组件（聊天机器人、营销助手、库存代理、任务队列）复用app.py中初始化的同一批实例。
+
+启动：
+    uvicorn asgi:app --host 127.0.0.1 --port 8000
+    python asgi.py
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
+
+from app import (
+    CHAT_SESSION_COOKIE,
+    CHAT_SESSION_MAX_AGE,
+    JOB_EVENTS_TIMEOUT,
+    JOB_PARAMS,
+    bot,
+    format_inventory_result,
+    inventory_agi,
+    job_queue,
+    marketing_agent,
+    parse_bool,
+    resolve_chat_session,
+    run_find_bigV,
+)
+from config.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    HTTP_REQUEST_ERRORS,
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUESTS,
+    render as render_metrics,
+)
+from config.tracing import end_span, record_exception, start_span
+from database.db import JobStore
+from tools.job_queue import STALE_ERROR
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+app = FastAPI(title="E-commerce LLM toolset")
+app.mount("/static", StaticFiles(directory=os.path.join(ROOT, "static")), name="static")
+
+templates = Jinja2Templates(directory=os.path.join(ROOT, "templates"))
+# 模板按Flask的方式调用url_for('static', filename=...)
+templates.env.globals["url_for"] = lambda endpoint, filename: f"/static/{filename}"
+
+
+class RequestInstrumentationMiddleware:
+    """每个请求记录一个根span和请求数、错误数、耗时指标
+
+    以纯ASGI中间件实现，流式响应的耗时覆盖到最后一块数据发送完毕。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        handle = start_span("http.request", **{"http.method": scope["method"], "http.route": scope["path"]})
+        status = 500
+        error = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # 按路由模板而不是实际路径统计，避免/jobs/{job_id}等路径产生大量标签
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            if handle is not None:
+                handle[0].set_attribute("http.status_code", status)
+            end_span(handle, error=error)
+            HTTP_REQUESTS.inc(endpoint=endpoint, method=scope["method"], status=status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+            if error is not None or status >= 500 or scope.get("state", {}).get("request_failed"):
+                HTTP_REQUEST_ERRORS.inc(endpoint=endpoint)
+
+
+app.add_middleware(RequestInstrumentationMiddleware)
+
+
+@app.middleware("http")
+async def check_api_key(request: Request, call_next):
+    # 检查API密钥(如果需要)
+    if request.url.path.startswith("/api/") and not request.headers.get("X-API-Key"):
+        return JSONResponse({"error": "缺少API密钥"}, status_code=401)
+    return await call_next(request)
+
+
+@app.exception_handler(Exception)
+async def handle_error(request: Request, error: Exception):
+    logger.error(f"应用错误: {str(error)}", exc_info=error)
+    return JSONResponse({
+        "error": "服务器内部错误",
+        "message": str(error)
+    }, status_code=500)
+
+
+def sse_response(events) -> StreamingResponse:
+    """将异步事件迭代器包装为server-sent events响应"""
+    async def generate():
+        async for event in events:
+            data = json.dumps(event["data"], ensure_ascii=False)
+            yield f"event: {event['event']}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 关闭nginx等反向代理的缓冲
+        },
+    )
+
+
+async def json_body(request: Request) -> dict:
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+@app.get("/", response_class=HTMLResponse)
+async def index(request: Request):
+    return templates.TemplateResponse(request, "index.html")
+
+
+@app.post("/process")
+async def process(request: Request):
+    try:
+        form = await request.form()
+        category = form["category"]
+        if not category:
+            return JSONResponse({"error": "类目不能为空"}, status_code=400)
+
+        # 查找大V的流程（ReAct代理、微博爬取）是同步实现，放到线程池中执行
+        return await run_in_threadpool(run_find_bigV, category)
+
+    except Exception as e:
+        logger.exception(f"Error in process: {str(e)}")
+        record_exception(e)
+        return JSONResponse({
+            "error": "服务器处理请求时出现错误",
+            "details": str(e)
+        }, status_code=500)
+
+
+@app.post("/chat")
+async def chat(request: Request):
+    try:
+        data = await json_body(request)
+        message = data.get("message", "")
+        if not message:
+            return JSONResponse({"error": "消息不能为空"}, status_code=400)
+
+        session_id, new_session = resolve_chat_session(data, request.headers, request.cookies)
+        response = await bot.aget_response(message, session_id=session_id)
+        result = JSONResponse({"response": response, "session_id": session_id})
+        if new_session:
+            result.set_cookie(CHAT_SESSION_COOKIE, session_id, max_age=CHAT_SESSION_MAX_AGE,
+                              httponly=True, samesite="lax")
+        return result
+
+    except Exception as e:
+        logger.exception(f"Chat error: {str(e)}")
+        record_exception(e)
+        return JSONResponse({"error": "服务器处理请求时出现错误"}, status_code=500)
+
+
+@app.post("/marketing/generate")
+async def generate_marketing_plan(request: Request):
+    try:
+        data = await json_body(request)
+        product = data.get("product")
+        target = data.get("target")
+        goal = data.get("goal")
+
+        if not all([product, target, goal]):
+            return JSONResponse({"error": "缺少必要参数"}, status_code=400)
+
+        return await marketing_agent.agenerate_marketing_plan(
+            product=product,
+            target=target,
+            goal=goal
+        )
+
+    except Exception as e:
+        logger.exception(f"Error in generate_marketing_plan: {str(e)}")
+        record_exception(e)
+        return JSONResponse({
+            "status": "error",
+            "error": str(e),
+            "conversation": []
+        }, status_code=500)
+
+
+@app.post("/chat/stream")
+async def stream_chat(request: Request):
+    """流式回答客服问题：先推送路由和计划步骤，回答的文本边生成边推送，最后推送完整回答"""
+    data = await json_body(request)
+    message = data.get("message", "")
+    if not message:
+        return JSONResponse({"error": "消息不能为空"}, status_code=400)
+
+    session_id, new_session = resolve_chat_session(data, request.headers, request.cookies)
+    result = sse_response(bot.astream_response(message, session_id=session_id))
+    if new_session:
+        result.set_cookie(CHAT_SESSION_COOKIE, session_id, max_age=CHAT_SESSION_MAX_AGE,
+                          httponly=True, samesite="lax")
+    return result
+
+
+@app.post("/marketing/generate/stream")
+async def stream_marketing_plan(request: Request):
+    """流式生成营销方案，每个回答的文本增量和每个完成的回合都会立即推送"""
+    data = await json_body(request)
+    product = data.get("product")
+    target = data.get("target")
+    goal = data.get("goal")
+
+    if not all([product, target, goal]):
+        return JSONResponse({"error": "缺少必要参数"}, status_code=400)
+
+    return sse_response(marketing_agent.astream_marketing_plan(
+        product=product,
+        target=target,
+        goal=goal
+    ))
+
+
+@app.post("/marketing/refine")
+async def refine_marketing_plan(request: Request):
+    try:
+        data = await json_body(request)
+        initial_plan = data.get("plan")
+        feedback = data.get("feedback")
+
+        if not all([initial_plan, feedback]):
+            return JSONResponse({"error": "缺少必要参数"}, status_code=400)
+
+        return await marketing_agent.arefine_plan(
+            initial_plan=initial_plan,
+            feedback=feedback
+        )
+
+    except Exception as e:
+        logger.exception(f"Error in refine_marketing_plan: {str(e)}")
+        record_exception(e)
+        return JSONResponse({
+            "status": "error",
+            "error": str(e),
+            "conversation": []
+        }, status_code=500)
+
+
+@app.post("/inventory/analyze")
+async def analyze_inventory(request: Request):
+    try:
+        data = await json_body(request)
+        product = data.get("product")
+        city = data.get("city", "全国")
+        bypass_cache = parse_bool(data.get("bypass_cache", False))  # 为True时忽略缓存，强制重新分析
+
+        if not product:
+            return JSONResponse({"error": "缺少必要参数"}, status_code=400)
+
+        result = await inventory_agi.aexecute_strategy(
+            product=product,
+            city=city,
+            bypass_cache=bypass_cache
+        )
+        result = format_inventory_result(result)
+        if result.get("error"):
+            request.state.request_failed = True
+        return result
+
+    except Exception as e:
+        logger.exception(f"Error in analyze_inventory: {str(e)}")
+        record_exception(e)
+        request.state.request_failed = True  # 以200返回错误信息，单独计入错误数
+        return {
+            "error": "分析库存时出现错误",
+            "factors": {
+                "weather_impact": {},
+                "social_trends": {},
+                "seasonal_events": []
+            },
+            "strategy": {},
+            "logistics": {}
+        }  # 返回200以确保前端能处理错误
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus格式的指标，与app.py的/metrics相同"""
+    return Response(render_metrics(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+@app.post("/jobs/{kind}")
+async def submit_job(kind: str, request: Request):
+    """异步提交长耗时任务，参数与对应的同步接口相同"""
+    if not job_queue.has_kind(kind):
+        return JSONResponse({"error": f"未知的任务类型: {kind}"}, status_code=404)
+
+    data = await json_body(request) or dict(await request.form())
+    required, optional = JOB_PARAMS[kind]
+    if not all(data.get(key) for key in required):
+        return JSONResponse({"error": "缺少必要参数"}, status_code=400)
+
+    payload = {key: data[key] for key in required + optional if key in data}
+    # 提交会打开写事务（最多等待busy_timeout），不能在事件循环上执行
+    job_id, deduplicated = await run_in_threadpool(job_queue.submit, kind, payload)
+    return JSONResponse({
+        "job_id": job_id,
+        "status": "queued",
+        "deduplicated": deduplicated,  # 为True表示合并到了相同输入的进行中任务
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events"
+    }, status_code=202)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """轮询任务状态，完成后result为对应同步接口的返回值"""
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if not job:
+        return JSONResponse({"error": "任务不存在或结果已过期"}, status_code=404)
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """以server-sent events订阅任务状态，任务结束或超过JOB_EVENTS_TIMEOUT秒后关闭连接
+
+    超时时发送timeout事件，客户端可以重新订阅或改为轮询/jobs/<job_id>。
+    """
+    async def events():
+        last_status = None
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        while True:
+            job = await run_in_threadpool(job_queue.get, job_id)
+            if not job:
+                yield {"event": "error", "data": {"error": "任务不存在或结果已过期"}}
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield {"event": "status", "data": job}
+            if job["status"] not in JobStore.ACTIVE_STATUSES:
+                return
+            if job_queue.is_stale(job):
+                # 所在进程已退出的任务不会再更新，不再继续等待
+                yield {"event": "error", "data": {"error": STALE_ERROR}}
+                return
+            if time.monotonic() >= deadline:
+                # 订阅连接占用服务端线程/连接，不随任务无限期保持
+                yield {"event": "timeout", "data": {"job_id": job_id, "status": last_status,
+                                                     "status_url": f"/jobs/{job_id}"}}
+                return
+            await asyncio.sleep(1)
+
+    return sse_response(events())
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,135 @@
+"""客服问答语义缓存压测
+
+用假LLM在临时工作目录中构建ChatbotWithRetrieval，按客服流量的特点回放问题序列：
+少数常见问题（花语、配送、售后政策）及其改写占大多数，其余为长尾问题，
+热度服从Zipf分布（固定seed可复现）。报告缓存命中率，以及命中与未命中请求各自的延迟分布，
+结果保存为JSON。
+
+注意：--fake-embeddings的哈希向量只能识别完全相同的问题，改写后的问题需要真实的嵌入模型才能命中。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_answer_cache --requests 300
+    python -m benchmarks.bench_answer_cache --threshold 0.9 --llm-ttft-ms 500
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.bench_endpoints import git_commit, percentiles  # noqa: E402
+from benchmarks.fakes import LatencyProfile, install_fakes  # noqa: E402
+
+# 常见问题及其改写
+FAQ = [
+    ["玫瑰的花语是什么？", "玫瑰花语是什么", "请问玫瑰代表什么花语？"],
+    ["配送范围有哪些城市？", "你们配送哪些城市？", "配送范围包括哪些城市"],
+    ["鲜花如何保鲜？", "鲜花怎么保鲜？", "买回去的鲜花如何保鲜"],
+    ["收到的花有损坏可以退换吗？", "花损坏了能退换吗？", "鲜花损坏如何退换"],
+    ["订单多久能送达？", "下单后多久送到？", "订单多长时间能送达"],
+    ["可以开发票吗？", "能开发票吗？", "是否可以开具发票"],
+    ["康乃馨适合送给谁？", "康乃馨送给谁合适？", "康乃馨适合送什么人"],
+    ["生日送什么花比较好？", "过生日送什么花好？", "生日适合送哪种花"],
+]
+LONG_TAIL = [
+    "员工入职需要准备哪些材料？", "门店几点开门？", "节假日配送会延迟吗？", "会员积分怎么使用？",
+    "可以指定配送时间吗？", "花束可以加贺卡吗？", "企业订花有折扣吗？", "向日葵的花语是什么？",
+    "百合花有香味吗？", "郁金香适合什么季节？", "花瓶需要单独购买吗？", "可以同城当日达吗？",
+]
+
+
+def make_trace(total: int, seed: int, tail_ratio: float):
+    """生成问题序列：常见问题按Zipf热度抽取并随机选一种说法，tail_ratio比例为长尾问题"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(FAQ))]
+    trace = []
+    for _ in range(total):
+        if rng.random() < tail_ratio:
+            trace.append(rng.choice(LONG_TAIL))
+        else:
+            trace.append(rng.choice(rng.choices(FAQ, weights)[0]))
+    return trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--tail-ratio", type=float, default=0.2, help="长尾问题占比")
+    parser.add_argument("--threshold", type=float, default=None, help="命中阈值，默认取CHAT_CACHE_THRESHOLD或0.95")
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0)
+    parser.add_argument("--llm-ttft-sigma", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=50.0)
+    parser.add_argument("--llm-output-tokens", type=int, default=200)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="用哈希向量代替SentenceTransformer（无法下载模型时使用）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/answer-cache-<commit>.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"answer-cache-{git_commit() or 'local'}.json"))
+    if args.threshold is not None:
+        os.environ["CHAT_CACHE_THRESHOLD"] = str(args.threshold)
+    for key in ("OPENAI_API_KEY", "OPENAI_BASE_URL"):
+        os.environ.setdefault(key, "bench")
+    os.environ.setdefault("LLM_MODELEND", "fake-chat")
+    latency = LatencyProfile(args.llm_ttft_ms, args.llm_ttft_sigma, args.llm_tokens_per_s,
+                             args.llm_output_tokens, seed=args.seed)
+    install_fakes(latency, fake_embeddings=args.fake_embeddings)
+
+    workdir = tempfile.mkdtemp(prefix="bench_answer_cache_")
+    os.chdir(workdir)
+    from chatbot import ChatbotWithRetrieval
+
+    bot = ChatbotWithRetrieval(os.path.join(ROOT, "docs"), index_dir=os.path.join(workdir, "doc_index"))
+
+    latencies = {"hit": [], "miss": []}
+    for question in make_trace(args.requests, args.seed, args.tail_ratio):
+        hits_before = bot.answer_cache.hits
+        start = time.perf_counter()
+        bot.get_response(question)
+        elapsed = time.perf_counter() - start
+        latencies["hit" if bot.answer_cache.hits > hits_before else "miss"].append(elapsed)
+
+    stats = bot.answer_cache.stats()
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_llm": latency.to_dict(),
+            "fake_embeddings": args.fake_embeddings,
+            "threshold": bot.answer_cache.threshold,
+            "requests": args.requests,
+            "tail_ratio": args.tail_ratio,
+        },
+        "results": {
+            "cache": stats,
+            "hit_latency_ms": percentiles(latencies["hit"]),
+            "miss_latency_ms": percentiles(latencies["miss"]),
+        },
+    }
+
+    print(f"命中率: {stats['hit_rate']:.1%}（命中 {stats['hits']}，未命中 {stats['misses']}，缓存条目 {stats['entries']}）")
+    for kind in ("hit", "miss"):
+        summary = result["results"][f"{kind}_latency_ms"] or {}
+        print(f"{kind:<6}p50 {summary.get('p50', '-')}ms  p95 {summary.get('p95', '-')}ms  "
+              f"p99 {summary.get('p99', '-')}ms  ({len(latencies[kind])} 次)")
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Flask（WSGI）与FastAPI（ASGI）服务模式的对比压测
+
+两种服务分别在独立的子进程中启动（同样使用假LLM和假外部接口），
+对LLM耗时为主的接口以逐级提高的并发发起请求，报告每个并发级别下的吞吐量、p50/p99延迟、
+流式接口的首字节时间，以及服务进程的峰值线程数和内存，结果保存为JSON。
+服务进程的LLM并发上限（LLM_MAX_CONCURRENCY/LLM_MODEL_CONCURRENCY）会限制两种模式能同时等待的LLM请求数，
+可以用--llm-max-concurrency/--llm-model-concurrency调整，生效的值记录在结果的meta中。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_asgi
+    python -m benchmarks.bench_asgi --concurrency 16 64 256 --requests 512 --llm-ttft-ms 800
+    python -m benchmarks.bench_asgi --concurrency 256 --llm-max-concurrency 512 --llm-model-concurrency 512
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.bench_endpoints import git_commit, run_endpoint  # noqa: E402
+from benchmarks.fakes import LatencyProfile, install_fakes  # noqa: E402
+from tools.llm_client import concurrency_limits  # noqa: E402
+
+MODES = ("flask", "asgi")
+# LLM耗时为主的接口，两种服务模式的差异主要体现在这里
+DEFAULT_ENDPOINTS = ["chat", "chat_stream", "marketing_generate", "marketing_generate_stream", "inventory_analyze"]
+
+
+def serve(mode: str, port: int):
+    """子进程入口：在临时工作目录中启动指定模式的服务，直到被父进程结束"""
+    workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    os.symlink(os.path.join(ROOT, "docs"), os.path.join(workdir, "docs"))
+    os.chdir(workdir)
+
+    if mode == "flask":
+        from werkzeug.serving import make_server
+
+        from app import app
+
+        make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+    else:
+        import uvicorn
+
+        from asgi import app
+
+        uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def proc_status(pid: int) -> dict:
+    """从/proc/<pid>/status读取线程数和常驻内存（MB），非Linux系统返回空字典"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    return {
+        "threads": int(fields["Threads"].strip()),
+        "rss_mb": int(fields["VmRSS"].split()[0]) / 1024,
+    }
+
+
+class ResourceSampler:
+    """在后台定期采样服务进程的线程数和内存，记录峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            status = proc_status(self.pid)
+            if status:
+                self.peak_threads = max(self.peak_threads, status["threads"])
+                self.peak_rss_mb = max(self.peak_rss_mb, status["rss_mb"])
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def start_server(mode: str, port: int, args) -> subprocess.Popen:
+    """启动服务子进程并等待其可以响应请求"""
+    command = [
+        sys.executable, "-m", "benchmarks.bench_asgi", "--serve", mode, "--port", str(port),
+        "--llm-ttft-ms", str(args.llm_ttft_ms), "--llm-ttft-sigma", str(args.llm_ttft_sigma),
+        "--llm-tokens-per-s", str(args.llm_tokens_per_s), "--llm-output-tokens", str(args.llm_output_tokens),
+        "--http-latency-ms", str(args.http_latency_ms), "--seed", str(args.seed),
+    ]
+    if args.fake_embeddings:
+        command.append("--fake-embeddings")
+    process = subprocess.Popen(command, cwd=ROOT, env=server_env(args))
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{mode}服务启动失败，退出码{process.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError(f"{mode}服务在{args.startup_timeout}秒内未就绪")
+
+
+def server_env(args) -> dict:
+    """服务子进程的环境变量：按命令行参数覆盖LLM并发上限"""
+    env = dict(os.environ)
+    if args.llm_max_concurrency is not None:
+        env["LLM_MAX_CONCURRENCY"] = str(args.llm_max_concurrency)
+    if args.llm_model_concurrency is not None:
+        env["LLM_MODEL_CONCURRENCY"] = str(args.llm_model_concurrency)
+    return env
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def bench_mode(mode: str, port: int, args) -> dict:
+    """对一种服务模式依次压测各接口和各并发级别"""
+    process = start_server(mode, port, args)
+    base_url = f"http://127.0.0.1:{port}"
+    results = {"startup": proc_status(process.pid)}
+    try:
+        for name in args.endpoints:
+            results[name] = {}
+            for concurrency in args.concurrency:
+                with ResourceSampler(process.pid) as sampler:
+                    result = run_endpoint(base_url, name, concurrency, args.requests, args.warmup)
+                result["server_peak_threads"] = sampler.peak_threads
+                result["server_peak_rss_mb"] = round(sampler.peak_rss_mb, 1)
+                results[name][str(concurrency)] = result
+                latency_ms = result["latency_ms"] or {}
+                ttfb = (result.get("ttfb_ms") or {}).get("p50", "-")
+                print(f"{mode:<7}{name:<28}{concurrency:>6}{result['throughput_rps']:>9}"
+                      f"{latency_ms.get('p50', '-'):>10}{latency_ms.get('p99', '-'):>10}{ttfb:>10}"
+                      f"{result['errors']:>8}{sampler.peak_threads:>9}{round(sampler.peak_rss_mb, 1):>9}")
+    finally:
+        stop_server(process)
+    return results
+
+
+def print_comparison(results: dict, endpoints, levels):
+    """按接口和并发级别并排打印两种模式的吞吐量与p99延迟"""
+    print(f"\n{'endpoint':<28}{'conc':>6}{'flask rps':>11}{'asgi rps':>10}{'flask p99':>11}{'asgi p99':>10}"
+          f"{'flask thr':>11}{'asgi thr':>10}")
+    for name in endpoints:
+        for concurrency in levels:
+            flask = results["flask"][name][str(concurrency)]
+            asgi = results["asgi"][name][str(concurrency)]
+            print(f"{name:<28}{concurrency:>6}{flask['throughput_rps']:>11}{asgi['throughput_rps']:>10}"
+                  f"{(flask['latency_ms'] or {}).get('p99', '-'):>11}{(asgi['latency_ms'] or {}).get('p99', '-'):>10}"
+                  f"{flask['server_peak_threads']:>11}{asgi['server_peak_threads']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[16, 64, 256], help="依次压测的并发级别")
+    parser.add_argument("--requests", type=int, default=256, help="每个接口每个并发级别的请求数")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--port", type=int, default=18700, help="服务端口，各模式依次使用port、port+1")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0)
+    parser.add_argument("--llm-ttft-sigma", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=50.0)
+    parser.add_argument("--llm-output-tokens", type=int, default=200)
+    parser.add_argument("--http-latency-ms", type=float, default=100.0)
+    parser.add_argument("--llm-max-concurrency", type=int,
+                        help="服务进程的LLM全局并发上限，默认沿用LLM_MAX_CONCURRENCY环境变量或其默认值")
+    parser.add_argument("--llm-model-concurrency", type=int,
+                        help="服务进程的LLM单模型并发上限，默认沿用LLM_MODEL_CONCURRENCY环境变量或其默认值")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="用哈希向量代替SentenceTransformer（无法下载模型时使用）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/asgi-<commit>.json")
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        for key in ("SERPAPI_API_KEY", "OPENAI_API_KEY", "OPENAI_BASE_URL"):
+            os.environ.setdefault(key, "bench")
+        os.environ.setdefault("LLM_MODELEND", "fake-chat")
+        latency = LatencyProfile(args.llm_ttft_ms, args.llm_ttft_sigma, args.llm_tokens_per_s,
+                                 args.llm_output_tokens, seed=args.seed)
+        install_fakes(latency, args.http_latency_ms, args.fake_embeddings)
+        serve(args.serve, args.port)
+        return
+
+    # 与服务子进程相同的环境下计算生效的并发上限
+    os.environ.update(server_env(args))
+    llm_limits = concurrency_limits()
+    effective_limit = min(llm_limits["global"], llm_limits["per_model"])
+    if max(args.concurrency) > effective_limit:
+        print(f"注意：LLM并发上限为{effective_limit}（global={llm_limits['global']}, "
+              f"per_model={llm_limits['per_model']}），更高并发级别下超出的LLM请求会排队等待名额")
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_llm": LatencyProfile(args.llm_ttft_ms, args.llm_ttft_sigma, args.llm_tokens_per_s,
+                                   args.llm_output_tokens).to_dict(),
+        "http_latency_ms": args.http_latency_ms,
+        "fake_embeddings": args.fake_embeddings,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "llm_concurrency_limits": llm_limits,
+    }
+
+    results = {}
+    print(f"{'mode':<7}{'endpoint':<28}{'conc':>6}{'rps':>9}{'p50':>10}{'p99':>10}{'ttfb50':>10}"
+          f"{'errors':>8}{'threads':>9}{'rss':>9}")
+    for offset, mode in enumerate(args.modes):
+        results[mode] = bench_mode(mode, args.port + offset, args)
+
+    if set(MODES) <= set(results):
+        print_comparison(results, args.endpoints, args.concurrency)
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"asgi-{meta['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""客服会话历史的内存浸泡测试
+
+模拟持续到来的多用户流量：同一时刻约有--active-users个活跃用户，每个用户发送若干条消息后离开，
+新用户不断加入。每处理--sample-every条消息采样一次常驻内存和内存中的会话数，
+比较有界的会话存储（按会话保留最近若干轮、LRU淘汰、空闲过期）与不设上限时的内存变化，结果保存为JSON。
+
+--target bot时消息经过ChatbotWithRetrieval（假LLM，零延迟），否则直接写入会话存储。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_chat_sessions --messages 200000
+    python -m benchmarks.bench_chat_sessions --target bot --messages 20000 --fake-embeddings
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.bench_endpoints import git_commit  # noqa: E402
+from tools.conversation_store import ConversationStore  # noqa: E402
+from tools.model_registry import rss_mb  # noqa: E402
+
+QUESTIONS = ["配送范围有哪些城市？", "鲜花如何保鲜？", "可以开发票吗？", "订单多久能送达？", "玫瑰的花语是什么？"]
+ANSWER = "您好，易速鲜花目前支持全国主要城市的配送，同城订单最快当日送达，" * 12
+
+
+def make_store(mode: str, args) -> ConversationStore:
+    if mode == "bounded":
+        return ConversationStore(max_turns=args.history_turns, max_sessions=args.max_sessions, ttl=args.ttl)
+    # 不设上限：相当于改造前每条消息都追加到同一份历史中
+    return ConversationStore(max_turns=None, max_sessions=sys.maxsize, ttl=float("inf"), max_chars=sys.maxsize)
+
+
+def soak(handle, store: ConversationStore, args) -> dict:
+    """发送args.messages条消息，返回内存和会话数的采样序列"""
+    rng = random.Random(args.seed)
+    next_user = args.active_users
+    active = list(range(args.active_users))
+    remaining = {user: rng.randint(1, 2 * args.messages_per_user) for user in active}
+    samples = []
+    start = time.perf_counter()
+
+    for i in range(1, args.messages + 1):
+        slot = rng.randrange(len(active))
+        user = active[slot]
+        handle(f"user-{user}", rng.choice(QUESTIONS))
+        remaining[user] -= 1
+        if remaining[user] <= 0:
+            # 用户离开，由新用户补上
+            del remaining[user]
+            active[slot] = next_user
+            remaining[next_user] = rng.randint(1, 2 * args.messages_per_user)
+            next_user += 1
+        if args.idle_seconds:
+            time.sleep(args.idle_seconds)
+        if i % args.sample_every == 0:
+            stats = store.stats()
+            samples.append({
+                "messages": i,
+                "elapsed_s": round(time.perf_counter() - start, 2),
+                "rss_mb": round(rss_mb() or 0, 1),
+                "sessions": stats["sessions"],
+                "turns": stats["turns"],
+            })
+            print(f"{i:>10}{samples[-1]['rss_mb']:>10}{stats['sessions']:>10}{stats['turns']:>10}")
+
+    half = samples[len(samples) // 2:]
+    growth = (half[-1]["rss_mb"] - half[0]["rss_mb"]) if len(half) > 1 else 0.0
+    return {
+        "samples": samples,
+        "users": next_user,
+        "rss_growth_second_half_mb": round(growth, 1),
+        "final": store.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["store", "bot"], default="store")
+    parser.add_argument("--modes", nargs="+", choices=["bounded", "unbounded"], default=["bounded", "unbounded"])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--active-users", type=int, default=500, help="同时活跃的用户数")
+    parser.add_argument("--messages-per-user", type=int, default=10, help="每个用户平均发送的消息数")
+    parser.add_argument("--history-turns", type=int, default=20)
+    parser.add_argument("--max-sessions", type=int, default=2000)
+    parser.add_argument("--ttl", type=float, default=1800)
+    parser.add_argument("--idle-seconds", type=float, default=0.0, help="每条消息之间的间隔")
+    parser.add_argument("--sample-every", type=int, default=10000)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="--target bot时用哈希向量代替SentenceTransformer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/chat-sessions-<commit>.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"chat-sessions-{git_commit() or 'local'}.json"))
+
+    bot = None
+    if args.target == "bot":
+        from benchmarks.fakes import LatencyProfile, install_fakes
+
+        os.environ["CHAT_CACHE_SIZE"] = "0"
+        for key in ("OPENAI_API_KEY", "OPENAI_BASE_URL"):
+            os.environ.setdefault(key, "bench")
+        os.environ.setdefault("LLM_MODELEND", "fake-chat")
+        install_fakes(LatencyProfile(ttft_ms=0, tokens_per_s=0), fake_embeddings=args.fake_embeddings)
+        workdir = tempfile.mkdtemp(prefix="bench_chat_sessions_")
+        os.chdir(workdir)
+        from chatbot import ChatbotWithRetrieval
+
+        bot = ChatbotWithRetrieval(os.path.join(ROOT, "docs"), index_dir=os.path.join(workdir, "doc_index"))
+
+    results = {}
+    for mode in args.modes:
+        store = make_store(mode, args)
+        if bot is not None:
+            bot.conversations = store
+            handle = lambda session_id, message: bot.get_response(message, session_id=session_id)  # noqa: E731
+        else:
+            handle = lambda session_id, message: store.append(session_id, message, ANSWER)  # noqa: E731
+        print(f"\n[{mode}]\n{'messages':>10}{'rss_mb':>10}{'sessions':>10}{'turns':>10}")
+        results[mode] = soak(handle, store, args)
+        print(f"后半段内存增长: {results[mode]['rss_growth_second_half_mb']}MB，共 {results[mode]['users']} 个用户")
+        store = handle = None
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "target": args.target,
+        "messages": args.messages,
+        "active_users": args.active_users,
+        "messages_per_user": args.messages_per_user,
+        "history_turns": args.history_turns,
+        "max_sessions": args.max_sessions,
+        "ttl": args.ttl,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
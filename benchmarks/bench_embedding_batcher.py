@@ -0,0 +1,63 @@
+"""微批处理嵌入的吞吐量基准
+
+在N个并发线程持续调用embed_query的情况下，对比直接调用模型与不同批处理时间窗口的QPS。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_embedding_batcher --threads 16 --requests 2000
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chatbot import SentenceBERTEmbeddings
+from tools.embedding_batcher import BatchingEmbeddings
+from tools.embedding_cache import EmbeddingCache
+
+
+def run(embeddings, threads: int, requests: int) -> float:
+    """并发执行requests次embed_query，返回QPS"""
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            # 每条查询文本都不同，避免命中向量缓存
+            embeddings.embed_query(f"易速鲜花的玫瑰花束配送问题 {i}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for _ in range(threads):
+            pool.submit(worker)
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--windows", type=float, nargs="+", default=[1, 2, 5, 10, 20])
+    args = parser.parse_args()
+
+    # 容量为0的缓存：每次都真正调用模型
+    model = SentenceBERTEmbeddings(cache=EmbeddingCache(max_entries=0))
+    model.embed_documents(["warm up"])
+
+    print(f"threads={args.threads} requests={args.requests}")
+    print(f"{'mode':<24}{'QPS':>10}{'avg batch':>12}")
+    print(f"{'direct':<24}{run(model, args.threads, args.requests):>10.1f}{1:>12}")
+    for window in args.windows:
+        batcher = BatchingEmbeddings(
+            model, max_batch_size=args.max_batch_size, max_wait_ms=window
+        )
+        qps = run(batcher, args.threads, args.requests)
+        print(f"{f'batched {window:g}ms':<24}{qps:>10.1f}{batcher.stats()['avg_batch_size']:>12}")
+
+
+if __name__ == "__main__":
+    main()
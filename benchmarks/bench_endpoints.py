@@ -0,0 +1,323 @@
+"""HTTP接口压测
+
+用本地的假LLM（可配置首token延迟分布和token速率）以及假的微博/SerpAPI接口替换外部依赖，
+在进程内启动Flask应用，以指定并发对每个接口发起请求，
+报告每个接口的p50/p95/p99延迟、吞吐量、流式接口的首字节时间(TTFB)和首个文本增量的时间(TTFT)以及进程内存，
+结果保存为JSON，便于在不同提交之间比较。
+
+应用在临时工作目录中运行（docs链接到项目的docs目录），数据库和文档索引都是全新的，不会影响开发数据。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_endpoints --concurrency 8 --requests 100
+    python -m benchmarks.bench_endpoints --endpoints chat inventory_analyze --llm-ttft-ms 500
+    python -m benchmarks.bench_endpoints --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import LatencyProfile, install_fakes  # noqa: E402
+from tools.model_registry import rss_mb  # noqa: E402
+
+PRODUCTS = ["玫瑰", "郁金香", "百合", "向日葵", "康乃馨"]
+QUESTIONS = ["配送范围有哪些城市？", "鲜花如何保鲜？", "可以开发票吗？", "订单多久能送达？"]
+CATEGORIES = ["鲜花", "数码", "美妆", "食品"]
+
+
+def _pick(options, i):
+    return options[i % len(options)]
+
+
+# 接口名 -> (方法, 路径, 请求参数生成函数, 是否为SSE流式接口)
+# 参数按请求序号轮换，每轮请求的内容固定，便于跨提交比较
+ENDPOINTS = {
+    "index": ("GET", "/", lambda i: {}, False),
+    "chat": ("POST", "/chat", lambda i: {"json": {"message": _pick(QUESTIONS, i)}}, False),
+    "chat_stream": ("POST", "/chat/stream", lambda i: {"json": {"message": _pick(QUESTIONS, i)}}, True),
+    "process": ("POST", "/process", lambda i: {"data": {"category": _pick(CATEGORIES, i)}}, False),
+    "marketing_generate": ("POST", "/marketing/generate", lambda i: {"json": {
+        "product": _pick(PRODUCTS, i), "target": "年轻白领", "goal": "提升七夕销量"}}, False),
+    "marketing_generate_stream": ("POST", "/marketing/generate/stream", lambda i: {"json": {
+        "product": _pick(PRODUCTS, i), "target": "年轻白领", "goal": "提升七夕销量"}}, True),
+    "marketing_refine": ("POST", "/marketing/refine", lambda i: {"json": {
+        "plan": f"{_pick(PRODUCTS, i)}七夕营销方案：社媒投放加门店活动", "feedback": "预算减少一半"}}, False),
+    "inventory_analyze": ("POST", "/inventory/analyze", lambda i: {"json": {
+        "product": _pick(PRODUCTS, i), "city": "上海", "bypass_cache": True}}, False),
+    "inventory_analyze_cached": ("POST", "/inventory/analyze", lambda i: {"json": {
+        "product": _pick(PRODUCTS, i), "city": "上海"}}, False),
+}
+
+
+def percentiles(values):
+    if not values:
+        return None
+    array = np.asarray(values) * 1000
+    return {
+        "p50": round(float(np.percentile(array, 50)), 2),
+        "p95": round(float(np.percentile(array, 95)), 2),
+        "p99": round(float(np.percentile(array, 99)), 2),
+        "mean": round(float(array.mean()), 2),
+        "max": round(float(array.max()), 2),
+    }
+
+
+def send(session, base_url, name, i):
+    """发送一次请求，返回(总耗时, 首字节时间, 首个文本增量的时间, 是否成功)
+
+    流式接口的首字节通常是start事件，首个delta事件才是用户看到回答开始出现的时间；非流式接口没有后者。
+    """
+    method, path, make_kwargs, stream = ENDPOINTS[name]
+    start = time.perf_counter()
+    response = session.request(method, base_url + path, stream=stream, timeout=600, **make_kwargs(i))
+    ttfb = ttft = None
+    ok = response.status_code < 400
+    if stream:
+        for chunk in response.iter_content(chunk_size=None):
+            if ttfb is None and chunk:
+                ttfb = time.perf_counter() - start
+            if ttft is None and b"event: delta" in chunk:
+                ttft = time.perf_counter() - start
+            # 流式接口以error事件报告失败
+            if b"event: error" in chunk:
+                ok = False
+    else:
+        body = response.content
+        ttfb = response.elapsed.total_seconds()
+        if ok and response.headers.get("Content-Type", "").startswith("application/json"):
+            data = json.loads(body)
+            ok = not (isinstance(data, dict) and data.get("error"))
+    return time.perf_counter() - start, ttfb, ttft, ok
+
+
+def run_endpoint(base_url, name, concurrency, total, warmup):
+    """闭环压测：concurrency个客户端线程循环发送请求，直到共完成total次"""
+    local = threading.local()
+    counter = iter(range(warmup + total))
+    counter_lock = threading.Lock()
+    latencies, ttfbs, ttfts, errors = [], [], [], 0
+    results_lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    for i in range(warmup):
+        send(session(), base_url, name, i)
+        next(counter)
+
+    def worker():
+        nonlocal errors
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            try:
+                elapsed, ttfb, ttft, ok = send(session(), base_url, name, i)
+            except (requests.RequestException, ValueError):
+                elapsed, ttfb, ttft, ok = None, None, None, False
+            with results_lock:
+                if ok:
+                    latencies.append(elapsed)
+                    if ttfb is not None:
+                        ttfbs.append(ttfb)
+                    if ttft is not None:
+                        ttfts.append(ttft)
+                else:
+                    errors += 1
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - start
+    rss_after = rss_mb()
+
+    result = {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency_ms": percentiles(latencies),
+        "rss_mb_before": round(rss_before, 1) if rss_before is not None else None,
+        "rss_mb_after": round(rss_after, 1) if rss_after is not None else None,
+    }
+    if ENDPOINTS[name][3]:
+        result["ttfb_ms"] = percentiles(ttfbs)
+        result["ttft_ms"] = percentiles(ttfts)
+    return result
+
+
+def tool_cache_calls():
+    """进程内库存分析工具的调用次数，按缓存结果(hit/miss/bypass)汇总"""
+    from config.metrics import TOOL_CALLS
+
+    calls = {}
+    for (_, cache), count in TOOL_CALLS.snapshot().items():
+        calls[cache] = calls.get(cache, 0) + int(count)
+    return calls
+
+
+def check_inventory_cache(base_url):
+    """连续发送两次相同的库存分析请求，第二次的分析工具调用应全部命中analysis_cache
+
+    返回检查结果；第一次请求可能已命中之前请求写入的缓存，只检查第二次。
+    """
+    body = {"json": {"product": "缓存检查", "city": "上海"}}
+    with requests.Session() as session:
+        session.post(base_url + "/inventory/analyze", timeout=600, **body)
+        before = tool_cache_calls()
+        session.post(base_url + "/inventory/analyze", timeout=600, **body)
+        after = tool_cache_calls()
+    delta = {key: after.get(key, 0) - before.get(key, 0) for key in ("hit", "miss", "bypass")}
+    return {**delta, "ok": delta["hit"] > 0 and delta["miss"] == 0 and delta["bypass"] == 0}
+
+
+def start_server():
+    """在临时工作目录中导入app并在后台线程启动多线程WSGI服务器，返回(base_url, server)"""
+    from werkzeug.serving import make_server
+
+    workdir = tempfile.mkdtemp(prefix="bench_endpoints_")
+    os.symlink(os.path.join(ROOT, "docs"), os.path.join(workdir, "docs"))
+    os.chdir(workdir)
+
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    """打印两次结果之间各接口的延迟与吞吐变化"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'endpoint':<28}{'metric':<16}{'old':>12}{'new':>12}{'change':>10}")
+    for name, result in new["results"].items():
+        base = old["results"].get(name)
+        if not base:
+            continue
+        rows = [("throughput_rps", base["throughput_rps"], result["throughput_rps"])]
+        for key in ("latency_ms", "ttfb_ms", "ttft_ms"):
+            if base.get(key) and result.get(key):
+                rows += [(f"{key[:-3]}_{p}", base[key][p], result[key][p]) for p in ("p50", "p95", "p99")]
+        for metric, before, after in rows:
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+            print(f"{name:<28}{metric:<16}{before:>12}{after:>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50, help="每个接口的请求数")
+    parser.add_argument("--warmup", type=int, default=2, help="每个接口正式计时前的预热请求数")
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0, help="假LLM首token延迟的中位数")
+    parser.add_argument("--llm-ttft-sigma", type=float, default=0.5, help="首token延迟对数正态分布的sigma")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=50.0, help="假LLM的输出速率")
+    parser.add_argument("--llm-output-tokens", type=int, default=200, help="假LLM每次回答的token数")
+    parser.add_argument("--http-latency-ms", type=float, default=100.0, help="假微博/SerpAPI接口的延迟")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="用哈希向量代替SentenceTransformer（无法下载模型时使用）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/endpoints-<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="比较两次结果后退出")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # 应用在临时目录中运行，先把输出路径转换为绝对路径
+    output = os.path.abspath(args.output or os.path.join(ROOT, "benchmarks", "results", "endpoints.json"))
+    latency = LatencyProfile(args.llm_ttft_ms, args.llm_ttft_sigma, args.llm_tokens_per_s,
+                             args.llm_output_tokens, seed=args.seed)
+    for key in ("SERPAPI_API_KEY", "OPENAI_API_KEY", "OPENAI_BASE_URL"):
+        os.environ.setdefault(key, "bench")
+    os.environ.setdefault("LLM_MODELEND", "fake-chat")
+    install_fakes(latency, args.http_latency_ms, args.fake_embeddings)
+
+    startup = time.perf_counter()
+    base_url, server = start_server()
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "startup_s": round(time.perf_counter() - startup, 2),
+        "startup_rss_mb": round(rss_mb() or 0, 1),
+        "fake_llm": latency.to_dict(),
+        "http_latency_ms": args.http_latency_ms,
+        "fake_embeddings": args.fake_embeddings,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+    }
+
+    results = {}
+    cache_check = None
+    if any(name.startswith("inventory_analyze") for name in args.endpoints):
+        cache_check = meta["inventory_cache_check"] = check_inventory_cache(base_url)
+        print(f"库存分析缓存检查: {'通过' if cache_check['ok'] else '失败'} {cache_check}\n")
+
+    print(f"{'endpoint':<28}{'rps':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'ttfb50':>10}{'ttft50':>10}"
+          f"{'errors':>8}{'rss':>8}")
+    try:
+        for name in args.endpoints:
+            calls_before = tool_cache_calls()
+            result = run_endpoint(base_url, name, args.concurrency, args.requests, args.warmup)
+            if name.startswith("inventory_analyze"):
+                calls_after = tool_cache_calls()
+                result["tool_calls"] = {key: calls_after[key] - calls_before.get(key, 0) for key in calls_after}
+            results[name] = result
+            latency_ms = result["latency_ms"] or {}
+            ttfb = (result.get("ttfb_ms") or {}).get("p50", "-")
+            ttft = (result.get("ttft_ms") or {}).get("p50", "-")
+            print(f"{name:<28}{result['throughput_rps']:>8}{latency_ms.get('p50', '-'):>10}"
+                  f"{latency_ms.get('p95', '-'):>10}{latency_ms.get('p99', '-'):>10}{ttfb:>10}{ttft:>10}"
+                  f"{result['errors']:>8}{result['rss_mb_after'] or '-':>8}")
+    finally:
+        server.shutdown()
+
+    if not args.output:
+        output = output.replace("endpoints.json", f"endpoints-{meta['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+    if cache_check and not cache_check["ok"]:
+        sys.exit("相同的库存分析请求没有命中analysis_cache")
+
+
+if __name__ == "__main__":
+    main()
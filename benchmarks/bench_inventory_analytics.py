@@ -0,0 +1,95 @@
+"""库存分析查询基准
+
+对比两种实现回答同样的分析问题：
+- python：读出所有记录，在Python中json.loads后过滤、分组（改造前的唯一做法）
+- sql：InventoryDB.aggregate，把过滤、分组和聚合下推到SQLite的结构化列和索引
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_inventory_analytics --rows 1000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from data.populate_inventory import populate
+from database.db import InventoryDB
+
+
+def scan_rows(db):
+    with db.pool.connection() as conn:
+        yield from conn.execute("SELECT product, factors, logistics FROM inventory_records")
+
+
+def python_avg_cost_by_warehouse(db):
+    totals = defaultdict(lambda: [0.0, 0])
+    for _, _, logistics in scan_rows(db):
+        data = json.loads(logistics)
+        total = totals[data["仓库"]]
+        total[0] += data["成本"]
+        total[1] += 1
+    return {warehouse: total / count for warehouse, (total, count) in sorted(totals.items())}
+
+
+def sql_avg_cost_by_warehouse(db):
+    rows = db.aggregate("shipping_cost", "avg", group_by="warehouse")
+    return {row["warehouse"]: row["value"] for row in rows}
+
+
+def python_high_demand_flowers(db):
+    count = 0
+    for product, factors, _ in scan_rows(db):
+        if product.split("-")[1] == "花卉" and json.loads(factors)["需求"] > 300:
+            count += 1
+    return count
+
+
+def sql_high_demand_flowers(db):
+    return db.aggregate(func="count", filters={"category": "花卉", "demand__gt": 300})[0]["value"]
+
+
+QUERIES = [
+    ("avg 成本 by 仓库", python_avg_cost_by_warehouse, sql_avg_cost_by_warehouse),
+    ("count 花卉 需求>300", python_high_demand_flowers, sql_high_demand_flowers),
+]
+
+
+def timed(fn, db, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(db)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3, help="每个查询重复次数，取最快一次")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1, help="生成测试数据的进程数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = InventoryDB(os.path.join(tmp, "inventory.db"))
+        start = time.perf_counter()
+        populate(db, args.rows, seed=args.seed, workers=args.workers)
+        print(f"写入 {args.rows} 条记录，耗时 {time.perf_counter() - start:.1f}s\n")
+
+        print(f"{'query':<22}{'python(s)':>12}{'sql(s)':>12}{'speedup':>10}")
+        for name, python_fn, sql_fn in QUERIES:
+            python_time, expected = timed(python_fn, db, args.repeat)
+            sql_time, actual = timed(sql_fn, db, args.repeat)
+            if isinstance(expected, dict):
+                assert expected.keys() == actual.keys()
+                assert all(abs(expected[k] - actual[k]) < 1e-6 for k in expected)
+            else:
+                assert expected == actual
+            print(f"{name:<22}{python_time:>12.3f}{sql_time:>12.3f}{python_time / sql_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
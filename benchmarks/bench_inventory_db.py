@@ -0,0 +1,114 @@
+"""InventoryDB并发读写基准
+
+对比改造前（每次调用新建连接、默认journal模式）与连接池+WAL的实现，
+在N个并发线程下测量单条插入、批量插入和查询的吞吐量。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_inventory_db --threads 1 4 8 --ops 500
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database.db import InventoryDB
+
+
+class LegacyInventoryDB:
+    """改造前的实现：每个方法都新建并关闭连接"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS inventory_records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    product TEXT NOT NULL,
+                    factors TEXT NOT NULL,
+                    strategy TEXT NOT NULL,
+                    logistics TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_product ON inventory_records(product)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON inventory_records(timestamp)")
+
+    def add_record(self, record_data):
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            conn.execute("""
+                INSERT INTO inventory_records
+                (timestamp, product, factors, strategy, logistics)
+                VALUES (?, ?, ?, ?, ?)
+            """, (
+                record_data.get("timestamp", datetime.now().isoformat()),
+                record_data["product"],
+                json.dumps(record_data.get("factors", {}), ensure_ascii=False),
+                record_data.get("strategy", ""),
+                record_data.get("logistics", "默认物流方案")
+            ))
+
+    def get_recent_records(self, limit=5):
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            return conn.execute("""
+                SELECT * FROM inventory_records
+                ORDER BY timestamp DESC
+                LIMIT ?
+            """, (limit,)).fetchall()
+
+
+def make_record(i):
+    return {
+        "product": f"玫瑰-花卉-{'ABCDE'[i % 5]}",
+        "factors": {"需求": i % 500, "成本": 42.0},
+        "strategy": "竞争定价",
+        "logistics": "北京仓 陆运"
+    }
+
+
+def run_concurrent(threads, ops, fn):
+    """threads个线程各执行ops次fn，返回每秒操作数"""
+    def worker(t):
+        for i in range(ops):
+            fn(t * ops + i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    return threads * ops / (time.perf_counter() - start)
+
+
+def bench(name, db, threads, ops):
+    inserts = run_concurrent(threads, ops, lambda i: db.add_record(make_record(i)))
+    reads = run_concurrent(threads, ops, lambda i: db.get_recent_records(5))
+    print(f"{name:<10}{threads:>8}{inserts:>14.0f}{reads:>14.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--ops", type=int, default=500, help="每个线程的操作次数")
+    args = parser.parse_args()
+
+    print(f"{'impl':<10}{'threads':>8}{'inserts/s':>14}{'reads/s':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for threads in args.threads:
+            legacy = LegacyInventoryDB(os.path.join(tmp, f"legacy_{threads}.db"))
+            bench("legacy", legacy, threads, args.ops)
+            pooled = InventoryDB(os.path.join(tmp, f"pooled_{threads}.db"))
+            bench("pooled", pooled, threads, args.ops)
+
+            # 显式事务批量写入：单线程写入同样多的记录，合并为一次提交
+            start = time.perf_counter()
+            with pooled.transaction():
+                for i in range(args.ops * threads):
+                    pooled.add_record(make_record(i))
+            rate = args.ops * threads / (time.perf_counter() - start)
+            print(f"{'batched':<10}{1:>8}{rate:>14.0f}{'-':>14}")
+
+
+if __name__ == "__main__":
+    main()
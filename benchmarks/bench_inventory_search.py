@@ -0,0 +1,68 @@
+"""库存记录检索延迟基准
+
+对比改造前的 product LIKE '%query%' 查询与基于FTS5全文索引的 InventoryDB.search_records，
+在不同数据量下测量每个查询的平均延迟。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_inventory_search --rows 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from data.populate_inventory import populate
+from database.db import InventoryDB
+
+# (说明, 查询词)：覆盖高频词、较少见的词、跨字段组合和无结果的查询
+QUERIES = [
+    ("common product", "玫瑰"),
+    ("rare product", "康乃馨-花卉-E"),
+    ("product + logistics", "向日葵 成都"),
+    ("strategy only", "溢价 社媒"),
+    ("no match", "不存在的商品"),
+]
+
+
+def legacy_search(db, query, limit=3):
+    """改造前的实现：只匹配产品名，LIKE无法使用idx_product"""
+    with db.pool.connection() as conn:
+        return conn.execute("""
+            SELECT * FROM inventory_records
+            WHERE product LIKE ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        """, (f"%{query}%", limit)).fetchall()
+
+
+def mean_latency_ms(fn, repeat):
+    fn()  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=1, help="生成测试数据的进程数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            db = InventoryDB(os.path.join(tmp, f"inventory_{rows}.db"))
+            start = time.perf_counter()
+            populate(db, rows, seed=args.seed, workers=args.workers)
+            print(f"\n{rows} 条记录（写入耗时 {time.perf_counter() - start:.1f}s）")
+            print(f"{'query':<22}{'like(ms)':>10}{'hits':>6}{'fts(ms)':>10}{'hits':>6}")
+            for name, query in QUERIES:
+                like_ms, like_hits = mean_latency_ms(lambda: legacy_search(db, query), args.repeat)
+                fts_ms, fts_hits = mean_latency_ms(lambda: db.search_records(query), args.repeat)
+                print(f"{name:<22}{like_ms:>10.2f}{like_hits:>6}{fts_ms:>10.2f}{fts_hits:>6}")
+
+
+if __name__ == "__main__":
+    main()
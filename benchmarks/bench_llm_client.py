@@ -0,0 +1,234 @@
+"""LLM客户端的连接复用与限流压测
+
+在本地启动一个OpenAI兼容的假LLM服务（/v1/chat/completions，延迟分布与benchmarks/fakes.py相同），
+统计服务端接受的TCP连接数，对比两种客户端用法：
+- per_call：每次调用新建ChatOpenAI（改造前textgen_tool等组件的做法），每个实例有自己的连接池；
+- shared：通过tools.llm_client.get_chat_model获取共享实例，复用keep-alive连接。
+
+--server-capacity可以让假服务在并发超过容量时返回429（带Retry-After），
+用于观察共享客户端的并发上限和退避重试是否能避免请求失败。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_llm_client --requests 200 --concurrency 16
+    python -m benchmarks.bench_llm_client --server-capacity 8 --concurrency 32
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import fakes  # noqa: E402
+from benchmarks.bench_endpoints import git_commit, percentiles  # noqa: E402
+from benchmarks.fakes import LatencyProfile  # noqa: E402
+
+MODEL = "fake-chat"
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """OpenAI兼容的假LLM服务，记录接受的连接数、请求数和返回的429数"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, capacity: int = 0):
+        super().__init__(("127.0.0.1", 0), FakeLLMHandler)
+        self.capacity = capacity
+        self.connections = 0
+        self.requests = 0
+        self.rejected = 0
+        self.inflight = 0
+        self.lock = threading.Lock()
+
+    def reset_stats(self):
+        with self.lock:
+            self.connections = self.requests = self.rejected = 0
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            if server.capacity and server.inflight >= server.capacity:
+                server.rejected += 1
+                rejected = True
+            else:
+                server.inflight += 1
+                rejected = False
+        if rejected:
+            self._send_json(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit"}},
+                            {"Retry-After": "0.2"})
+            return
+
+        try:
+            prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+            text = fakes.respond(prompt)
+            tokens = len(fakes.tokenize(text))
+            time.sleep(fakes.profile.sample_ttft() + tokens * fakes.profile.token_interval())
+        finally:
+            with server.lock:
+                server.inflight -= 1
+        self._send_json(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", MODEL),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 2,
+                "completion_tokens": tokens,
+                "total_tokens": len(prompt) // 2 + tokens,
+            },
+        })
+
+
+def make_per_call_model():
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model=MODEL, temperature=0)
+
+
+def make_shared_model():
+    from tools.llm_client import get_chat_model
+
+    return get_chat_model("bench", temperature=0, model=MODEL)
+
+
+CLIENTS = {
+    "per_call": make_per_call_model,
+    "shared": make_shared_model,
+}
+
+
+def run_client(server: FakeLLMServer, name: str, concurrency: int, total: int) -> dict:
+    """concurrency个线程共发送total次调用，每次调用前按对应用法获取ChatOpenAI"""
+    make_model = CLIENTS[name]
+    latencies, setups, errors = [], [], 0
+    lock = threading.Lock()
+
+    def call(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            model = make_model()
+            setup = time.perf_counter() - start
+            model.invoke(f"请为第{i}位客户推荐花束")
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            setups.append(setup)
+            latencies.append(time.perf_counter() - start)
+
+    server.reset_stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(total)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency_ms": percentiles(latencies),
+        "client_setup_ms": percentiles(setups),
+        "server_connections": server.connections,
+        "server_requests": server.requests,
+        "server_429": server.rejected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", nargs="+", choices=list(CLIENTS), default=list(CLIENTS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--server-capacity", type=int, default=0, help="假服务的并发容量，超出时返回429；0为不限")
+    parser.add_argument("--llm-ttft-ms", type=float, default=50.0)
+    parser.add_argument("--llm-ttft-sigma", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=0.0, help="0表示不模拟逐token输出耗时")
+    parser.add_argument("--llm-output-tokens", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/llm-client-<commit>.json")
+    args = parser.parse_args()
+
+    fakes.profile = LatencyProfile(args.llm_ttft_ms, args.llm_ttft_sigma, args.llm_tokens_per_s,
+                                   args.llm_output_tokens, seed=args.seed)
+    server = FakeLLMServer(args.server_capacity)
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["LLM_MODELEND"] = MODEL
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_llm": fakes.profile.to_dict(),
+        "server_capacity": args.server_capacity,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+    }
+
+    results = {}
+    print(f"{'client':<10}{'rps':>8}{'p50':>10}{'p99':>10}{'setup50':>10}{'conns':>8}{'429s':>7}{'errors':>8}")
+    try:
+        for name in args.clients:
+            result = run_client(server, name, args.concurrency, args.requests)
+            results[name] = result
+            latency_ms = result["latency_ms"] or {}
+            setup_ms = result["client_setup_ms"] or {}
+            print(f"{name:<10}{result['throughput_rps']:>8}{latency_ms.get('p50', '-'):>10}"
+                  f"{latency_ms.get('p99', '-'):>10}{setup_ms.get('p50', '-'):>10}"
+                  f"{result['server_connections']:>8}{result['server_429']:>7}{result['errors']:>8}")
+    finally:
+        server.shutdown()
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results",
+                                         f"llm-client-{meta['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
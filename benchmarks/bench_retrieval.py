@@ -0,0 +1,185 @@
+"""客服文档检索的离线评估
+
+在临时目录中用指定的嵌入模型为docs目录构建文档索引，对带标注的问题集分别用向量检索、BM25、
+混合检索（倒数排名融合）以及可选的交叉编码器重排检索，报告recall@k、MRR和检索延迟，结果保存为JSON。
+
+相关性按分块是否包含标注的关键词判断（忽略空白），分块方式改变后标注依然有效；
+recall@k为前k个结果中至少有一个相关分块的问题比例。没有任何分块包含关键词的问题（关键词被切分到两个分块中）不计入。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_retrieval
+    python -m benchmarks.bench_retrieval --models all-MiniLM-L6-v2 BAAI/bge-small-zh-v1.5 \\
+        --rerank-model BAAI/bge-reranker-base
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.bench_endpoints import git_commit, percentiles  # noqa: E402
+
+# (问题, 相关分块包含的关键词)，覆盖员工手册、运营指南和花语大全
+EVAL_SET = [
+    ("迟到10分钟以内扣多少钱？", ["扣款20元"]),
+    ("上班迟到半小时以上怎么处理？", ["按旷工一天计"]),
+    ("忘记打卡怎么办？", ["补刷卡申请"]),
+    ("公司的上班时间是几点到几点？", ["9:00--12:00"]),
+    ("一个月最多可以请几天事假？", ["最多不得超过10天"]),
+    ("病假期间工资怎么发？", ["基本工资的80%"]),
+    ("员工结婚可以休几天婚假？", ["3天婚假"]),
+    ("女员工产假有多少天？", ["90天产假"]),
+    ("工作满三年有几天年休假？", ["年休假5天"]),
+    ("直系亲属去世可以请丧假吗？", ["丧假3天"]),
+    ("部门经理可以批准员工几天假期？", ["员工3天假期"]),
+    ("试用期员工辞职要提前几天申请？", ["提前三天"]),
+    ("正式员工辞职需要提前多久提出？", ["提前三十天"]),
+    ("新员工入职需要提供哪些资料？", ["入职申请表"]),
+    ("员工和顾客吵架会被罚多少钱？", ["罚款50"]),
+    ("加班需要填写什么单子？", ["加班申请单"]),
+    ("女员工头发有什么要求？", ["头发长度不可过肩"]),
+    ("工作时对鞋子有什么要求？", ["黑色制式皮鞋"]),
+    ("接电话时应该怎么说？", ["请问您找谁"]),
+    ("发现火警应该拨打什么电话？", ["119"]),
+    ("奖励的加分每分折合多少钱？", ["每分5元"]),
+    ("连续旷工三天会怎么处理？", ["连续旷工三日"]),
+    ("偷盗公司财物会受到什么处分？", ["偷盗公司"]),
+    ("网站的盈利来源有哪些？", ["加盟费"]),
+    ("推广阶段预期达到多少注册用户？", ["100万的注册用户"]),
+    ("网站开发阶段需要多长时间？", ["三个月内完全开发完毕"]),
+    ("网站从开发到盈利需要多少投资？", ["200万的投资"]),
+    ("融资方案以什么资金为主？", ["种子资金为主"]),
+    ("向日葵的花语是什么？", ["Sunflower"]),
+    ("康乃馨代表什么？", ["Carnation"]),
+    ("What does lavender symbolize?", ["Lavender"]),
+    ("Which flower means eternal love?", ["EternalLove"]),
+]
+
+
+def _compact(text: str) -> str:
+    return re.sub(r"\s+", "", text)
+
+
+def relevant_chunks(chunks, keywords) -> set:
+    keywords = [_compact(keyword) for keyword in keywords]
+    return {i for i, chunk in enumerate(chunks) if any(k in _compact(chunk["text"]) for k in keywords)}
+
+
+def evaluate(retriever, queries, ks, repeat: int) -> dict:
+    """queries为(问题, 查询向量, 相关分块集合)，返回recall@k、MRR和检索延迟"""
+    hits = {k: 0 for k in ks}
+    reciprocal_ranks, latencies = [], []
+    for question, vector, relevant in queries:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ids = retriever.search_ids(question, vector, k=max(ks))
+            latencies.append(time.perf_counter() - start)
+        rank = next((r for r, i in enumerate(ids, 1) if i in relevant), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        for k in ks:
+            hits[k] += rank is not None and rank <= k
+
+    result = {f"recall@{k}": round(hits[k] / len(queries), 4) for k in ks}
+    result["mrr"] = round(sum(reciprocal_ranks) / len(queries), 4)
+    result["latency_ms"] = percentiles(latencies)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["all-MiniLM-L6-v2"], help="要比较的嵌入模型")
+    parser.add_argument("--rerank-model", help="交叉编码器模型，设置后增加hybrid+rerank模式")
+    parser.add_argument("--candidates", type=int, default=20, help="每一路召回和重排的候选分块数")
+    parser.add_argument("--k", nargs="+", type=int, default=[1, 3, 5])
+    parser.add_argument("--repeat", type=int, default=5, help="每个问题检索的次数（用于统计延迟）")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="用哈希向量代替SentenceTransformer（此时只有BM25的结果有意义）")
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/retrieval-<commit>.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"retrieval-{git_commit() or 'local'}.json"))
+    if args.fake_embeddings:
+        from benchmarks.fakes import LatencyProfile, install_fakes
+
+        for key in ("OPENAI_API_KEY", "OPENAI_BASE_URL"):
+            os.environ.setdefault(key, "bench")
+        install_fakes(LatencyProfile(ttft_ms=0, tokens_per_s=0), fake_embeddings=True)
+
+    # 在临时目录中运行，向量缓存和文档索引都是全新的，编码耗时不受已有缓存影响
+    workdir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    os.chdir(workdir)
+    from chatbot import SentenceBERTEmbeddings
+    from tools.doc_index import DocumentIndex
+    from tools.hybrid_retriever import HybridRetriever
+
+    modes = [("dense", {"mode": "dense"}), ("sparse", {"mode": "sparse"}), ("hybrid", {"mode": "hybrid"})]
+    if args.rerank_model:
+        modes.append(("hybrid+rerank", {"mode": "hybrid", "rerank_model": args.rerank_model}))
+
+    results = {}
+    print(f"{'model':<40}{'mode':<15}" + "".join(f"{f'R@{k}':>8}" for k in args.k)
+          + f"{'MRR':>8}{'p50_ms':>10}{'p95_ms':>10}")
+    for model in args.models:
+        embeddings = SentenceBERTEmbeddings(model)
+        start = time.perf_counter()
+        doc_index = DocumentIndex(os.path.join(ROOT, "docs"), embeddings,
+                                  index_dir=os.path.join(workdir, "doc_index", model.replace("/", "_"))).sync()
+        build_s = time.perf_counter() - start
+
+        queries, skipped, encode = [], [], []
+        for question, keywords in EVAL_SET:
+            relevant = relevant_chunks(doc_index.chunks, keywords)
+            if not relevant:
+                skipped.append(question)
+                continue
+            start = time.perf_counter()
+            vector = embeddings.embed_query(question)
+            encode.append(time.perf_counter() - start)
+            queries.append((question, vector, relevant))
+        if skipped:
+            print(f"{model}: {len(skipped)} 个问题没有包含关键词的分块，不计入: {skipped}")
+
+        results[model] = {
+            "chunks": len(doc_index.chunks),
+            "index_build_s": round(build_s, 2),
+            "queries": len(queries),
+            "skipped": skipped,
+            "query_encode_ms": percentiles(encode),
+            "modes": {},
+        }
+        for name, options in modes:
+            retriever = HybridRetriever.from_index(doc_index, candidates=args.candidates, **options)
+            result = evaluate(retriever, queries, args.k, args.repeat)
+            results[model]["modes"][name] = result
+            latency_ms = result["latency_ms"] or {}
+            print(f"{model:<40}{name:<15}" + "".join(f"{result[f'recall@{k}']:>8}" for k in args.k)
+                  + f"{result['mrr']:>8}{latency_ms.get('p50', '-'):>10}{latency_ms.get('p95', '-'):>10}")
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_embeddings": args.fake_embeddings,
+        "rerank_model": args.rerank_model,
+        "candidates": args.candidates,
+        "eval_queries": len(EVAL_SET),
+        "repeat": args.repeat,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""客服问题分流压测
+
+用假LLM在临时工作目录中构建ChatbotWithRetrieval（关闭语义答案缓存），
+对一组带标注的问题（单跳文档问答、纯计算、多步问题）分别在开启和关闭分流时各回答一遍，
+报告分流准确率、每个请求的LLM调用次数和延迟，结果保存为JSON。
+
+注意：--fake-embeddings的哈希向量没有语义，此时只有规则能正确分流，按示例分流的准确率需要真实的嵌入模型。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_router
+    python -m benchmarks.bench_router --llm-ttft-ms 500 --repeat 3
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.bench_endpoints import git_commit, percentiles  # noqa: E402
+from benchmarks.fakes import LatencyProfile, install_fakes  # noqa: E402
+
+# (问题, 期望的路由)，与tools/query_router.py中的示例不重复
+LABELLED_QUERIES = [
+    ("向日葵的花语是什么？", "rag"),
+    ("节假日配送会延迟吗？", "rag"),
+    ("会员积分怎么使用？", "rag"),
+    ("可以指定配送时间吗？", "rag"),
+    ("花束可以加贺卡吗？", "rag"),
+    ("企业订花有折扣吗？", "rag"),
+    ("百合花需要每天换水吗？", "rag"),
+    ("员工迟到会怎么处理？", "rag"),
+    # 含"比较""方案""先生…再"但只需一次检索的问题，不应被规则分到plan
+    ("生日送什么花比较好？", "rag"),
+    ("哪种花比较便宜？", "rag"),
+    ("玫瑰和百合比较好养吗？", "rag"),
+    ("配送方案有哪些？", "rag"),
+    ("先生订的花可以再改配送地址吗？", "rag"),
+    ("12*8+5等于多少", "math"),
+    ("99×3", "math"),
+    ("5束百合每束68元一共多少钱？", "math"),
+    ("300元打九折是多少钱？", "math"),
+    ("一个月30天每天卖出25束，一共卖多少束？", "math"),
+    ("比较向日葵和郁金香哪个更适合送老师，并说明理由", "plan"),
+    ("帮我规划一个婚礼用花方案，预算5000元", "plan"),
+    ("先查一下退换货政策，再告诉我运费怎么算", "plan"),
+    ("分别介绍玫瑰和康乃馨的花语，然后推荐适合母亲节的花束", "plan"),
+    ("对比上海和北京的配送时效", "plan"),
+    ("比较一下玫瑰与百合的保鲜期", "plan"),
+    ("帮我设计一个公司年会的鲜花布置方案", "plan"),
+]
+
+
+def llm_calls() -> float:
+    """当前进程中chatbot组件累计的LLM调用次数"""
+    from config.metrics import LLM_REQUESTS
+
+    return sum(value for key, value in LLM_REQUESTS.snapshot().items() if key[0] == "chatbot")
+
+
+def run_mode(bot, repeat: int) -> dict:
+    """回答全部标注问题repeat遍，按分流器选择的路由汇总LLM调用次数和延迟"""
+    per_route = {}
+    all_calls, all_latencies = [], []
+    for _ in range(repeat):
+        for question, _label in LABELLED_QUERIES:
+            calls_before = llm_calls()
+            start = time.perf_counter()
+            bot.get_response(question)
+            elapsed = time.perf_counter() - start
+            calls = llm_calls() - calls_before
+            route = bot.router.route(question) if bot.router.enabled else "plan"
+            stats = per_route.setdefault(route, {"calls": [], "latencies": []})
+            stats["calls"].append(calls)
+            stats["latencies"].append(elapsed)
+            all_calls.append(calls)
+            all_latencies.append(elapsed)
+
+    return {
+        "requests": len(all_calls),
+        "llm_calls_per_request": round(sum(all_calls) / len(all_calls), 2),
+        "latency_ms": percentiles(all_latencies),
+        "routes": {
+            route: {
+                "requests": len(stats["calls"]),
+                "llm_calls_per_request": round(sum(stats["calls"]) / len(stats["calls"]), 2),
+                "latency_ms": percentiles(stats["latencies"]),
+            }
+            for route, stats in per_route.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1, help="每个问题回答的遍数")
+    parser.add_argument("--llm-ttft-ms", type=float, default=300.0)
+    parser.add_argument("--llm-ttft-sigma", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=50.0)
+    parser.add_argument("--llm-output-tokens", type=int, default=200)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="用哈希向量代替SentenceTransformer（无法下载模型时使用）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/router-<commit>.json")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or os.path.join(
+        ROOT, "benchmarks", "results", f"router-{git_commit() or 'local'}.json"))
+    os.environ["CHAT_CACHE_SIZE"] = "0"  # 关闭语义答案缓存，每个请求都实际回答
+    for key in ("OPENAI_API_KEY", "OPENAI_BASE_URL"):
+        os.environ.setdefault(key, "bench")
+    os.environ.setdefault("LLM_MODELEND", "fake-chat")
+    latency = LatencyProfile(args.llm_ttft_ms, args.llm_ttft_sigma, args.llm_tokens_per_s,
+                             args.llm_output_tokens, seed=args.seed)
+    install_fakes(latency, fake_embeddings=args.fake_embeddings)
+
+    workdir = tempfile.mkdtemp(prefix="bench_router_")
+    os.chdir(workdir)
+    from chatbot import ChatbotWithRetrieval
+
+    bot = ChatbotWithRetrieval(os.path.join(ROOT, "docs"), index_dir=os.path.join(workdir, "doc_index"))
+
+    predicted = [(bot.router.route(question), label) for question, label in LABELLED_QUERIES]
+    confusion = Counter(f"{label}->{route}" for route, label in predicted)
+    accuracy = sum(route == label for route, label in predicted) / len(predicted)
+
+    results = {"routing": {"accuracy": round(accuracy, 4), "confusion": dict(confusion)}}
+    for mode, enabled in (("router", True), ("plan_only", False)):
+        bot.router.enabled = enabled
+        results[mode] = run_mode(bot, args.repeat)
+
+    print(f"分流准确率: {accuracy:.1%}  {dict(confusion)}")
+    print(f"{'mode':<12}{'route':<8}{'requests':>10}{'llm/req':>10}{'p50':>10}{'p95':>10}")
+    for mode in ("router", "plan_only"):
+        result = results[mode]
+        rows = [("all", result)] + sorted(result["routes"].items())
+        for route, stats in rows:
+            latency_ms = stats["latency_ms"] or {}
+            print(f"{mode:<12}{route:<8}{stats['requests']:>10}{stats['llm_calls_per_request']:>10}"
+                  f"{latency_ms.get('p50', '-'):>10}{latency_ms.get('p95', '-'):>10}")
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_llm": latency.to_dict(),
+        "fake_embeddings": args.fake_embeddings,
+        "queries": len(LABELLED_QUERIES),
+        "repeat": args.repeat,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
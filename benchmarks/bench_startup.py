@@ -0,0 +1,79 @@
+"""组件启动耗时与内存基准
+
+对比两种方式加载嵌入模型的耗时和常驻内存：
+- 各组件各自实例化SentenceTransformer（改造前的方式）
+- 通过模型注册表共享同一份模型
+然后依次初始化app.py中的各个组件，报告每个组件的启动耗时和内存增量。
+两种模型加载方式分别在独立的子进程中测量，互不影响。
+
+用法（在项目根目录执行，需要配置LLM_MODELEND等环境变量）：
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from tools.model_registry import rss_mb
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+def measure(label, factory, report):
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    factory()
+    report.append({
+        "step": label,
+        "seconds": round(time.perf_counter() - start, 3),
+        "rss_delta_mb": round(rss_mb() - rss_before, 1),
+    })
+
+
+def run_mode(mode):
+    """在当前进程中执行一种加载方式，结果以JSON输出"""
+    report = []
+    if mode == "separate":
+        from sentence_transformers import SentenceTransformer
+
+        measure("chatbot model", lambda: SentenceTransformer(MODEL_NAME), report)
+        measure("inventory model", lambda: SentenceTransformer(MODEL_NAME), report)
+    elif mode == "shared":
+        from tools.model_registry import get_sentence_model
+
+        measure("chatbot model", lambda: get_sentence_model(MODEL_NAME), report)
+        measure("inventory model", lambda: get_sentence_model(MODEL_NAME), report)
+    else:
+        from chatbot import ChatbotWithRetrieval
+        from agents.marketing_agent import MarketingAgent
+        from agents.inventory_agent import InventoryAGI
+
+        measure("ChatbotWithRetrieval", lambda: ChatbotWithRetrieval("docs"), report)
+        measure("MarketingAgent", MarketingAgent, report)
+        measure("InventoryAGI", InventoryAGI.create_default_agent, report)
+    report.append({"step": "total", "rss_mb": round(rss_mb(), 1)})
+    print(json.dumps(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", choices=["separate", "shared", "components"])
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode)
+        return
+
+    for mode in ["separate", "shared", "components"]:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_startup", "--mode", mode],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        print(f"\n=== {mode} ===")
+        for row in json.loads(output.strip().splitlines()[-1]):
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
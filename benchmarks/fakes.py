@@ -0,0 +1,255 @@
+"""基准测试使用的本地替身：不访问任何外部服务
+
+- FakeChatModel：替代ChatOpenAI，输出由提示词确定（同一提示词总是得到同一回答），
+  首token延迟服从对数正态分布，之后按固定的token速率输出，支持流式和异步调用
+- fake_get_UID / fake_get_data：替代SerpAPI搜索和微博资料接口
+- FakeSentenceModel：可选，替代SentenceTransformer，按文本哈希生成确定的向量
+
+必须在导入app、chatbot、agents等模块之前调用install_fakes()，
+这些模块在导入时就绑定了ChatOpenAI等名字。
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import (
+    BaseChatModel,
+    agenerate_from_stream,
+    generate_from_stream,
+)
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict, Field
+
+FAKE_UID = "1669879400"
+
+
+class LatencyProfile:
+    """LLM延迟模型：首token延迟~LogNormal(ln(ttft_ms), sigma)，其后每个token耗时1/tokens_per_s秒"""
+
+    def __init__(self, ttft_ms: float = 300.0, sigma: float = 0.5, tokens_per_s: float = 50.0,
+                 output_tokens: int = 200, seed: int = 0):
+        self.ttft_ms = ttft_ms
+        self.sigma = sigma
+        self.tokens_per_s = tokens_per_s
+        self.output_tokens = output_tokens
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_ttft(self) -> float:
+        """采样一次首token延迟（秒）"""
+        if self.ttft_ms <= 0:
+            return 0.0
+        with self._lock:
+            return self._rng.lognormvariate(np.log(self.ttft_ms), self.sigma) / 1000
+
+    def token_interval(self) -> float:
+        return 1 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "ttft_ms": self.ttft_ms,
+            "sigma": self.sigma,
+            "tokens_per_s": self.tokens_per_s,
+            "output_tokens": self.output_tokens,
+        }
+
+
+# 当前生效的延迟模型，由install_fakes设置
+profile = LatencyProfile()
+http_latency_ms = 100.0
+
+_FILLER = (
+    "根据当前的市场数据和历史销售情况，建议在旺季前适当增加库存，"
+    "同时结合社交媒体热度调整营销投放节奏，重点关注华东和华南地区的物流时效。"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """把回答切分为"token"：每两个字符计为一个token"""
+    return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+
+def _filler(prompt: str, tokens: int) -> str:
+    """与提示词绑定的确定性回答"""
+    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+    text = f"分析编号{digest}：" + _FILLER * (tokens * 2 // len(_FILLER) + 1)
+    return text[:tokens * 2]
+
+
+def _math_expression(question: str) -> str:
+    """从计算问题中取出算式；没有显式算式时把问题中的数字相乘"""
+    question = question.replace("×", "*").replace("÷", "/")
+    expression = re.search(r"\d+(?:\.\d+)?(?:\s*[-+*/]\s*\d+(?:\.\d+)?)+", question)
+    if expression:
+        return expression.group(0)
+    return " * ".join(re.findall(r"\d+(?:\.\d+)?", question)) or "0"
+
+
+def respond(prompt: str) -> str:
+    """按提示词的格式要求生成能被对应解析器接受的回答"""
+    # LLMMathChain：返回numexpr可执行的算式
+    if "numexpr" in prompt:
+        questions = re.findall(r"Question: (.+)", prompt)
+        return f"```text\n{_math_expression(questions[-1] if questions else '')}\n```"
+
+    # ZERO_SHOT_REACT代理（查找微博大V）：先调用搜索工具，拿到Observation后给出最终答案
+    if "Action Input:" in prompt and "Final Answer:" in prompt:
+        if prompt.count("Action Input:") > 1:
+            return f"Thought: 已经找到该领域的KOL\nFinal Answer: {FAKE_UID}"
+        return "Thought: 需要搜索微博KOL\nAction: Crawl Google for 微博 page\nAction Input: 微博 KOL"
+
+    # Plan-and-Execute的计划器
+    if "<END_OF_PLAN>" in prompt:
+        question = re.search(r'问题："(.+?)"', prompt)
+        question = question.group(1) if question else "用户的问题"
+        return f"Plan:\n1. 在文档中搜索：{question}\n2. 根据搜索结果回答用户的问题\n<END_OF_PLAN>"
+
+    # Plan-and-Execute的执行器（structured chat代理）：先检索文档，再给出答案
+    if "action_input" in prompt:
+        if '"action": "VectorDBSearch"' in prompt:
+            blob = {"action": "Final Answer", "action_input": _filler(prompt, profile.output_tokens)}
+        else:
+            objective = re.search(r"Current objective: (.+)", prompt)
+            query = objective.group(1).strip() if objective else prompt[-50:]
+            blob = {"action": "VectorDBSearch", "action_input": query}
+        return f"```json\n{json.dumps(blob, ensure_ascii=False)}\n```"
+
+    # PydanticOutputParser(TextParsing)：生成大V分析和合作邮件
+    if '"summary"' in prompt and '"letter"' in prompt:
+        return json.dumps({
+            "summary": _filler(prompt, 40),
+            "facts": ["粉丝活跃度高", "内容专业"],
+            "interest": ["新品试用", "品牌联名"],
+            "letter": [_filler(prompt, profile.output_tokens)],
+        }, ensure_ascii=False)
+
+    return _filler(prompt, profile.output_tokens)
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(str(message.content) for message in messages)
+
+
+class FakeChatModel(BaseChatModel):
+    """ChatOpenAI的本地替身，接受相同的构造参数（多余的参数被忽略）"""
+
+    model_name: str = Field(default="fake-chat", alias="model")
+    temperature: float = 0.0
+    streaming: bool = False  # 与ChatOpenAI相同：为True时invoke也逐token触发回调
+
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+        text = respond(_prompt_text(messages))
+        time.sleep(profile.sample_ttft() + len(tokenize(text)) * profile.token_interval())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text = respond(_prompt_text(messages))
+        time.sleep(profile.sample_ttft())
+        interval = profile.token_interval()
+        for token in tokenize(text):
+            time.sleep(interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    # 异步版本用asyncio.sleep等待，与真实的异步客户端一样不占用线程
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+        text = respond(_prompt_text(messages))
+        await asyncio.sleep(profile.sample_ttft() + len(tokenize(text)) * profile.token_interval())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text = respond(_prompt_text(messages))
+        await asyncio.sleep(profile.sample_ttft())
+        interval = profile.token_interval()
+        for token in tokenize(text):
+            await asyncio.sleep(interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def fake_get_UID(query: str) -> str:
+    """替代SerpAPI搜索"""
+    time.sleep(http_latency_ms / 1000)
+    return f"['https://weibo.com/u/{FAKE_UID}']"
+
+
+def fake_get_data(uid) -> dict:
+    """替代微博资料接口，返回与真实接口结构相近的资料"""
+    time.sleep(http_latency_ms / 1000)
+    return {
+        "ok": 1,
+        "data": {
+            "description": "专注鲜花与生活方式内容十年",
+            "verified_reason": "知名花艺博主",
+            "ip_location": "IP属地：北京",
+            "label_desc": [{"name": "鲜花领域创作者"}, {"name": "好物推荐官"}],
+            "followers_count": "120万",
+        },
+    }
+
+
+class FakeSentenceModel:
+    """SentenceTransformer的替身：按文本哈希生成确定的单位向量"""
+
+    def __init__(self, model_name: str, dimension: int = 384):
+        self.model_name = model_name
+        self.dimension = dimension
+
+    def encode(self, texts, **kwargs) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension)
+            vectors[i] = vector / np.linalg.norm(vector)
+        return vectors
+
+
+def install_fakes(latency: LatencyProfile, http_latency: float = 100.0, fake_embeddings: bool = False):
+    """用本地替身替换LLM、SerpAPI和微博接口（以及可选的嵌入模型）"""
+    global profile, http_latency_ms
+    profile = latency
+    http_latency_ms = http_latency
+
+    import langchain_openai
+    langchain_openai.ChatOpenAI = FakeChatModel
+
+    import tools.scraping_tool
+    import tools.search_tool
+    tools.search_tool.get_UID = fake_get_UID
+    tools.scraping_tool.get_data = fake_get_data
+
+    if fake_embeddings:
+        import tools.model_registry
+        models = {}
+        tools.model_registry.get_sentence_model = (
+            lambda name: models.setdefault(name, FakeSentenceModel(name))
+        )
@@ -1,100 +1,226 @@
-import os
+import asyncio
+import json
+import logging
+import queue
+import re
+import threading
+import time
 import gradio as gr
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Qdrant
 from langchain.memory.chat_message_histories import ChatMessageHistory
 from langchain.memory import ConversationBufferMemory  # 改用基础的对话缓存
 from langchain.chains import ConversationalRetrievalChain
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.document_loaders import Docx2txtLoader
-from langchain_community.document_loaders import TextLoader
-from typing import Dict, List, Any
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Any, Optional, Tuple
 from langchain.embeddings.base import Embeddings
 from pydantic import BaseModel
 from volcenginesdkarkruntime import Ark
-from langchain_openai import ChatOpenAI  # ChatOpenAI模型
-from sentence_transformers import SentenceTransformer
 from langchain_experimental.plan_and_execute import (
-    PlanAndExecute,
     load_agent_executor,
     load_chat_planner,
 )
+from langchain_experimental.plan_and_execute.schema import ListStepContainer
 from langchain.agents import Tool
 from langchain.chains import LLMMathChain
+from langchain.prompts import PromptTemplate
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.output_parsers import StrOutputParser
+from config.metrics import (
+    AGENT_ERRORS, AGENT_RUN_SECONDS, CHAT_ANSWER_CACHE, CHAT_RESPONSE_SECONDS, CHAT_ROUTES, EMBEDDING_CACHE,
+    EMBEDDING_SECONDS, timer
+)
+from config.tracing import bind_context, record_exception, span
+from tools.answer_cache import SemanticAnswerCache, answer_cache_from_env
+from tools.conversation_store import ConversationStore, conversation_store_from_env
+from tools.doc_index import DocumentIndex
+from tools.embedding_cache import EmbeddingCache, get_default_cache
+from tools.embedding_batcher import BatchingEmbeddings
+from tools.hybrid_retriever import HybridRetriever, retriever_from_env
+from tools.llm_client import get_chat_model
+from tools.model_registry import embedding_model_name, get_sentence_model
+from tools.query_router import QueryRouter, router_from_env
+
+logger = logging.getLogger(__name__)
+
+# 单跳文档问答：一次检索加一次LLM调用
+RAG_PROMPT = PromptTemplate.from_template("""你是易速鲜花的客服助手。请根据以下文档内容回答用户的问题，文档中没有相关信息时请如实说明。
+
+文档内容：
+{context}
+
+问题：{question}
+回答：""")
+
+# structured chat代理给出最终回答时输出的JSON前缀，其后是回答的字符串
+_FINAL_ANSWER = re.compile(r'"action"\s*:\s*"Final Answer"\s*,\s*"action_input"\s*:\s*"')
+
+# 进行中的流式回答后台任务（见ChatbotWithRetrieval.astream_response）
+_stream_tasks: "set[asyncio.Task]" = set()
+
+
+def _event(name: str, **data) -> Dict:
+    return {"event": name, "data": data}
+
+
+class FinalAnswerTokens(BaseCallbackHandler):
+    """从执行器的流式输出中取出最终回答，边生成边通过emit推送文本增量
+
+    执行器每次调用模型都先输出一段JSON（调用工具或给出Final Answer），只有Final Answer的action_input
+    是给用户的回答；这里按token增量解析这个JSON字符串（包括转义字符），其余输出忽略。
+    """
+
+    run_inline = True  # 异步执行时也在事件循环线程中直接回调，保证增量的顺序
+
+    def __init__(self, emit: Callable[[str], None]):
+        self.emit = emit
+        self._reset()
+
+    def _reset(self):
+        self._buffer = ""
+        self._pos: Optional[int] = None  # 回答字符串在_buffer中的当前解析位置，None表示尚未出现
+        self._closed = False
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._reset()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._reset()
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self._closed:
+            return
+        self._buffer += token
+        if self._pos is None:
+            match = _FINAL_ANSWER.search(self._buffer)
+            if match is None:
+                return
+            self._pos = match.end()
+
+        buffer, i, text = self._buffer, self._pos, []
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self._closed = True
+                break
+            if char != "\\":
+                text.append(char)
+                i += 1
+                continue
+            # 转义字符：等完整的转义序列（代理对需要两个\uXXXX）到达后再解码
+            end = i + 2
+            if buffer[i + 1:i + 2] == "u":
+                end = i + 6
+                if len(buffer) >= end and 0xD800 <= int(buffer[i + 2:end], 16) < 0xDC00:
+                    end = i + 12
+            if len(buffer) < end:
+                break
+            text.append(json.loads(f'"{buffer[i:end]}"'))
+            i = end
+        self._pos = i
+        if text:
+            self.emit("".join(text))
+
 
 class SentenceBERTEmbeddings(Embeddings):  # 继承Embeddings基类
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name='all-MiniLM-L6-v2', cache: Optional[EmbeddingCache] = None):
+        self.model_name = model_name
+        # 默认使用进程内共享的向量缓存，相同文本不会重复编码
+        self.cache = cache if cache is not None else get_default_cache()
+
+    @property
+    def model(self):
+        # 模型由注册表统一管理，首次编码时才加载，各组件共享同一份
+        return get_sentence_model(self.model_name)
 
     def embed_query(self, text: str) -> List[float]:
-        return self.model.encode(text).tolist()
+        return self.embed_documents([text])[0]
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return self.model.encode(texts).tolist()
+        with span("embedding.embed_documents", model=self.model_name, texts=len(texts)) as current:
+            vectors = self.cache.get_many(self.model_name, texts)
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            current.set_attribute("cache_misses", len(missing))
+            EMBEDDING_CACHE.inc(len(texts) - len(missing), model=self.model_name, result="hit")
+            EMBEDDING_CACHE.inc(len(missing), model=self.model_name, result="miss")
+            if missing:
+                # 只编码未命中的文本，同一批次中的重复文本只编码一次
+                unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+                with span("embedding.encode", model=self.model_name, texts=len(unique_texts)), \
+                        timer(EMBEDDING_SECONDS, model=self.model_name):
+                    encoded = self.model.encode(unique_texts).tolist()
+                self.cache.put_many(self.model_name, unique_texts, encoded)
+                by_text = dict(zip(unique_texts, encoded))
+                for i in missing:
+                    vectors[i] = by_text[texts[i]]
+            return vectors
 
     class Config:
         arbitrary_types_allowed = True
 
 
+_shared_embeddings: Dict[str, BatchingEmbeddings] = {}
+_shared_embeddings_lock = threading.Lock()
+
+
+def get_shared_embeddings(model_name: Optional[str] = None) -> BatchingEmbeddings:
+    """获取进程内共享的嵌入实例（共享模型、向量缓存和批处理线程），默认使用EMBEDDING_MODEL配置的模型"""
+    model_name = model_name or embedding_model_name()
+    with _shared_embeddings_lock:
+        if model_name not in _shared_embeddings:
+            _shared_embeddings[model_name] = BatchingEmbeddings(
+                SentenceBERTEmbeddings(model_name)
+            )
+        return _shared_embeddings[model_name]
+
+
 class ChatbotWithRetrieval:
-    def __init__(self, dir):
-
-        # 加载Documents
-        base_dir = dir  # 文档的存放目录
-        documents = []
-        for file in os.listdir(base_dir):
-            file_path = os.path.join(base_dir, file)
-            if file.endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-                documents.extend(loader.load())
-            elif file.endswith(".docx") or file.endswith(".doc"):
-                loader = Docx2txtLoader(file_path)
-                documents.extend(loader.load())
-            elif file.endswith(".txt"):
-                loader = TextLoader(file_path)
-                documents.extend(loader.load())
-
-        # 文本的分割
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0)
-        all_splits = text_splitter.split_documents(documents)
-
-        # 向量数据库
-        self.vectorstore = Qdrant.from_documents(
-            documents=all_splits,  # 以分块的文档
-            embedding=SentenceBERTEmbeddings(),  # 用OpenAI的Embedding Model做嵌入
-            location=":memory:",  # in-memory 存储
-            collection_name="my_documents",
-        )  # 指定collection_name
+    def __init__(self, dir, index_dir=None, answer_cache: Optional[SemanticAnswerCache] = None,
+                 router: Optional[QueryRouter] = None, conversations: Optional[ConversationStore] = None,
+                 retriever: Optional[HybridRetriever] = None):
+
+        self.embeddings = get_shared_embeddings()  # 与其他组件共享模型，并发查询合并为批量编码
+
+        # 加载持久化的文档索引，仅对新增或修改过的文档重新分块和嵌入
+        self.doc_index = DocumentIndex(
+            docs_dir=dir,  # 文档的存放目录
+            embeddings=self.embeddings,
+            index_dir=index_dir,  # 索引的存放目录，默认为data/doc_index
+            chunk_size=200,
+            chunk_overlap=0,
+        ).sync()
+
+        # BM25与向量检索融合的混合检索，直接使用索引中已计算好的向量
+        self.retriever = retriever if retriever is not None else retriever_from_env(self.doc_index)
 
         # 初始化LLM和向量数据库
-        self.llm = ChatOpenAI(
-            model=os.environ["LLM_MODELEND"],
-            temperature=0,
-        )
+        self.llm = get_chat_model("chatbot", temperature=0)
         
         # 创建工具集
-        llm_math_chain = LLMMathChain.from_llm(llm=self.llm, verbose=True)
+        self.llm_math_chain = llm_math_chain = LLMMathChain.from_llm(llm=self.llm, verbose=True)
         self.tools = [
             Tool(
                 name="VectorDBSearch",
                 func=self._search_docs,
+                coroutine=self._asearch_docs,
                 description="用于搜索文档数据库获取相关信息",
             ),
             Tool(
                 name="Calculator",
                 func=llm_math_chain.run,
+                coroutine=llm_math_chain.arun,
                 description="用于执行数学计算",
             ),
         ]
         
-        # 初始化Plan-and-Execute代理
+        # 初始化Plan-and-Execute代理的计划器和执行器（执行流程见_run_plan）
         self.planner = load_chat_planner(self.llm)
         self.executor = load_agent_executor(self.llm, self.tools, verbose=True)
-        self.agent = PlanAndExecute(
-            planner=self.planner,
-            executor=self.executor,
-            verbose=True
+        # 流式回答时最后一步使用的执行器：模型以流式输出，最终回答逐token推送
+        self.stream_executor = load_agent_executor(
+            get_chat_model("chatbot", temperature=0, streaming=True), self.tools, verbose=True
         )
+
+        # 简单问题不经过计划器：单跳文档问答和纯计算分别只需一次检索加一次LLM调用、一次计算链调用
+        self.rag_chain = RAG_PROMPT | self.llm | StrOutputParser()
+        self.router = router if router is not None else router_from_env(self.embeddings)
         
         # 修改内存初始化
         self.memory = ConversationBufferMemory(  # 使用更简单的内存模型
@@ -103,18 +229,46 @@ class ChatbotWithRetrieval:
             output_key="answer"
         )
 
-        # 初始化对话历史
-        self.conversation_history = ""
+        # 按会话保存的对话历史，每个会话只保留最近若干轮，空闲会话自动过期
+        self.conversations = conversations if conversations is not None else conversation_store_from_env()
+
+        # 语义相同的问题直接返回已有答案，不再执行计划；文档索引变化后缓存自动失效
+        self.answer_cache = answer_cache if answer_cache is not None else answer_cache_from_env()
+
+    def refresh_docs(self) -> "ChatbotWithRetrieval":
+        """重新同步docs目录并重建检索索引，文档有变化时已缓存的答案随之失效"""
+        fingerprint = self.doc_index.fingerprint
+        self.doc_index.sync()
+        if self.doc_index.fingerprint != fingerprint:
+            retriever = self.retriever
+            self.retriever = HybridRetriever.from_index(
+                self.doc_index, mode=retriever.mode, candidates=retriever.candidates,
+                rrf_k=retriever.rrf_k, rerank_model=retriever.rerank_model,
+            )
+        return self
 
     def _search_docs(self, query: str) -> str:
         """搜索文档数据库"""
-        docs = self.vectorstore.similarity_search(query, k=3)
-        return "\n".join([doc.page_content for doc in docs])
+        return self._retrieve(query, self.embeddings.embed_query(query))
 
-    def get_response(self, user_input: str) -> str:
-        try:
-            # 使用Plan-and-Execute代理处理查询
-            task_prompt = f"""基于用户的问题："{user_input}"
+    def _retrieve(self, query: str, vector: List[float]) -> str:
+        """用已计算好的查询向量做混合检索，返回最相关的3个分块"""
+        chunks = self.retriever.search(query, vector, k=3)
+        return "\n".join(chunk["text"] for chunk in chunks)
+
+    async def _aretrieve(self, query: str, vector: List[float]) -> str:
+        """_retrieve的异步版本：不重排时检索很快，直接执行；交叉编码器重排是CPU密集的计算，放到线程池中执行"""
+        if self.retriever.rerank_model:
+            return await asyncio.to_thread(self._retrieve, query, vector)
+        return self._retrieve(query, vector)
+
+    async def _asearch_docs(self, query: str) -> str:
+        """_search_docs的异步版本：等待查询向量合批时不占用线程"""
+        return await self._aretrieve(query, await self.embeddings.aembed_query(query))
+
+    @staticmethod
+    def _task_prompt(user_input: str) -> str:
+        return f"""基于用户的问题："{user_input}"
             
 请分析并回答这个问题。考虑以下几点：
 1. 是否需要搜索文档获取信息
@@ -124,20 +278,300 @@ class ChatbotWithRetrieval:
 
 请制定详细的执行计划并执行。"""
 
-            # 执行计划并获取结果
-            response = self.agent.run(task_prompt)
-            
-            # 更新对话历史
-            self.conversation_history += (
-                f"你: {user_input}\nChatbot: {response}\n"
-            )
-            
-            return self.conversation_history
+    def _lookup_answer(self, user_input: str, vector: List[float]) -> Optional[str]:
+        with span("chatbot.answer_cache") as current:
+            answer = self.answer_cache.lookup(vector, user_input, self.doc_index.fingerprint)
+            current.set_attribute("cache_hit", answer is not None)
+        CHAT_ANSWER_CACHE.inc(result="hit" if answer is not None else "miss")
+        return answer
+
+    def _append_history(self, session_id: str, user_input: str, response: str, started: float,
+                        cache: str = "miss", route: str = "plan") -> str:
+        # 更新会话的对话历史，只返回本轮的回答
+        self.conversations.append(session_id, user_input, response)
+        elapsed = time.perf_counter() - started
+        CHAT_RESPONSE_SECONDS.observe(elapsed, cache=cache, route=route)
+        if cache != "hit":
+            AGENT_RUN_SECONDS.observe(elapsed, agent="chatbot", operation="chat")
+        return response
+
+    def get_history(self, session_id: str = "default") -> List[Tuple[str, str]]:
+        """返回会话最近的(用户消息, 回答)列表"""
+        return self.conversations.history(session_id)
+
+    @staticmethod
+    def _math_answer(output: str) -> str:
+        # LLMMathChain的输出形如"Answer: 297"
+        return f"计算结果：{output.replace('Answer:', '', 1).strip()}"
+
+    def _route(self, user_input: str, vector: List[float]) -> str:
+        with span("chatbot.route") as current:
+            route = self.router.route(user_input, vector)
+            current.set_attribute("route", route)
+        return route
+
+    def _plan_steps(self, plan, emit: Optional[Callable[[Dict], None]]):
+        """依次返回(序号, 步骤, 执行器, 回调)；流式回答时最后一步改用流式执行器，推送最终回答的token"""
+        for index, step in enumerate(plan.steps, 1):
+            if emit is not None and index == len(plan.steps):
+                handler = FinalAnswerTokens(lambda content: emit(_event("delta", content=content)))
+                yield index, step, self.stream_executor, [handler]
+            else:
+                yield index, step, self.executor, None
+
+    def _run_plan(self, user_input: str, emit: Optional[Callable[[Dict], None]] = None) -> str:
+        """用Plan-and-Execute回答，emit不为空时推送计划、每个完成的步骤和最终回答的文本增量
+
+        与PlanAndExecute.run的流程相同，但每次回答使用独立的步骤记录：PlanAndExecute把步骤记录保存在
+        实例上，所有请求共用同一份，记录会无限增长，也会把其他用户的步骤带入执行器的提示词。
+        """
+        inputs = {"input": self._task_prompt(user_input)}
+        with span("chatbot.plan_and_execute") as current:
+            plan = self.planner.plan(inputs)
+            current.set_attribute("steps", len(plan.steps))
+            if emit is not None:
+                emit(_event("plan", steps=[step.value for step in plan.steps]))
+            steps = ListStepContainer()
+            for index, step, executor, callbacks in self._plan_steps(plan, emit):
+                response = executor.step(
+                    {"previous_steps": steps, "current_step": step, "objective": inputs["input"], **inputs},
+                    callbacks=callbacks,
+                )
+                steps.add_step(step, response)
+                if emit is not None:
+                    emit(_event("step", index=index, total=len(plan.steps), step=step.value,
+                                response=response.response))
+            return steps.get_final_response()
+
+    async def _arun_plan(self, user_input: str, emit: Optional[Callable[[Dict], None]] = None) -> str:
+        """_run_plan的异步版本"""
+        inputs = {"input": self._task_prompt(user_input)}
+        with span("chatbot.plan_and_execute") as current:
+            plan = await self.planner.aplan(inputs)
+            current.set_attribute("steps", len(plan.steps))
+            if emit is not None:
+                emit(_event("plan", steps=[step.value for step in plan.steps]))
+            steps = ListStepContainer()
+            for index, step, executor, callbacks in self._plan_steps(plan, emit):
+                response = await executor.astep(
+                    {"previous_steps": steps, "current_step": step, "objective": inputs["input"], **inputs},
+                    callbacks=callbacks,
+                )
+                steps.add_step(step, response)
+                if emit is not None:
+                    emit(_event("step", index=index, total=len(plan.steps), step=step.value,
+                                response=response.response))
+            return steps.get_final_response()
+
+    def _answer(self, user_input: str, vector: List[float],
+                emit: Optional[Callable[[Dict], None]] = None) -> Tuple[str, str]:
+        """按分流结果回答，返回(实际处理的路由, 回答)；计算链无法处理的问题改由Plan-and-Execute回答
+
+        emit不为空时推送路由、计划步骤和回答的文本增量（见stream_response）。
+        """
+        route = self._route(user_input, vector)
+        if emit is not None:
+            emit(_event("start", route=route))
+        served = route
+        if route == "rag":
+            context = self._retrieve(user_input, vector)
+            with span("chatbot.rag"):
+                inputs = {"context": context, "question": user_input}
+                if emit is None:
+                    response = self.rag_chain.invoke(inputs)
+                else:
+                    chunks = []
+                    for chunk in self.rag_chain.stream(inputs):
+                        chunks.append(chunk)
+                        emit(_event("delta", content=chunk))
+                    response = "".join(chunks)
+        else:
+            response = None
+            if route == "math":
+                try:
+                    with span("chatbot.math"):
+                        response = self._math_answer(self.llm_math_chain.run(user_input))
+                    if emit is not None:
+                        emit(_event("delta", content=response))
+                except ValueError as e:
+                    logger.info(f"计算链无法处理该问题，改用计划执行: {str(e)}")
+                    served = "plan"
+            if response is None:
+                # 使用Plan-and-Execute代理处理查询，执行计划并获取结果
+                response = self._run_plan(user_input, emit)
+        CHAT_ROUTES.inc(chosen=route, served=served)
+        return served, response
+
+    async def _aanswer(self, user_input: str, vector: List[float],
+                       emit: Optional[Callable[[Dict], None]] = None) -> Tuple[str, str]:
+        """_answer的异步版本"""
+        route = self._route(user_input, vector)
+        if emit is not None:
+            emit(_event("start", route=route))
+        served = route
+        if route == "rag":
+            context = await self._aretrieve(user_input, vector)
+            with span("chatbot.rag"):
+                inputs = {"context": context, "question": user_input}
+                if emit is None:
+                    response = await self.rag_chain.ainvoke(inputs)
+                else:
+                    chunks = []
+                    async for chunk in self.rag_chain.astream(inputs):
+                        chunks.append(chunk)
+                        emit(_event("delta", content=chunk))
+                    response = "".join(chunks)
+        else:
+            response = None
+            if route == "math":
+                try:
+                    with span("chatbot.math"):
+                        response = self._math_answer(await self.llm_math_chain.arun(user_input))
+                    if emit is not None:
+                        emit(_event("delta", content=response))
+                except ValueError as e:
+                    logger.info(f"计算链无法处理该问题，改用计划执行: {str(e)}")
+                    served = "plan"
+            if response is None:
+                response = await self._arun_plan(user_input, emit)
+        CHAT_ROUTES.inc(chosen=route, served=served)
+        return served, response
+
+    def get_response(self, user_input: str, session_id: str = "default") -> str:
+        """回答用户的问题，session_id区分不同用户的对话历史"""
+        started = time.perf_counter()
+        try:
+            vector = self.embeddings.embed_query(user_input)
+            answer = self._lookup_answer(user_input, vector)
+            if answer is not None:
+                return self._append_history(session_id, user_input, answer, started, cache="hit", route="cache")
+
+            route, response = self._answer(user_input, vector)
+            self.answer_cache.put(vector, user_input, response, self.doc_index.fingerprint)
+            return self._append_history(session_id, user_input, response, started, route=route)
             
         except Exception as e:
-            print(f"处理查询时出错: {str(e)}")
+            logger.exception(f"处理查询时出错: {str(e)}")
+            record_exception(e)
+            AGENT_ERRORS.inc(agent="chatbot", operation="chat")
+            return "抱歉，我暂时无法处理您的问题，请稍后再试。"
+
+    async def aget_response(self, user_input: str, session_id: str = "default") -> str:
+        """get_response的异步版本：计划器和执行器的LLM调用通过异步客户端发出"""
+        started = time.perf_counter()
+        try:
+            vector = await self.embeddings.aembed_query(user_input)
+            answer = self._lookup_answer(user_input, vector)
+            if answer is not None:
+                return self._append_history(session_id, user_input, answer, started, cache="hit", route="cache")
+
+            route, response = await self._aanswer(user_input, vector)
+            self.answer_cache.put(vector, user_input, response, self.doc_index.fingerprint)
+            return self._append_history(session_id, user_input, response, started, route=route)
+
+        except Exception as e:
+            logger.exception(f"处理查询时出错: {str(e)}")
+            record_exception(e)
+            AGENT_ERRORS.inc(agent="chatbot", operation="chat")
             return "抱歉，我暂时无法处理您的问题，请稍后再试。"
 
+    def _produce_stream(self, user_input: str, session_id: str, emit: Callable[[Dict], None]):
+        """回答问题并通过emit推送事件，最后一个事件总是done或error"""
+        started = time.perf_counter()
+        try:
+            vector = self.embeddings.embed_query(user_input)
+            answer = self._lookup_answer(user_input, vector)
+            if answer is not None:
+                emit(_event("start", route="cache"))
+                emit(_event("delta", content=answer))
+                self._append_history(session_id, user_input, answer, started, cache="hit", route="cache")
+                emit(_event("done", response=answer, route="cache", session_id=session_id))
+                return
+
+            route, response = self._answer(user_input, vector, emit)
+            self.answer_cache.put(vector, user_input, response, self.doc_index.fingerprint)
+            self._append_history(session_id, user_input, response, started, route=route)
+            emit(_event("done", response=response, route=route, session_id=session_id))
+
+        except Exception as e:
+            logger.exception(f"处理查询时出错: {str(e)}")
+            record_exception(e)
+            AGENT_ERRORS.inc(agent="chatbot", operation="chat_stream")
+            emit(_event("error", error="抱歉，我暂时无法处理您的问题，请稍后再试。"))
+
+    def stream_response(self, user_input: str, session_id: str = "default") -> Iterator[Dict]:
+        """流式回答用户的问题，依次产出事件{"event": ..., "data": {...}}：
+
+        - start：选定的路由（cache/rag/math/plan）
+        - plan：Plan-and-Execute的计划步骤；step：每个完成的步骤及其结果
+        - delta：回答的文本增量，按生成顺序拼接即为回答
+        - done：完整的回答（以此为准，执行器重试时增量可能重复）；error：处理失败
+
+        回答在后台线程中生成，模型回调中产生的事件经队列交给调用方；调用方中途停止读取时，
+        回答仍会完成并写入对话历史和答案缓存。
+        """
+        events: "queue.Queue[Dict]" = queue.Queue()
+        threading.Thread(
+            target=bind_context(self._produce_stream),
+            args=(user_input, session_id, events.put),
+            name="chat-stream",
+            daemon=True,
+        ).start()
+        while True:
+            event = events.get()
+            yield event
+            if event["event"] in ("done", "error"):
+                return
+
+    async def _aproduce_stream(self, user_input: str, session_id: str, emit: Callable[[Dict], None]):
+        """_produce_stream的异步版本"""
+        started = time.perf_counter()
+        try:
+            vector = await self.embeddings.aembed_query(user_input)
+            answer = self._lookup_answer(user_input, vector)
+            if answer is not None:
+                emit(_event("start", route="cache"))
+                emit(_event("delta", content=answer))
+                self._append_history(session_id, user_input, answer, started, cache="hit", route="cache")
+                emit(_event("done", response=answer, route="cache", session_id=session_id))
+                return
+
+            route, response = await self._aanswer(user_input, vector, emit)
+            self.answer_cache.put(vector, user_input, response, self.doc_index.fingerprint)
+            self._append_history(session_id, user_input, response, started, route=route)
+            emit(_event("done", response=response, route=route, session_id=session_id))
+
+        except Exception as e:
+            logger.exception(f"处理查询时出错: {str(e)}")
+            record_exception(e)
+            AGENT_ERRORS.inc(agent="chatbot", operation="chat_stream")
+            emit(_event("error", error="抱歉，我暂时无法处理您的问题，请稍后再试。"))
+
+    async def astream_response(self, user_input: str, session_id: str = "default") -> AsyncIterator[Dict]:
+        """stream_response的异步版本，回答在同一事件循环的后台任务中生成
+
+        客户端断开（生成器被关闭）时取消后台任务，不再继续调用模型。
+        """
+        events: "asyncio.Queue[Dict]" = asyncio.Queue()
+        task = asyncio.create_task(self._aproduce_stream(user_input, session_id, events.put_nowait))
+        # 事件循环只持有任务的弱引用，保存强引用以免执行中被垃圾回收
+        _stream_tasks.add(task)
+        task.add_done_callback(_stream_tasks.discard)
+        try:
+            while True:
+                event = await events.get()
+                yield event
+                if event["event"] in ("done", "error"):
+                    break
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
 if __name__ == "__main__":
     
     folder = "docs"
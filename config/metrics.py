@@ -0,0 +1,435 @@
+"""进程内的Prometheus风格指标注册表
+
+提供Counter、Gauge和Histogram三类指标，按标签值分别计数，每个指标一把锁，可在多线程中直接使用。
+/metrics接口调用render()输出Prometheus文本格式（0.0.4）。
+
+多进程部署（如gunicorn多worker）时设置环境变量METRICS_DIR为各进程共享的目录：
+每个进程定期（METRICS_FLUSH_INTERVAL秒，默认5秒）把自己的指标快照写入<pid>.json，
+抓取时由响应请求的进程汇总目录中所有快照。计数器和直方图按进程求和；
+已退出进程的快照保留（计数器保持单调递增），退出时其Gauge归零。
+未设置METRICS_DIR时只报告当前进程的指标。
+
+用法：
+    LLM_REQUESTS.inc(component="chatbot", model=model, status="ok")
+    with timer(VECTOR_SEARCH_SECONDS, store="faiss"):
+        ...
+"""
+import atexit
+import functools
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 延迟类直方图的默认分桶（秒），覆盖从毫秒级数据库查询到分钟级LLM调用
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"指标{self.name}需要标签{self.labelnames}，实际为{tuple(labels)}")
+        try:
+            return tuple(str(labels[name]) for name in self.labelnames)
+        except KeyError as e:
+            raise ValueError(f"指标{self.name}缺少标签{e}") from None
+
+    def snapshot(self) -> Dict[Tuple, object]:
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的当前值，多进程时各进程的值相加"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def zero(self):
+        with self._lock:
+            for key in self._values:
+                self._values[key] = 0.0
+
+
+class Histogram(_Metric):
+    """分桶直方图，每个标签组合保存[各桶计数..., +Inf桶计数, 总和]"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+
+class timer:
+    """计时并记录到直方图，可用作上下文管理器或装饰器"""
+
+    __slots__ = ("histogram", "labels", "_start")
+
+    def __init__(self, histogram: Histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._start, **self.labels)
+        return False
+
+    def __call__(self, fn):
+        histogram, labels = self.histogram, self.labels
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+
+        return wrapper
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标重复注册: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def metrics(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, Dict[Tuple, object]]:
+        return {metric.name: metric.snapshot() for metric in self.metrics()}
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+
+# ---- 多进程汇总 ----
+
+def _metrics_dir() -> Optional[str]:
+    return os.environ.get("METRICS_DIR") or None
+
+
+_flush_lock = threading.Lock()
+
+
+def _encode_snapshot(snapshot: Dict[str, Dict[Tuple, object]]) -> Dict:
+    return {name: [[list(key), value] for key, value in values.items()] for name, values in snapshot.items()}
+
+
+def flush(final: bool = False):
+    """把当前进程的指标快照写入METRICS_DIR；final为True时先把Gauge归零（进程退出时调用）"""
+    directory = _metrics_dir()
+    if not directory:
+        return
+    if final:
+        for metric in REGISTRY.metrics():
+            if isinstance(metric, Gauge):
+                metric.zero()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    with _flush_lock:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_encode_snapshot(REGISTRY.snapshot()), f, ensure_ascii=False)
+        # 原子替换，抓取进程不会读到写了一半的文件
+        os.replace(tmp_path, path)
+
+
+def _merge(target: Dict[Tuple, object], key: Tuple, value):
+    current = target.get(key)
+    if current is None:
+        target[key] = list(value) if isinstance(value, list) else value
+    elif isinstance(value, list):
+        if len(current) == len(value):
+            target[key] = [a + b for a, b in zip(current, value)]
+    else:
+        target[key] = current + value
+
+
+def collect() -> Dict[str, Dict[Tuple, object]]:
+    """汇总所有进程的指标；未启用多进程模式时只返回当前进程的指标"""
+    directory = _metrics_dir()
+    if not directory:
+        return REGISTRY.snapshot()
+    try:
+        flush()
+    except OSError as e:
+        logger.warning(f"写入指标快照失败: {str(e)}")
+    merged: Dict[str, Dict[Tuple, object]] = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # 进程可能正在退出或文件已被清理
+        for name, values in data.items():
+            target = merged.setdefault(name, {})
+            for key, value in values:
+                _merge(target, tuple(key), value)
+    return merged
+
+
+_flusher: Optional[threading.Thread] = None
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+
+
+def _flush_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception as e:
+            logger.warning(f"写入指标快照失败: {str(e)}")
+
+
+def start_flusher():
+    """启用多进程模式时在当前进程启动定期写快照的后台线程；fork出的worker会各自启动"""
+    global _flusher, _flusher_pid
+    if not _metrics_dir():
+        return
+    with _flusher_lock:
+        if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+            return
+        interval = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+        _flusher_pid = os.getpid()
+        _flusher = threading.Thread(target=_flush_loop, args=(interval,), name="metrics-flusher", daemon=True)
+        _flusher.start()
+
+
+def _after_fork_in_child():
+    # gunicorn --preload等场景下worker从主进程fork，继承来的计数属于主进程，重新计数；
+    # fork时其他线程可能正持有锁，子进程中的锁全部重建
+    global _flusher, _flush_lock, _flusher_lock
+    _flush_lock = threading.Lock()
+    _flusher_lock = threading.Lock()
+    REGISTRY._lock = threading.Lock()
+    for metric in REGISTRY.metrics():
+        metric._lock = threading.Lock()
+    REGISTRY.reset()
+    _flusher = None
+    start_flusher()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush(final=True)
+    except Exception:
+        pass
+
+
+# ---- Prometheus文本格式 ----
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple, values: Tuple, extra: Optional[Tuple] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render() -> str:
+    """以Prometheus文本格式输出所有指标"""
+    data = collect()
+    lines = []
+    for metric in REGISTRY.metrics():
+        # 计数器按惯例以_total结尾
+        exposed = f"{metric.name}_total" if isinstance(metric, Counter) else metric.name
+        lines.append(f"# HELP {exposed} {metric.documentation}")
+        lines.append(f"# TYPE {exposed} {metric.type}")
+        for key, value in sorted(data.get(metric.name, {}).items()):
+            if isinstance(metric, Histogram):
+                if len(value) != len(metric.buckets) + 2:
+                    continue  # 分桶定义已变化的旧快照
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                    cumulative += count
+                    labels = _format_labels(metric.labelnames, key, ("le", _format_value(bound)))
+                    lines.append(f"{metric.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(metric.labelnames, key)
+                lines.append(f"{metric.name}_sum{labels} {_format_value(value[-1])}")
+                lines.append(f"{metric.name}_count{labels} {cumulative}")
+            else:
+                lines.append(f"{exposed}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- 应用使用的指标 ----
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests", "HTTP请求数", ["endpoint", "method", "status"])
+HTTP_REQUEST_ERRORS = REGISTRY.counter(
+    "http_request_errors", "处理失败的HTTP请求数（含以200返回错误信息的接口）", ["endpoint"])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP请求耗时（流式接口含整个流）", ["endpoint"])
+
+LLM_REQUESTS = REGISTRY.counter(
+    "llm_requests", "LLM调用次数", ["component", "model", "status"])
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "llm_request_duration_seconds", "LLM调用耗时", ["component", "model"])
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens", "LLM消耗的token数", ["component", "model", "type"])
+LLM_PROMPT_TOKENS = REGISTRY.histogram(
+    "llm_prompt_tokens", "每次LLM调用的提示词token数", ["component"], buckets=TOKEN_BUCKETS)
+LLM_SLOT_WAIT_SECONDS = REGISTRY.histogram(
+    "llm_slot_wait_seconds", "LLM请求等待并发名额的时间", ["model"])
+LLM_INFLIGHT = REGISTRY.gauge(
+    "llm_inflight_requests", "正在发送或读取响应的LLM HTTP请求数", ["model"])
+LLM_RATE_LIMITED = REGISTRY.counter(
+    "llm_rate_limited", "LLM接口返回429的次数", ["model", "outcome"])
+
+AGENT_RUN_SECONDS = REGISTRY.histogram(
+    "agent_run_duration_seconds", "代理完成一次完整任务的耗时", ["agent", "operation"])
+AGENT_ERRORS = REGISTRY.counter(
+    "agent_errors", "代理执行失败次数", ["agent", "operation"])
+INVENTORY_TASK_SECONDS = REGISTRY.histogram(
+    "inventory_task_duration_seconds", "库存代理单个分析任务的耗时", ["task"])
+TOOL_CALLS = REGISTRY.counter(
+    "inventory_tool_calls", "库存分析工具调用次数", ["tool", "cache"])
+TOOL_SECONDS = REGISTRY.histogram(
+    "inventory_tool_duration_seconds", "库存分析工具耗时（含缓存查询）", ["tool", "cache"])
+
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram(
+    "embedding_batch_size", "微批处理合并的嵌入请求数", [], buckets=BATCH_BUCKETS)
+EMBEDDING_SECONDS = REGISTRY.histogram(
+    "embedding_encode_duration_seconds", "嵌入模型编码耗时", ["model"])
+EMBEDDING_CACHE = REGISTRY.counter(
+    "embedding_cache_lookups", "嵌入向量缓存查询的文本数", ["model", "result"])
+VECTOR_SEARCH_SECONDS = REGISTRY.histogram(
+    "vector_search_duration_seconds", "向量检索耗时", ["store"])
+RETRIEVAL_SECONDS = REGISTRY.histogram(
+    "retrieval_stage_duration_seconds", "客服文档混合检索各阶段耗时（dense、sparse、rerank）", ["stage"])
+
+CHAT_ANSWER_CACHE = REGISTRY.counter(
+    "chat_answer_cache_lookups", "客服问答语义缓存的查询次数", ["result"])
+CHAT_RESPONSE_SECONDS = REGISTRY.histogram(
+    "chat_response_duration_seconds", "客服问答的响应耗时，按是否命中语义缓存和实际处理路由区分", ["cache", "route"])
+CHAT_ROUTES = REGISTRY.counter(
+    "chat_routes", "客服问题的分流结果（chosen为分流器选择的路由，served为实际处理的路由）", ["chosen", "served"])
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_duration_seconds", "数据库操作耗时", ["operation"])
+
+EXTERNAL_REQUEST_SECONDS = REGISTRY.histogram(
+    "external_request_duration_seconds", "外部接口（微博、SerpAPI）请求耗时", ["service"])
+EXTERNAL_REQUEST_ERRORS = REGISTRY.counter(
+    "external_request_errors", "外部接口请求失败次数", ["service"])
+
+JOBS_SUBMITTED = REGISTRY.counter(
+    "jobs_submitted", "提交的后台任务数", ["kind", "deduplicated"])
+JOBS_FINISHED = REGISTRY.counter(
+    "jobs_finished", "结束的后台任务数", ["kind", "status"])
+JOB_SECONDS = REGISTRY.histogram(
+    "job_duration_seconds", "后台任务执行耗时", ["kind"])
+JOBS_INFLIGHT = REGISTRY.gauge(
+    "jobs_inflight", "排队或执行中的后台任务数", ["kind"])
@@ -0,0 +1,318 @@
+"""基于OpenTelemetry的轻量级span追踪
+
+默认关闭：未调用setup_tracing()或未设置TRACING_EXPORTER时，span()只返回一个空操作对象，
+开销仅为一次全局变量判断，不会导入opentelemetry。
+
+启用方式（在应用启动前设置环境变量）：
+    TRACING_EXPORTER=console   # 输出到标准输出
+    TRACING_EXPORTER=file      # 每个span一行JSON，写入TRACING_FILE（默认logs/traces.jsonl）
+    TRACING_EXPORTER=otlp      # 通过gRPC发送到OTEL_EXPORTER_OTLP_ENDPOINT
+
+用法：
+    with span("faiss.search", k=5) as s:
+        results = ...
+        s.set_attribute("results", len(results))
+
+    llm = ChatOpenAI(..., callbacks=llm_callbacks("chatbot"))  # LLM调用的耗时与token数
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "ecommerce-llm-toolset"
+
+# 启用后为opentelemetry的Tracer，关闭时为None
+_tracer = None
+_provider = None
+_setup_lock = threading.Lock()
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空span，同时充当上下文管理器"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_exception(self, exception, **kwargs):
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def _clean(attributes: Dict) -> Dict:
+    """span属性只能是基本类型，其余值转为字符串，None被忽略"""
+    return {
+        key: value if isinstance(value, (str, bool, int, float)) else str(value)
+        for key, value in attributes.items()
+        if value is not None
+    }
+
+
+def _file_exporter(path: str):
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return ConsoleSpanExporter(
+        service_name=SERVICE_NAME,
+        out=open(path, "a", encoding="utf-8"),
+        formatter=lambda s: s.to_json(indent=None) + "\n",
+    )
+
+
+def setup_tracing(exporter: Optional[str] = None, path: Optional[str] = None) -> bool:
+    """按exporter（默认取环境变量TRACING_EXPORTER）启用追踪，返回是否已启用
+
+    未安装opentelemetry时记录警告并保持关闭，重复调用不会重复初始化。
+    """
+    global _tracer, _provider
+    exporter = (exporter or os.environ.get("TRACING_EXPORTER", "")).strip().lower()
+    if not exporter or exporter == "none":
+        return is_enabled()
+
+    with _setup_lock:
+        if _tracer is not None:
+            return True
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+            if exporter == "console":
+                span_exporter = ConsoleSpanExporter(service_name=SERVICE_NAME)
+            elif exporter == "file":
+                span_exporter = _file_exporter(path or os.environ.get("TRACING_FILE", "logs/traces.jsonl"))
+            elif exporter == "otlp":
+                from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+                span_exporter = OTLPSpanExporter()
+            else:
+                logger.warning(f"未知的追踪导出方式: {exporter}，追踪保持关闭")
+                return False
+        except ImportError as e:
+            logger.warning(f"未安装opentelemetry，追踪保持关闭: {str(e)}")
+            return False
+
+        _provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        _provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        _tracer = _provider.get_tracer(__name__)
+        logger.info(f"已启用追踪，导出方式: {exporter}")
+        return True
+
+
+def shutdown_tracing():
+    """导出尚未发送的span并关闭追踪"""
+    global _tracer, _provider
+    with _setup_lock:
+        if _provider is not None:
+            _provider.shutdown()
+        _tracer = _provider = None
+
+
+def span(name: str, **attributes):
+    """开启一个span（作为当前span的子span），用作上下文管理器；追踪关闭时返回空span"""
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.start_as_current_span(name, attributes=_clean(attributes))
+
+
+def traced(name: Optional[str] = None):
+    """装饰器：每次调用函数时开启一个span，默认以函数的限定名命名"""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _tracer.start_as_current_span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def bind_context(fn):
+    """把当前追踪上下文绑定到fn上，使其在线程池中执行时产生的span仍挂在当前span之下"""
+    if _tracer is None:
+        return fn
+    from opentelemetry import context
+
+    parent = context.get_current()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = context.attach(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            context.detach(token)
+
+    return wrapper
+
+
+def start_span(name: str, **attributes):
+    """开启一个跨越多个回调的span并设为当前span，返回(span, token)，需配合end_span使用"""
+    if _tracer is None:
+        return None
+    from opentelemetry import context, trace
+
+    current = _tracer.start_span(name, attributes=_clean(attributes))
+    token = context.attach(trace.set_span_in_context(current))
+    return current, token
+
+
+def end_span(handle, error: Optional[BaseException] = None, **attributes):
+    """结束start_span开启的span，error不为空时记录异常并标记为失败"""
+    if handle is None:
+        return
+    from opentelemetry import context
+    from opentelemetry.trace import Status, StatusCode
+
+    current, token = handle
+    if attributes:
+        current.set_attributes(_clean(attributes))
+    if error is not None:
+        current.record_exception(error)
+        current.set_status(Status(StatusCode.ERROR, str(error)))
+    current.end()
+    context.detach(token)
+
+
+def record_exception(error: BaseException):
+    """在当前span上记录被捕获处理（没有向上抛出）的异常并标记为失败；追踪关闭时不做任何事"""
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    from opentelemetry.trace import Status, StatusCode
+
+    current = trace.get_current_span()
+    current.record_exception(error)
+    current.set_status(Status(StatusCode.ERROR, str(error)))
+
+
+_callback_handlers: Dict[str, object] = {}
+
+
+def _build_callback_handler(component: str):
+    """构造记录LLM调用的LangChain回调，首次使用时才导入langchain"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    from config.metrics import LLM_PROMPT_TOKENS, LLM_REQUEST_SECONDS, LLM_REQUESTS, LLM_TOKENS
+
+    class LLMCallbackHandler(BaseCallbackHandler):
+        """记录每次LLM调用的次数、耗时和token数指标；启用追踪时同时记录一个llm.call span
+
+        LangChain的回调可能在不同线程中开始和结束，调用状态按run_id保存，不依赖当前上下文。
+        """
+
+        def __init__(self):
+            self._runs = {}
+            self._lock = threading.Lock()
+
+        def _start(self, run_id, kwargs, prompt_chars):
+            params = kwargs.get("invocation_params") or {}
+            model = params.get("model_name") or params.get("model") or "unknown"
+            current = None
+            if _tracer is not None:
+                current = _tracer.start_span("llm.call", attributes=_clean({
+                    "llm.component": component,
+                    "llm.model": model,
+                    "llm.type": params.get("_type"),
+                    "llm.prompt_chars": prompt_chars,
+                }))
+            with self._lock:
+                self._runs[run_id] = (time.perf_counter(), model, current)
+
+        def _finish(self, run_id, status):
+            with self._lock:
+                run = self._runs.pop(run_id, None)
+            if run is None:
+                return None, None
+            started, model, current = run
+            LLM_REQUESTS.inc(component=component, model=model, status=status)
+            LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, component=component, model=model)
+            return model, current
+
+        def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+            self._start(run_id, kwargs, sum(len(p) for p in prompts))
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+            chars = sum(len(str(m.content)) for batch in messages for m in batch)
+            self._start(run_id, kwargs, chars)
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            model, current = self._finish(run_id, "ok")
+            if model is None:
+                return
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            if not usage:
+                # 流式调用或新版本的模型在消息的usage_metadata中返回用量
+                for generations in response.generations:
+                    for generation in generations:
+                        metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                        if metadata:
+                            usage = {
+                                "prompt_tokens": metadata.get("input_tokens"),
+                                "completion_tokens": metadata.get("output_tokens"),
+                                "total_tokens": metadata.get("total_tokens"),
+                            }
+            for kind in ("prompt", "completion"):
+                if usage.get(f"{kind}_tokens"):
+                    LLM_TOKENS.inc(usage[f"{kind}_tokens"], component=component, model=model, type=kind)
+            if usage.get("prompt_tokens"):
+                LLM_PROMPT_TOKENS.observe(usage["prompt_tokens"], component=component)
+            if current is not None:
+                current.set_attributes(_clean({
+                    "llm.prompt_tokens": usage.get("prompt_tokens"),
+                    "llm.completion_tokens": usage.get("completion_tokens"),
+                    "llm.total_tokens": usage.get("total_tokens"),
+                }))
+                current.end()
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            _, current = self._finish(run_id, "error")
+            if current is not None:
+                from opentelemetry.trace import Status, StatusCode
+
+                current.record_exception(error)
+                current.set_status(Status(StatusCode.ERROR, str(error)))
+                current.end()
+
+    return LLMCallbackHandler()
+
+
+def llm_callbacks(component: str = "default") -> List:
+    """传给ChatOpenAI(callbacks=...)的回调列表，component为指标和span中区分调用方的标签
+
+    指标始终记录；追踪关闭时不创建span。
+    """
+    with _setup_lock:
+        if component not in _callback_handlers:
+            _callback_handlers[component] = _build_callback_handler(component)
+        return [_callback_handlers[component]]
@@ -1,73 +1,171 @@
-import random
+"""生成库存测试数据
+
+可复现（固定seed时结果相同，与worker数量无关）、可扩展到百万级：
+各字段用NumPy批量生成，时间戳按日内流量分布散布在截止到end（默认为当前时间）的days天内，
+需要时间戳也完全相同时用--end指定截止日期；
+每个分块在一个事务内用executemany写入；workers>1时由子进程并行生成分块，主进程负责写入。
+同时作为数据库基准测试的数据源（见benchmarks/）。
+
+用法（在项目根目录执行）：
+    python -m data.populate_inventory --rows 1000000 --workers 4 --seed 42
+    python -m data.populate_inventory --rows 1000000 --seed 42 --end 2025-01-01
+"""
+import argparse
+import math
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+
 from database.db import InventoryDB
-from datetime import datetime
-import json
-
-def generate_random_product():
-    """生成随机产品名称（限制长度不超过100字符）"""
-    categories = {
-        '花卉': ['玫瑰', '郁金香', '兰花', '向日葵', '牡丹', '百合', '菊花', '茉莉', '康乃馨', '薰衣草'],
-        '服装': ['T恤', '衬衫', '连衣裙', '牛仔裤', '夹克', '毛衣', '西装', '裙子', '短裤', '风衣'],
-        '电子': ['手机', '平板', '电脑', '耳机', '手表', '相机', '游戏机', '充电宝', '音箱', '路由器'],
-        '食品': ['巧克力', '饼干', '茶叶', '咖啡', '坚果', '蜂蜜', '罐头', '调味品', '面包', '糖果'],
-        '家居': ['枕头', '被子', '床单', '毛巾', '餐具', '灯具', '地毯', '窗帘', '收纳盒', '置物架']
-    }
-    
-    category = random.choice(list(categories.keys()))
-    product = f"{random.choice(categories[category])}-{category}-{random.choice(['A', 'B', 'C', 'D', 'E'])}"
-    return product[:100]  # 确保不超过100字符
-
-def generate_random_factors():
-    """生成随机因素（限制JSON长度不超过1000字符）"""
-    factors = {
-        "需求": random.randint(50, 500),
-        "效率": round(random.uniform(0.5, 1.0), 2),
-        "成本": round(random.uniform(10.0, 100.0), 2),
-        "季节": random.choice(['高', '中', '低'])
-    }
-    return json.dumps(factors, ensure_ascii=False)[:1000]
-
-def generate_random_strategy():
-    """生成随机策略（限制长度不超过500字符）"""
-    strategy = {
-        "定价": random.choice(['竞争', '溢价', '折扣']),
-        "营销": random.choice(['广告', '社媒', '邮件', 'SEO']),
-        "分销": random.choice(['直销', '批发', '零售']),
-        "库存": random.choice(['JIT', '批量', '代发'])
-    }
-    return json.dumps(strategy, ensure_ascii=False)[:500]
-
-def generate_random_logistics():
-    """生成随机物流信息（限制长度不超过500字符）"""
-    logistics = {
-        "仓库": random.choice(['北京', '上海', '广州', '深圳', '成都']),
-        "运输": random.choice(['空运', '海运', '陆运', '铁路']),
-        "时效": random.randint(1, 30),
-        "成本": round(random.uniform(10.0, 200.0), 2)
+
+CATEGORIES = {
+    '花卉': ['玫瑰', '郁金香', '兰花', '向日葵', '牡丹', '百合', '菊花', '茉莉', '康乃馨', '薰衣草'],
+    '服装': ['T恤', '衬衫', '连衣裙', '牛仔裤', '夹克', '毛衣', '西装', '裙子', '短裤', '风衣'],
+    '电子': ['手机', '平板', '电脑', '耳机', '手表', '相机', '游戏机', '充电宝', '音箱', '路由器'],
+    '食品': ['巧克力', '饼干', '茶叶', '咖啡', '坚果', '蜂蜜', '罐头', '调味品', '面包', '糖果'],
+    '家居': ['枕头', '被子', '床单', '毛巾', '餐具', '灯具', '地毯', '窗帘', '收纳盒', '置物架']
+}
+VARIANTS = ['A', 'B', 'C', 'D', 'E']
+SEASONS = ['高', '中', '低']
+PRICING = ['竞争', '溢价', '折扣']
+MARKETING = ['广告', '社媒', '邮件', 'SEO']
+DISTRIBUTION = ['直销', '批发', '零售']
+STOCK_MODES = ['JIT', '批量', '代发']
+WAREHOUSES = ['北京', '上海', '广州', '深圳', '成都']
+TRANSPORTS = ['空运', '海运', '陆运', '铁路']
+
+# 所有产品名：(产品名, 类目)，按类目、名称、型号展开
+PRODUCTS = [
+    (f"{name}-{category}-{variant}", category)
+    for category, names in CATEGORIES.items()
+    for name in names
+    for variant in VARIANTS
+]
+
+# 各小时产生记录的相对权重：凌晨最少，白天和晚间较多
+HOURLY_WEIGHTS = np.array([
+    1, 1, 1, 1, 1, 2, 3, 5, 7, 9, 10, 10,
+    9, 9, 10, 10, 9, 8, 8, 9, 10, 8, 5, 3
+], dtype=float)
+HOURLY_WEIGHTS /= HOURLY_WEIGHTS.sum()
+
+
+def _choice(rng, options, size):
+    return np.asarray(options, dtype=object)[rng.integers(0, len(options), size)].tolist()
+
+
+def _timestamps(rng, size, window_start: datetime, window_seconds: float):
+    """在时间窗口内生成有序的时间戳：日期均匀分布，小时按HOURLY_WEIGHTS分布"""
+    days = max(1, math.ceil(window_seconds / 86400))
+    offsets = (
+        rng.integers(0, days, size) * 86400
+        + rng.choice(24, size, p=HOURLY_WEIGHTS) * 3600
+        + rng.integers(0, 3600, size)
+    )
+    # 多于窗口的部分折回窗口内，保证分块之间的时间段不重叠
+    offsets = np.sort(offsets % max(1, int(window_seconds)))
+    base = np.datetime64(window_start.replace(microsecond=0), "s")
+    return np.datetime_as_string(base + offsets.astype("timedelta64[s]"), unit="s").tolist()
+
+
+def generate_chunk(chunk_index: int, size: int, chunk_count: int, seed: int = 42,
+                   days: int = 365, end: datetime = None) -> list:
+    """生成一个分块的记录，返回InventoryDB.insert_rows所需的元组列表
+
+    每个分块使用由(seed, chunk_index)派生的独立随机数流，并占据时间范围中的第chunk_index段，
+    因此结果只取决于seed和分块划分，与由哪个进程生成无关。
+    """
+    rng = np.random.default_rng([seed, chunk_index])
+    end = end or datetime.now()
+    window_seconds = days * 86400 / chunk_count
+    window_start = end - timedelta(days=days) + timedelta(seconds=window_seconds * chunk_index)
+
+    product_index = rng.integers(0, len(PRODUCTS), size)
+    columns = {
+        "timestamp": _timestamps(rng, size, window_start, window_seconds),
+        "product": [PRODUCTS[i][0] for i in product_index.tolist()],
+        "category": [PRODUCTS[i][1] for i in product_index.tolist()],
+        "demand": rng.integers(50, 501, size).tolist(),
+        "efficiency": np.round(rng.uniform(0.5, 1.0, size), 2).tolist(),
+        "cost": np.round(rng.uniform(10.0, 100.0, size), 2).tolist(),
+        "season_level": _choice(rng, SEASONS, size),
+        "pricing": _choice(rng, PRICING, size),
+        "marketing": _choice(rng, MARKETING, size),
+        "distribution": _choice(rng, DISTRIBUTION, size),
+        "stock_mode": _choice(rng, STOCK_MODES, size),
+        "warehouse": _choice(rng, WAREHOUSES, size),
+        "transport": _choice(rng, TRANSPORTS, size),
+        "lead_time_days": rng.integers(1, 31, size).tolist(),
+        "shipping_cost": np.round(rng.uniform(10.0, 200.0, size), 2).tolist(),
     }
-    return json.dumps(logistics, ensure_ascii=False)[:500]
+    # JSON字段与json.dumps(..., ensure_ascii=False)的输出格式一致，直接格式化比逐行dumps快得多
+    columns["factors"] = [
+        f'{{"需求": {d}, "效率": {e}, "成本": {c}, "季节": "{s}"}}'
+        for d, e, c, s in zip(columns["demand"], columns["efficiency"],
+                              columns["cost"], columns["season_level"])
+    ]
+    columns["strategy"] = [
+        f'{{"定价": "{p}", "营销": "{m}", "分销": "{d}", "库存": "{s}"}}'
+        for p, m, d, s in zip(columns["pricing"], columns["marketing"],
+                              columns["distribution"], columns["stock_mode"])
+    ]
+    columns["logistics"] = [
+        f'{{"仓库": "{w}", "运输": "{t}", "时效": {l}, "成本": {c}}}'
+        for w, t, l, c in zip(columns["warehouse"], columns["transport"],
+                              columns["lead_time_days"], columns["shipping_cost"])
+    ]
+    return list(zip(*(columns[column] for column in InventoryDB.INSERT_COLUMNS)))
+
+
+def _generate_chunk(args):
+    return generate_chunk(*args)
+
+
+def populate(db: InventoryDB, rows: int, seed: int = 42, chunk_size: int = 50000,
+             workers: int = 1, days: int = 365, end: datetime = None) -> int:
+    """向数据库写入rows条生成的记录，返回写入条数；end默认为当前时间"""
+    end = end or datetime.now()  # 在主进程中确定一次，各分块（子进程）使用相同的截止时间
+    chunk_count = max(1, math.ceil(rows / chunk_size))
+    tasks = [
+        (i, min(chunk_size, rows - i * chunk_size), chunk_count, seed, days, end)
+        for i in range(chunk_count)
+        if rows - i * chunk_size > 0
+    ]
+    written = 0
+    if workers > 1:
+        with Pool(workers) as pool:
+            # imap保持分块顺序，写入（单写者）与子进程的生成并行进行
+            for chunk in pool.imap(_generate_chunk, tasks):
+                written += db.insert_rows(chunk)
+    else:
+        for task in tasks:
+            written += db.insert_rows(_generate_chunk(task))
+    return written
+
 
 def main():
-    db = InventoryDB()
-    records = []
-    timestamp = datetime.now().isoformat()[:50]  # 确保时间戳不超过50字符
-
-    for i in range(100):
-        record = {
-            "timestamp": timestamp,
-            "product": generate_random_product(),
-            "factors": generate_random_factors(),
-            "strategy": generate_random_strategy(),
-            "logistics": generate_random_logistics()
-        }
-        records.append(record)
-        print(f"准备添加记录 {i+1}/100: {record['product']}")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=50000, help="每个分块（一个事务）的记录数")
+    parser.add_argument("--workers", type=int, default=1, help="生成数据的进程数")
+    parser.add_argument("--days", type=int, default=365, help="时间戳分布的天数")
+    parser.add_argument("--end", type=datetime.fromisoformat,
+                        help="时间戳的截止时间（如2025-01-01），默认为当前时间；固定后结果完全可复现")
+    parser.add_argument("--db", default="data/inventory.db")
+    args = parser.parse_args()
 
+    db = InventoryDB(args.db)
+    start = time.perf_counter()
     try:
-        db.add_records(records)
-        print("成功批量添加 100 条记录到数据库。")
+        written = populate(db, args.rows, args.seed, args.chunk_size, args.workers, args.days, args.end)
+        elapsed = time.perf_counter() - start
+        print(f"成功添加 {written} 条记录到数据库，耗时 {elapsed:.1f}s（{written / elapsed:.0f} 条/秒）。")
     except Exception as e:
         print(f"添加记录时出错: {e}")
 
+
 if __name__ == "__main__":
     main()
@@ -1,116 +1,653 @@
 import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
 import json
+import logging
 import os
+import threading
+import time
+
+from config.metrics import DB_QUERY_SECONDS, timer
+from config.tracing import traced
+from database.fields import structured_fields
+from database.migrations import STRUCTURED_COLUMN_NAMES, add_column_if_missing, migrate
+from database.search import build_match_query, cjk_bigrams
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """SQLite连接池：每个线程复用一个长连接
+
+    连接以autocommit模式打开，写操作通过transaction()显式开启事务，
+    嵌套的transaction()会并入最外层事务，便于批量写入。
+    连接打开时统一设置WAL、synchronous=NORMAL、页缓存和mmap，并注册全文索引使用的分词函数，
+    长连接上sqlite3模块的语句缓存也能被复用，避免重复编译SQL。
+    """
+
+    def __init__(self, db_path: str, cache_size_kb: int = 20000,
+                 mmap_size: int = 256 * 1024 * 1024, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # 由transaction()显式管理事务
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        # 全文索引的同步触发器依赖该函数
+        conn.create_function("cjk_bigrams", 1, cjk_bigrams, deterministic=True)
+        return conn
+
+    def get(self) -> sqlite3.Connection:
+        """获取当前线程的连接；fork出的子进程会重新建立连接"""
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            local.conn = self._connect()
+            local.pid = os.getpid()
+            local.depth = 0
+        return local.conn
+
+    @contextmanager
+    def connection(self):
+        """用于只读查询的连接"""
+        yield self.get()
+
+    @contextmanager
+    def transaction(self):
+        """写事务，异常时回滚；嵌套调用时只有最外层提交"""
+        conn = self.get()
+        local = self._local
+        if local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            local.depth -= 1
+            if local.depth == 0 and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        if local.depth > 1:
+            local.depth -= 1
+            return
+        try:
+            conn.execute("COMMIT")
+        except BaseException:
+            # COMMIT失败（如SQLITE_BUSY）时事务仍未结束，回滚后连接才能继续使用
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            local.depth = 0
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """同一数据库文件在进程内共享一个连接池"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path)
+        return _pools[key]
+
+
+class InventoryRecord:
+    """一条库存记录的紧凑表示
+
+    使用__slots__避免每行一个字典；factors在首次访问时才做JSON解码。
+    未在投影中选择的列为None。
+    """
+
+    __slots__ = ("id", "timestamp", "product", "_factors", "_factors_decoded", "strategy", "logistics")
+
+    COLUMNS = ("id", "timestamp", "product", "factors", "strategy", "logistics")
+
+    def __init__(self, id, timestamp, product=None, factors=None, strategy=None, logistics=None):
+        self.id = id
+        self.timestamp = timestamp
+        self.product = product
+        self._factors = factors
+        self._factors_decoded = factors is None
+        self.strategy = strategy
+        self.logistics = logistics
+
+    @property
+    def factors(self):
+        if not self._factors_decoded:
+            self._factors = json.loads(self._factors)
+            self._factors_decoded = True
+        return self._factors
+
+    @property
+    def cursor(self):
+        """以该记录为起点继续翻页的游标"""
+        return (self.timestamp, self.id)
+
+    def to_dict(self) -> dict:
+        return {column: getattr(self, column) for column in self.COLUMNS}
+
+    def __repr__(self):
+        return f"InventoryRecord(id={self.id!r}, timestamp={self.timestamp!r}, product={self.product!r})"
+
 
 class InventoryDB:
     def __init__(self, db_path="data/inventory.db"):
         # 确保目录存在
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self._init_db()
+
+    def transaction(self):
+        """显式事务，可将多次add_record合并为一次提交：
+
+        with db.transaction():
+            for record in records:
+                db.add_record(record)
+        """
+        return self.pool.transaction()
     
     def _init_db(self):
-        """初始化数据库表"""
-        with sqlite3.connect(self.db_path) as conn:
-            # 删除旧表
-            conn.execute("DROP TABLE IF EXISTS inventory_records")
-            
-            # 创建新表，添加字段长度限制
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS inventory_records (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL CHECK(length(timestamp) <= 50),
-                    product TEXT NOT NULL CHECK(length(product) <= 100),
-                    factors TEXT NOT NULL CHECK(length(factors) <= 1000),
-                    strategy TEXT NOT NULL CHECK(length(strategy) <= 500),
-                    logistics TEXT NOT NULL CHECK(length(logistics) <= 500)
-                )
-            """)
-            
-            # 创建索引优化查询
-            conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_product 
-                ON inventory_records(product)
-            """)
-            conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_timestamp 
-                ON inventory_records(timestamp)
-            """)
+        """按版本升级数据库结构，已是最新版本时只检查版本号，不会重建表或丢失数据"""
+        self.schema_version = migrate(self.pool)
     
+    # 可用于聚合、分组和过滤的列（均为真实列，分组/过滤可走索引）
+    AGGREGATE_COLUMNS = ("product", *STRUCTURED_COLUMN_NAMES)
+    AGGREGATE_FUNCS = {"avg": "AVG", "sum": "SUM", "min": "MIN", "max": "MAX", "count": "COUNT"}
+    FILTER_OPS = {"eq": "=", "ne": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "in": "IN"}
+    INSERT_COLUMNS = ("timestamp", "product", "factors", "strategy", "logistics", *STRUCTURED_COLUMN_NAMES)
+    _INSERT_SQL = f"""
+        INSERT INTO inventory_records ({", ".join(INSERT_COLUMNS)})
+        VALUES ({", ".join("?" * len(INSERT_COLUMNS))})
+    """
+
+    @staticmethod
+    def _encode_json(value) -> str:
+        """JSON字段的存储格式：已是JSON的字符串原样保存，避免重复编码"""
+        if isinstance(value, str):
+            try:
+                json.loads(value)
+                return value
+            except ValueError:
+                pass
+        return json.dumps(value, ensure_ascii=False)
+
+    def _record_row(self, record: dict, default_logistics: str) -> tuple:
+        factors = record.get("factors", {})
+        strategy = record.get("strategy", "")
+        logistics = record.get("logistics", default_logistics)
+        fields = structured_fields(record["product"], factors, strategy, logistics)
+        return (
+            record.get("timestamp", datetime.now().isoformat()),
+            record["product"],
+            self._encode_json(factors),
+            strategy,
+            logistics,
+            *(fields[column] for column in STRUCTURED_COLUMN_NAMES)
+        )
+
+    @traced("sqlite.add_record")
+    @timer(DB_QUERY_SECONDS, operation="add_record")
     def add_record(self, record_data: dict):
-        """添加新记录，确保字段名匹配"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO inventory_records 
-                (timestamp, product, factors, strategy, logistics)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                record_data.get("timestamp", datetime.now().isoformat()),
-                record_data["product"],
-                json.dumps(record_data.get("factors", {}), ensure_ascii=False),
-                record_data.get("strategy", ""),
-                record_data.get("logistics", "默认物流方案")
-            ))
+        """添加新记录，确保字段名匹配；同时写入从JSON字段提取出的结构化列"""
+        with self.pool.transaction() as conn:
+            conn.execute(self._INSERT_SQL, self._record_row(record_data, "默认物流方案"))
     
+    @traced("sqlite.add_records")
+    @timer(DB_QUERY_SECONDS, operation="add_records")
     def add_records(self, records: list):
         """批量添加记录"""
-        with sqlite3.connect(self.db_path) as conn:
-            data_to_insert = [
-                (
-                    record.get("timestamp", datetime.now().isoformat()),
-                    record["product"],
-                    json.dumps(record.get("factors", {}), ensure_ascii=False),
-                    record.get("strategy", ""),
-                    record.get("logistics", "")
-                )
-                for record in records
-            ]
-            conn.executemany("""
-                INSERT INTO inventory_records 
-                (timestamp, product, factors, strategy, logistics)
-                VALUES (?, ?, ?, ?, ?)
-            """, data_to_insert)
+        with self.pool.transaction() as conn:
+            conn.executemany(self._INSERT_SQL, [self._record_row(record, "") for record in records])
     
+    @traced("sqlite.insert_rows")
+    @timer(DB_QUERY_SECONDS, operation="insert_rows")
+    def insert_rows(self, rows: list, chunk_size: int = 10000) -> int:
+        """批量导入已按INSERT_COLUMNS顺序排好的行（结构化列由调用方提供，不再解析JSON）
+
+        所有行在一个事务内分块executemany写入，返回写入条数。
+        """
+        with self.pool.transaction() as conn:
+            for start in range(0, len(rows), chunk_size):
+                conn.executemany(self._INSERT_SQL, rows[start:start + chunk_size])
+        return len(rows)
+
+    @traced("sqlite.aggregate")
+    @timer(DB_QUERY_SECONDS, operation="aggregate")
+    def aggregate(self, metric: str = None, func: str = "count", group_by=None, filters: dict = None):
+        """在SQL中完成过滤、分组和聚合，返回字典列表
+
+        metric/group_by/过滤字段取自AGGREGATE_COLUMNS，func取自AGGREGATE_FUNCS（默认count）；
+        func为count时metric可省略（统计行数）。过滤条件用"列名__操作符"表示，例如：
+
+        db.aggregate("shipping_cost", "avg", group_by="warehouse")
+        db.aggregate("demand", "count", filters={"category": "花卉", "demand__gt": 300})
+        """
+        sql_func = self.AGGREGATE_FUNCS.get(func)
+        if sql_func is None:
+            raise ValueError(f"不支持的聚合函数: {func}")
+        if metric is None and func != "count":
+            raise ValueError("除count外的聚合函数需要指定metric")
+        if isinstance(group_by, str):
+            group_by = [group_by]
+        group_by = list(group_by or [])
+        for column in ([metric] if metric else []) + group_by:
+            self._check_column(column)
+
+        where, params = self._build_filters(filters or {})
+        select = [*group_by, f"{sql_func}({metric or '*'}) AS value", "COUNT(*) AS count"]
+        sql = f"SELECT {', '.join(select)} FROM inventory_records"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        if group_by:
+            columns = ", ".join(group_by)
+            sql += f" GROUP BY {columns} ORDER BY {columns}"
+
+        with self.pool.connection() as conn:
+            cursor = conn.execute(sql, params)
+            names = [description[0] for description in cursor.description]
+            return [dict(zip(names, row)) for row in cursor]
+
+    def _check_column(self, column: str):
+        if column not in self.AGGREGATE_COLUMNS:
+            raise ValueError(f"不支持的字段: {column}")
+
+    def _build_filters(self, filters: dict):
+        where, params = [], []
+        for key, value in filters.items():
+            column, _, op = key.partition("__")
+            self._check_column(column)
+            sql_op = self.FILTER_OPS.get(op or "eq")
+            if sql_op is None:
+                raise ValueError(f"不支持的过滤操作: {op}")
+            if sql_op == "IN":
+                values = list(value)
+                if not values:
+                    where.append("0")
+                    continue
+                where.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif value is None and sql_op in ("=", "!="):
+                where.append(f"{column} IS {'NOT ' if sql_op == '!=' else ''}NULL")
+            else:
+                where.append(f"{column} {sql_op} ?")
+                params.append(value)
+        return where, params
+
+    def iter_records(self, columns=None, cursor=None, batch_size: int = 1000, limit: int = None):
+        """按(timestamp, id)从新到旧流式遍历记录，逐条产出InventoryRecord
+
+        使用键集分页：每批只查询游标之后的batch_size条，不使用OFFSET，也不会长时间持有读事务，
+        遍历整表的内存占用与表大小无关。columns为要读取的列（id和timestamp总会读取），
+        cursor为上一页最后一条记录的record.cursor，limit限制总条数。
+        """
+        select = self._projection(columns)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            rows = self._fetch_page(select, cursor, size)
+            for row in rows:
+                yield InventoryRecord(*row)
+            if len(rows) < size:
+                return
+            cursor = (rows[-1][1], rows[-1][0])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    @traced("sqlite.fetch_page")
+    @timer(DB_QUERY_SECONDS, operation="fetch_page")
+    def _fetch_page(self, select: str, cursor, size: int) -> list:
+        """读取游标之后的一页
+
+        (timestamp, id) < (?, ?) 的行值比较只能在索引上按timestamp定位，同一时间戳的记录很多时
+        （例如批量导入）每页都要从头扫描；这里拆成两次查询，分别走 timestamp = ? AND rowid < ?
+        和 timestamp < ? 的索引区间，每页的代价与页大小成正比。
+        """
+        with self.pool.connection() as conn:
+            if cursor is None:
+                return conn.execute(f"""
+                    SELECT {select} FROM inventory_records
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT ?
+                """, (size,)).fetchall()
+
+            timestamp, last_id = cursor
+            rows = conn.execute(f"""
+                SELECT {select} FROM inventory_records
+                WHERE timestamp = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+            """, (timestamp, last_id, size)).fetchall()
+            if len(rows) < size:
+                rows += conn.execute(f"""
+                    SELECT {select} FROM inventory_records
+                    WHERE timestamp < ?
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT ?
+                """, (timestamp, size - len(rows))).fetchall()
+            return rows
+
+    def get_records_page(self, limit: int = 20, cursor=None, columns=None):
+        """获取一页记录，返回(记录列表, 下一页游标)；没有更多记录时游标为None"""
+        if limit < 1:
+            raise ValueError(f"limit必须为正整数: {limit}")
+        records = list(self.iter_records(columns, cursor, batch_size=limit + 1, limit=limit + 1))
+        if len(records) > limit:
+            return records[:limit], records[limit - 1].cursor
+        return records, None
+
+    def export_jsonl(self, fp, columns=None, batch_size: int = 1000) -> int:
+        """将记录逐行以JSON写入文件对象，内存占用恒定，返回写入条数"""
+        count = 0
+        for record in self.iter_records(columns, batch_size=batch_size):
+            data = record.to_dict()
+            if columns is not None:
+                data = {column: data[column] for column in ("id", "timestamp", *columns)}
+            fp.write(json.dumps(data, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+
+    def _projection(self, columns) -> str:
+        """InventoryRecord构造参数顺序的SELECT列表；未选择的列以NULL占位"""
+        if columns is None:
+            return ", ".join(InventoryRecord.COLUMNS)
+        unknown = set(columns) - set(InventoryRecord.COLUMNS)
+        if unknown:
+            raise ValueError(f"不支持的字段: {', '.join(sorted(unknown))}")
+        wanted = {"id", "timestamp", *columns}
+        return ", ".join(column if column in wanted else "NULL" for column in InventoryRecord.COLUMNS)
+
     def get_recent_records(self, limit: int = 5):
         """获取最近的记录"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                SELECT * FROM inventory_records 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            """, (limit,))
-            
-            records = []
-            for row in cursor:
-                records.append({
-                    "id": row[0],
-                    "timestamp": row[1],
-                    "product": row[2],
-                    "factors": json.loads(row[3]),
-                    "strategy": row[4],
-                    "logistics": row[5]
-                })
-            return records
+        return [record.to_dict() for record in self.iter_records(limit=limit, batch_size=limit)]
     
+    # 全文检索中各列的bm25权重：产品名命中比策略、物流文本更相关
+    SEARCH_WEIGHTS = (10.0, 1.0, 1.0)
+
+    @traced("sqlite.search_records")
+    @timer(DB_QUERY_SECONDS, operation="search_records")
     def search_records(self, query: str, limit: int = 3):
-        """搜索相关记录"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("""
-                SELECT * FROM inventory_records 
-                WHERE product LIKE ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            """, (f"%{query}%", limit))
-            
-            records = []
-            for row in cursor:
-                records.append({
-                    "id": row[0],
-                    "timestamp": row[1],
-                    "product": row[2],
-                    "factors": json.loads(row[3]),
-                    "strategy": row[4],
-                    "logistics": row[5]
-                })
-            return records
+        """在产品名、策略和物流信息中全文检索，按bm25相关度排序，相关度相同时较新的记录优先
+
+        中文按二元组切分建立索引，关键词之间以空格分隔（AND）；
+        含有单个汉字的关键词无法使用索引，退化为三列上的LIKE查询并按时间排序。
+        """
+        match = build_match_query(query)
+        with self.pool.connection() as conn:
+            if match is not None:
+                cursor = conn.execute(f"""
+                    SELECT r.id, r.timestamp, r.product, r.factors, r.strategy, r.logistics
+                    FROM inventory_fts
+                    JOIN inventory_records r ON r.id = inventory_fts.rowid
+                    WHERE inventory_fts MATCH ?
+                    ORDER BY bm25(inventory_fts, {", ".join(map(str, self.SEARCH_WEIGHTS))}),
+                             r.timestamp DESC, r.id DESC
+                    LIMIT ?
+                """, (match, limit))
+            else:
+                where, params = [], []
+                for term in query.split() or [query]:
+                    where.append("(product LIKE ? OR strategy LIKE ? OR logistics LIKE ?)")
+                    params.extend([f"%{term}%"] * 3)
+                cursor = conn.execute(f"""
+                    SELECT id, timestamp, product, factors, strategy, logistics
+                    FROM inventory_records
+                    WHERE {" AND ".join(where)}
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT ?
+                """, (*params, limit))
+
+            return [InventoryRecord(*row).to_dict() for row in cursor]
+
+
+class AnalysisCache:
+    """LLM分析结果的TTL缓存
+
+    与库存记录共用同一个SQLite文件，缓存在进程重启后依然有效，并由多个worker共享。
+    缓存读写失败只记录日志，不影响正常分析流程。
+    """
+
+    def __init__(self, db_path="data/inventory.db"):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        """初始化缓存表"""
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    tool TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_analysis_cache_expires
+                ON analysis_cache(expires_at)
+            """)
+
+    @traced("sqlite.analysis_cache.get")
+    @timer(DB_QUERY_SECONDS, operation="analysis_cache.get")
+    def get(self, cache_key: str):
+        """获取未过期的缓存值，不存在时返回None"""
+        try:
+            with self.pool.connection() as conn:
+                row = conn.execute("""
+                    SELECT value FROM analysis_cache
+                    WHERE cache_key = ? AND expires_at > ?
+                """, (cache_key, time.time())).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.warning(f"读取分析缓存失败: {str(e)}")
+            return None
+
+    @traced("sqlite.analysis_cache.set")
+    @timer(DB_QUERY_SECONDS, operation="analysis_cache.set")
+    def set(self, cache_key: str, tool: str, value: str, ttl: float):
+        """写入缓存，ttl单位为秒"""
+        now = time.time()
+        try:
+            with self.pool.transaction() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO analysis_cache
+                    (cache_key, tool, value, created_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (cache_key, tool, value, now, now + ttl))
+        except sqlite3.Error as e:
+            logger.warning(f"写入分析缓存失败: {str(e)}")
+
+    def purge_expired(self) -> int:
+        """删除过期的缓存，返回删除条数"""
+        with self.pool.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM analysis_cache WHERE expires_at <= ?", (time.time(),)
+            )
+            return cursor.rowcount
+
+
+class JobStore:
+    """后台任务的状态与结果存储
+
+    与库存记录共用同一个SQLite文件，多个worker进程可以查询彼此提交的任务。
+    """
+
+    ACTIVE_STATUSES = ("queued", "running")
+
+    def __init__(self, db_path="data/inventory.db"):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        """初始化任务表"""
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    dedup_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_jobs_dedup
+                ON jobs(dedup_key, status)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_jobs_expires
+                ON jobs(expires_at)
+            """)
+            # 执行任务的进程ID，用于识别进程退出后遗留的任务
+            add_column_if_missing(conn, "jobs", "owner_pid", "INTEGER")
+
+    def create(self, job_id: str, kind: str, dedup_key: str, payload: dict):
+        now = time.time()
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                INSERT INTO jobs
+                (job_id, kind, dedup_key, status, payload, created_at, updated_at, owner_pid)
+                VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)
+            """, (job_id, kind, dedup_key, json.dumps(payload, ensure_ascii=False), now, now, os.getpid()))
+
+    def find_active(self, dedup_key: str, stale_after: float):
+        """查找相同输入且仍在排队或执行中的任务ID；超过stale_after秒未更新的任务视为已失效"""
+        with self.pool.connection() as conn:
+            row = conn.execute("""
+                SELECT job_id FROM jobs
+                WHERE dedup_key = ? AND status IN (?, ?) AND updated_at > ?
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, (dedup_key, *self.ACTIVE_STATUSES, time.time() - stale_after)).fetchone()
+            return row[0] if row else None
+
+    def create_unless_active(self, job_id: str, kind: str, dedup_key: str, payload: dict,
+                             stale_after: float):
+        """在同一个写事务内查找相同输入的进行中任务，没有时创建新任务，返回(任务ID, 是否新建)
+
+        BEGIN IMMEDIATE会先取得写锁，多个进程同时提交相同输入时只有一个会创建任务，其余合并到该任务。
+        """
+        with self.pool.transaction():
+            existing = self.find_active(dedup_key, stale_after)
+            if existing:
+                return existing, False
+            self.create(job_id, kind, dedup_key, payload)
+        return job_id, True
+
+    def mark_running(self, job_id: str):
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                UPDATE jobs SET status = 'running', updated_at = ?
+                WHERE job_id = ?
+            """, (time.time(), job_id))
+
+    def mark_finished(self, job_id: str, status: str, ttl: float, result=None, error: str = None):
+        """记录任务结果，结果保留ttl秒"""
+        now = time.time()
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                UPDATE jobs
+                SET status = ?, result = ?, error = ?, updated_at = ?, expires_at = ?
+                WHERE job_id = ?
+            """, (
+                status,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error,
+                now,
+                now + ttl,
+                job_id
+            ))
+
+    def active_owners(self) -> list:
+        """仍有排队或执行中任务的进程ID（旧版本创建的任务为None）"""
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute("""
+                SELECT DISTINCT owner_pid FROM jobs WHERE status IN (?, ?)
+            """, self.ACTIVE_STATUSES)]
+
+    def fail_abandoned(self, error: str, ttl: float, owners=(), updated_before: float = None) -> int:
+        """把不会再完成的排队/执行中任务标记为失败，返回标记的条数
+
+        owners为已退出的进程ID（None表示没有记录进程ID的任务），updated_before之前没有更新的任务同样视为已中断。
+        """
+        conditions, params = [], []
+        pids = [owner for owner in owners if owner is not None]
+        if pids:
+            conditions.append(f"owner_pid IN ({', '.join('?' * len(pids))})")
+            params.extend(pids)
+        if None in owners:
+            conditions.append("owner_pid IS NULL")
+        if updated_before is not None:
+            conditions.append("updated_at < ?")
+            params.append(updated_before)
+        if not conditions:
+            return 0
+
+        now = time.time()
+        with self.pool.transaction() as conn:
+            cursor = conn.execute(f"""
+                UPDATE jobs
+                SET status = 'failed', error = ?, updated_at = ?, expires_at = ?
+                WHERE status IN (?, ?) AND ({" OR ".join(conditions)})
+            """, (error, now, now + ttl, *self.ACTIVE_STATUSES, *params))
+            return cursor.rowcount
+
+    def get(self, job_id: str):
+        """获取任务状态和结果，不存在或结果已过期时返回None"""
+        with self.pool.connection() as conn:
+            row = conn.execute("""
+                SELECT job_id, kind, status, result, error, created_at, updated_at
+                FROM jobs
+                WHERE job_id = ? AND (expires_at IS NULL OR expires_at > ?)
+            """, (job_id, time.time())).fetchone()
+        if not row:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6]
+        }
+
+    def purge_expired(self) -> int:
+        """删除结果已过期的任务，返回删除条数"""
+        with self.pool.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE expires_at <= ?", (time.time(),)
+            )
+            return cursor.rowcount
@@ -0,0 +1,57 @@
+import json
+from typing import Any, Dict
+
+# 结构化列与JSON字段的对应关系：列名 -> (来源字段, JSON键, SQLite类型)
+STRUCTURED_COLUMNS = {
+    "demand": ("factors", "需求", "INTEGER"),
+    "efficiency": ("factors", "效率", "REAL"),
+    "cost": ("factors", "成本", "REAL"),
+    "season_level": ("factors", "季节", "TEXT"),
+    "pricing": ("strategy", "定价", "TEXT"),
+    "marketing": ("strategy", "营销", "TEXT"),
+    "distribution": ("strategy", "分销", "TEXT"),
+    "stock_mode": ("strategy", "库存", "TEXT"),
+    "warehouse": ("logistics", "仓库", "TEXT"),
+    "transport": ("logistics", "运输", "TEXT"),
+    "lead_time_days": ("logistics", "时效", "INTEGER"),
+    "shipping_cost": ("logistics", "成本", "REAL"),
+}
+
+_CASTS = {"INTEGER": int, "REAL": float, "TEXT": str}
+
+
+def as_dict(value: Any) -> Dict:
+    """将JSON字段解析为dict；兼容被重复编码的JSON字符串，无法解析时返回空dict"""
+    for _ in range(2):
+        if isinstance(value, dict):
+            return value
+        if not isinstance(value, str):
+            return {}
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def product_category(product: str):
+    """从"名称-类目-型号"格式的产品名中提取类目"""
+    parts = product.split("-")
+    return parts[1] if len(parts) >= 3 else None
+
+
+def structured_fields(product: str, factors: Any, strategy: Any, logistics: Any) -> Dict:
+    """从记录的JSON字段中提取结构化列的值，缺失或类型不符的值为None"""
+    sources = {
+        "factors": as_dict(factors),
+        "strategy": as_dict(strategy),
+        "logistics": as_dict(logistics),
+    }
+    fields = {"category": product_category(product)}
+    for column, (source, key, sql_type) in STRUCTURED_COLUMNS.items():
+        value = sources[source].get(key)
+        try:
+            fields[column] = _CASTS[sql_type](value) if value is not None else None
+        except (TypeError, ValueError):
+            fields[column] = None
+    return fields
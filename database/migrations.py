@@ -0,0 +1,231 @@
+import logging
+import time
+from typing import Callable, List, Optional, Union
+
+from database.fields import STRUCTURED_COLUMNS, structured_fields
+
+logger = logging.getLogger(__name__)
+
+
+class Migration:
+    """一次有序的schema升级
+
+    upgrade在一个写事务内执行，必须是幂等的（使用IF NOT EXISTS或下面的辅助函数），
+    这样多个进程同时启动、或上次升级中途退出时可以安全重跑。
+    backfill为可选的数据回填，在upgrade之后分批执行（见backfill_in_chunks），每批一个短事务，
+    不会长时间锁表；它同样需要可重入（重跑时会重新处理已回填的行）。
+    两者都完成后才记录版本号。
+    """
+
+    def __init__(self, version: int, description: str,
+                 upgrade: Callable, backfill: Optional[Callable] = None):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.backfill = backfill
+
+
+def column_exists(conn, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def add_column_if_missing(conn, table: str, column: str, definition: str):
+    """幂等地添加列（SQLite的ADD COLUMN只修改schema，不重写表数据）"""
+    if not column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def backfill_in_chunks(pool, backfill: Union[str, Callable], table: str = "inventory_records",
+                       chunk_size: int = 5000) -> int:
+    """按id区间分批回填，每个区间一个短事务，不会长时间持有写锁，返回回填的行数
+
+    backfill为SQL语句时以(区间起点, 区间终点)为参数执行，语句中用 id > ?1 AND id <= ?2 限定区间；
+    也可以是函数backfill(conn, start, end)，返回回填的行数。
+    区间上限取开始回填时的MAX(id)，之后新写入的行需由写入代码或触发器处理。
+    """
+    with pool.connection() as conn:
+        max_id = conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+    total = 0
+    for start in range(0, max_id, chunk_size):
+        end = min(start + chunk_size, max_id)
+        with pool.transaction() as conn:
+            if callable(backfill):
+                total += backfill(conn, start, end)
+            else:
+                total += conn.execute(backfill, (start, end)).rowcount
+    return total
+
+
+def _create_inventory_records(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inventory_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL CHECK(length(timestamp) <= 50),
+            product TEXT NOT NULL CHECK(length(product) <= 100),
+            factors TEXT NOT NULL CHECK(length(factors) <= 1000),
+            strategy TEXT NOT NULL CHECK(length(strategy) <= 500),
+            logistics TEXT NOT NULL CHECK(length(logistics) <= 500)
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_product
+        ON inventory_records(product)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_timestamp
+        ON inventory_records(timestamp)
+    """)
+
+
+STRUCTURED_COLUMN_NAMES = ["category", *STRUCTURED_COLUMNS]
+
+
+def _add_structured_columns(conn):
+    add_column_if_missing(conn, "inventory_records", "category", "TEXT")
+    for column, (_, _, sql_type) in STRUCTURED_COLUMNS.items():
+        add_column_if_missing(conn, "inventory_records", column, sql_type)
+
+
+def _backfill_structured_chunk(conn, start: int, end: int) -> int:
+    """解析区间内记录的JSON字段并写入结构化列"""
+    rows = conn.execute("""
+        SELECT id, product, factors, strategy, logistics
+        FROM inventory_records
+        WHERE id > ? AND id <= ?
+    """, (start, end)).fetchall()
+    updates = []
+    for row_id, product, factors, strategy, logistics in rows:
+        fields = structured_fields(product, factors, strategy, logistics)
+        updates.append((*(fields[c] for c in STRUCTURED_COLUMN_NAMES), row_id))
+    assignments = ", ".join(f"{column} = ?" for column in STRUCTURED_COLUMN_NAMES)
+    conn.executemany(f"UPDATE inventory_records SET {assignments} WHERE id = ?", updates)
+    return len(updates)
+
+
+def _backfill_structured_columns(pool, chunk_size: int = 5000):
+    """按id分批解析已有记录的JSON字段并写入结构化列，每批一个短事务"""
+    backfill_in_chunks(pool, _backfill_structured_chunk, chunk_size=chunk_size)
+
+
+def _create_structured_indexes(conn):
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_category_demand
+        ON inventory_records(category, demand)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_warehouse_shipping_cost
+        ON inventory_records(warehouse, shipping_cost)
+    """)
+
+
+def _create_search_index(conn):
+    """全文索引：product/strategy/logistics经cjk_bigrams切分后写入无内容(contentless)的FTS5表，
+    由触发器随inventory_records同步；cjk_bigrams由ConnectionPool在每个连接上注册"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'inventory_fts'"
+    ).fetchone()
+    if not exists:
+        conn.execute("""
+            CREATE VIRTUAL TABLE inventory_fts USING fts5(
+                product, strategy, logistics,
+                content='', tokenize='unicode61'
+            )
+        """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON inventory_records
+        BEGIN
+            INSERT INTO inventory_fts (rowid, product, strategy, logistics)
+            VALUES (new.id, cjk_bigrams(new.product), cjk_bigrams(new.strategy),
+                    cjk_bigrams(new.logistics));
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON inventory_records
+        BEGIN
+            INSERT INTO inventory_fts (inventory_fts, rowid, product, strategy, logistics)
+            VALUES ('delete', old.id, cjk_bigrams(old.product), cjk_bigrams(old.strategy),
+                    cjk_bigrams(old.logistics));
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_update
+        AFTER UPDATE OF product, strategy, logistics ON inventory_records
+        BEGIN
+            INSERT INTO inventory_fts (inventory_fts, rowid, product, strategy, logistics)
+            VALUES ('delete', old.id, cjk_bigrams(old.product), cjk_bigrams(old.strategy),
+                    cjk_bigrams(old.logistics));
+            INSERT INTO inventory_fts (rowid, product, strategy, logistics)
+            VALUES (new.id, cjk_bigrams(new.product), cjk_bigrams(new.strategy),
+                    cjk_bigrams(new.logistics));
+        END
+    """)
+
+
+def _backfill_search_index(pool, chunk_size: int = 5000):
+    """按id分批为已有记录建立全文索引
+
+    触发器在upgrade中已经创建，回填期间新写入的行由触发器索引；
+    无内容FTS5表允许重复的rowid，因此跳过区间内已经建立索引的行，中断后重跑不会重复写入。
+    """
+    backfill_in_chunks(pool, """
+        INSERT INTO inventory_fts (rowid, product, strategy, logistics)
+        SELECT id, cjk_bigrams(product), cjk_bigrams(strategy), cjk_bigrams(logistics)
+        FROM inventory_records
+        WHERE id > ?1 AND id <= ?2
+          AND id NOT IN (SELECT rowid FROM inventory_fts WHERE rowid > ?1 AND rowid <= ?2)
+    """, chunk_size=chunk_size)
+
+
+# 按版本号升序排列，只能追加，不能修改已发布的迁移
+MIGRATIONS: List[Migration] = [
+    Migration(1, "创建inventory_records表及索引", _create_inventory_records),
+    Migration(2, "添加factors/strategy/logistics的结构化列并回填",
+              _add_structured_columns, _backfill_structured_columns),
+    Migration(3, "为结构化列创建索引", _create_structured_indexes),
+    Migration(4, "创建product/strategy/logistics的全文索引及同步触发器",
+              _create_search_index, _backfill_search_index),
+]
+
+
+def current_version(conn) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+
+def migrate(pool, migrations: List[Migration] = MIGRATIONS) -> int:
+    """将数据库升级到最新版本，返回升级后的版本号
+
+    已是最新版本时只做一次版本号查询。
+    """
+    latest = migrations[-1].version if migrations else 0
+    with pool.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at REAL NOT NULL
+            )
+        """)
+        version = current_version(conn)
+    if version >= latest:
+        return version
+
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        start = time.perf_counter()
+        logger.info(f"执行数据库迁移 v{migration.version}: {migration.description}")
+
+        with pool.transaction() as conn:
+            migration.upgrade(conn)
+        if migration.backfill:
+            migration.backfill(pool)
+
+        with pool.transaction() as conn:
+            conn.execute("""
+                INSERT OR IGNORE INTO schema_migrations (version, description, applied_at)
+                VALUES (?, ?, ?)
+            """, (migration.version, migration.description, time.time()))
+        version = migration.version
+        logger.info(f"数据库迁移 v{migration.version} 完成，耗时 {time.perf_counter() - start:.2f}s")
+    return version
@@ -0,0 +1,50 @@
+import re
+from typing import Optional
+
+# 连续的中日韩字符按二元组(bigram)切分，其余按字母数字词切分
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_PATTERN = re.compile(f"[{_CJK_RANGES}]+|[^\\W_{_CJK_RANGES}]+")
+_CJK_PATTERN = re.compile(f"[{_CJK_RANGES}]")
+
+
+def _segments(text: str):
+    """返回(词元列表, 是否含有单个汉字的片段)"""
+    tokens, has_single_cjk = [], False
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if not _CJK_PATTERN.match(run):
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+            has_single_cjk = True
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens, has_single_cjk
+
+
+def cjk_bigrams(text: Optional[str]) -> str:
+    """将文本切分为以空格分隔的词元，供FTS5的unicode61分词器建立索引
+
+    注册为SQLite函数后在同步全文索引的触发器中调用，例如"向日葵-花卉-A"切分为"向日 日葵 花卉 a"。
+    """
+    if not text:
+        return ""
+    return " ".join(_segments(text)[0])
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """把用户输入转换为FTS5 MATCH表达式
+
+    每个以空格分隔的关键词转换为一个短语（词元须连续出现，等价于子串匹配），多个关键词之间为AND。
+    关键词以字母或数字结尾时最后一个词元按前缀匹配（"ros"匹配"rose bouquet"），
+    但英文词中间的片段（"ose"）不会匹配。
+    关键词中含有单个汉字的片段时，索引中的二元组无法保证匹配，返回None，由调用方退化为LIKE查询。
+    """
+    phrases = []
+    for term in query.split():
+        tokens, has_single_cjk = _segments(term)
+        if has_single_cjk:
+            return None
+        if tokens:
+            prefix = "*" if not _CJK_PATTERN.match(tokens[-1]) else ""
+            phrases.append('"' + " ".join(tokens) + '"' + prefix)
+    return " AND ".join(phrases) or None
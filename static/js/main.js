@@ -69,22 +69,72 @@ function handleMarketingSubmit(e) {
 function submitMarketingPlan(data) {
     showLoading('正在生成营销方案...');
     
-    fetch('/marketing/generate', {
+    // 使用流式接口，每个回合的回答边生成边显示
+    const planContent = document.getElementById('plan-content');
+    let currentAnswer = null;
+    
+    fetch('/marketing/generate/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(data)
     })
-    .then(handleJsonResponse)
-    .then(data => {
-        if (data.conversation) {
-            displayConversation(data.conversation);
+    .then(response => readEventStream(response, (event, payload) => {
+        if (event === 'start') {
+            planContent.innerHTML = '';
             document.getElementById('marketing-result').style.display = 'block';
+        } else if (event === 'round_start') {
+            // 首个回合开始后即可展示内容，不再需要加载动画
+            hideLoading();
+            currentAnswer = appendConversationTurn({ ...payload, answer: '' });
+        } else if (event === 'delta' && currentAnswer) {
+            currentAnswer.textContent += payload.content;
+            planContent.scrollTop = planContent.scrollHeight;
+        } else if (event === 'round' && currentAnswer) {
+            currentAnswer.textContent = payload.answer;
+            currentAnswer = null;
+        } else if (event === 'error') {
+            showError(payload.error || '营销方案生成失败');
         }
-    })
+    }))
     .catch(handleError)
     .finally(hideLoading);
 }
 
+// 读取server-sent events流，每解析出一个事件就回调onEvent(event, data)
+async function readEventStream(response, onEvent) {
+    if (!response.ok) {
+        throw new Error(response.statusText);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            const dataLines = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    event = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataLines.push(line.slice(5).trim());
+                }
+            });
+            if (dataLines.length) {
+                onEvent(event, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+}
+
 // ...existing marketing functions...
 
 // 库存管理功能
@@ -176,17 +226,44 @@ function sendChatbotMessage() {
     appendChatMessage('user', message);
     input.value = '';
     
-    fetch('/chat', {
+    // 使用流式接口：先显示计划步骤，回答边生成边显示
+    const messages = document.getElementById('chatbot-messages');
+    const answer = appendChatMessage('bot', '正在思考...');
+    let steps = null;
+    let answering = false;
+    
+    fetch('/chat/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ message })
     })
-    .then(handleJsonResponse)
-    .then(data => {
-        if (data.response) {
-            appendChatMessage('bot', data.response);
+    .then(response => readEventStream(response, (event, payload) => {
+        if (event === 'plan') {
+            steps = document.createElement('ol');
+            steps.className = 'chat-steps';
+            payload.steps.forEach(step => {
+                const item = document.createElement('li');
+                item.textContent = step;
+                steps.appendChild(item);
+            });
+            answer.parentNode.insertBefore(steps, answer);
+        } else if (event === 'step' && steps) {
+            steps.children[payload.index - 1].classList.add('done');
+        } else if (event === 'delta') {
+            if (!answering) {
+                answer.textContent = '';
+                answering = true;
+            }
+            answer.textContent += payload.content;
+        } else if (event === 'done') {
+            // 以完整回答为准
+            answer.textContent = payload.response;
+        } else if (event === 'error') {
+            answer.textContent = payload.error || '抱歉，我暂时无法处理您的问题，请稍后再试。';
+            answer.closest('.message').classList.add('error-message');
         }
-    })
+        messages.scrollTop = messages.scrollHeight;
+    }))
     .catch(handleError);
 }
 
@@ -202,6 +279,7 @@ function appendChatMessage(type, content) {
     `;
     messages.appendChild(messageDiv);
     messages.scrollTop = messages.scrollHeight;
+    return messageDiv.querySelector('.message-text');
 }
 
 // 显示/隐藏加载动画
@@ -220,37 +298,44 @@ function displayConversation(conversation) {
     const planContent = document.getElementById('plan-content');
     planContent.innerHTML = '';
     
-    conversation.forEach(turn => {
-        // 添加问题
-        const questionDiv = document.createElement('div');
-        questionDiv.className = 'decision-maker-message';
-        questionDiv.innerHTML = `
-            <div class="message-content">
-                <div class="message-header">
-                    <i class="fas fa-user"></i> 
-                    回合 ${turn.round} - 问题
-                </div>
-                <div class="message-text">${turn.question}</div>
+    conversation.forEach(turn => appendConversationTurn(turn));
+    
+    planContent.scrollTop = planContent.scrollHeight;
+}
+
+// 添加一个回合的问题和回答，返回回答文本节点以便流式追加内容
+function appendConversationTurn(turn) {
+    const planContent = document.getElementById('plan-content');
+    
+    // 添加问题
+    const questionDiv = document.createElement('div');
+    questionDiv.className = 'decision-maker-message';
+    questionDiv.innerHTML = `
+        <div class="message-content">
+            <div class="message-header">
+                <i class="fas fa-user"></i> 
+                回合 ${turn.round} - 问题
             </div>
-        `;
-        planContent.appendChild(questionDiv);
-        
-        // 添加回答
-        const answerDiv = document.createElement('div');
-        answerDiv.className = 'expert-message';
-        answerDiv.innerHTML = `
-            <div class="message-content">
-                <div class="message-header">
-                    <i class="fas fa-user-tie"></i> 
-                    回合 ${turn.round} - 专家回答
-                </div>
-                <div class="message-text">${turn.answer}</div>
+            <div class="message-text">${turn.question}</div>
+        </div>
+    `;
+    planContent.appendChild(questionDiv);
+    
+    // 添加回答
+    const answerDiv = document.createElement('div');
+    answerDiv.className = 'expert-message';
+    answerDiv.innerHTML = `
+        <div class="message-content">
+            <div class="message-header">
+                <i class="fas fa-user-tie"></i> 
+                回合 ${turn.round} - 专家回答
             </div>
-        `;
-        planContent.appendChild(answerDiv);
-    });
+            <div class="message-text">${turn.answer}</div>
+        </div>
+    `;
+    planContent.appendChild(answerDiv);
     
-    planContent.scrollTop = planContent.scrollHeight;
+    return answerDiv.querySelector('.message-text');
 }
 
 // 工具函数
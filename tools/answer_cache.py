@@ -0,0 +1,150 @@
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+class SemanticAnswerCache:
+    """按问题语义寻址的答案缓存
+
+    问题向量归一化后存入预分配的矩阵，查询时与所有条目做一次矩阵乘法，
+    余弦相似度不低于threshold且问题中的数字完全相同的条目视为命中
+    （"3束玫瑰多少钱"和"5束玫瑰多少钱"的向量非常接近，但答案不同）。
+
+    每个条目记录写入时文档索引的版本，版本变化（docs目录中的文档有增删改）时清空全部条目；
+    容量满时淘汰最久未使用的条目，ttl不为空时过期条目不再命中。
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl: Optional[float] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim)，首次写入时按向量维度分配
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._entries: List[Optional[Dict]] = [None] * max_entries
+        self._size = 0
+
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _check_version(self, version: Optional[str]):
+        """文档索引版本变化时清空缓存（调用方需持有锁）"""
+        if version == self._version:
+            return
+        if self._size:
+            logger.info(f"文档索引已变化，清空 {self._size} 条缓存答案")
+            self.invalidations += 1
+        self._version = version
+        self._entries = [None] * self.max_entries
+        self._last_used[:] = 0
+        self._size = 0
+
+    def lookup(self, vector, question: str, version: Optional[str] = None) -> Optional[str]:
+        """返回与question语义相同的已缓存答案，未命中时返回None"""
+        if not self.enabled:
+            return None
+        query = self._normalize(vector)
+        numbers = _NUMBER.findall(question)
+        now = time.monotonic()
+
+        with self._lock:
+            self._check_version(version)
+            if self._size:
+                scores = self._vectors[:self._size] @ query
+                # 按相似度从高到低检查，跳过数字不一致或已过期的条目
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for i in candidates[np.argsort(-scores[candidates])]:
+                    entry = self._entries[i]
+                    if entry["numbers"] != numbers:
+                        continue
+                    if self.ttl is not None and now - entry["created"] > self.ttl:
+                        continue
+                    self._last_used[i] = now
+                    self.hits += 1
+                    return entry["answer"]
+            self.misses += 1
+        return None
+
+    def put(self, vector, question: str, answer: str, version: Optional[str] = None):
+        """缓存question的答案，容量满时替换最久未使用的条目"""
+        if not self.enabled:
+            return
+        value = self._normalize(vector)
+        now = time.monotonic()
+
+        with self._lock:
+            self._check_version(version)
+            if self._vectors is None or self._vectors.shape[1] != len(value):
+                self._vectors = np.zeros((self.max_entries, len(value)), dtype=np.float32)
+                self._entries = [None] * self.max_entries
+                self._size = 0
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = value
+            self._last_used[slot] = now
+            self._entries[slot] = {
+                "question": question,
+                "answer": answer,
+                "numbers": _NUMBER.findall(question),
+                "created": now,
+            }
+
+    def invalidate(self):
+        """清空所有条目"""
+        with self._lock:
+            self._entries = [None] * self.max_entries
+            self._last_used[:] = 0
+            self._size = 0
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        """返回命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": self._size,
+                "invalidations": self.invalidations,
+            }
+
+
+def answer_cache_from_env() -> SemanticAnswerCache:
+    """按环境变量创建答案缓存
+
+    - CHAT_CACHE_SIZE：最大条目数，默认1000，设为0关闭缓存
+    - CHAT_CACHE_THRESHOLD：命中所需的最低余弦相似度，默认0.95
+    - CHAT_CACHE_TTL：条目有效期（秒），不设置则只在文档变化时失效
+    """
+    ttl = os.environ.get("CHAT_CACHE_TTL")
+    return SemanticAnswerCache(
+        threshold=float(os.environ.get("CHAT_CACHE_THRESHOLD", 0.95)),
+        max_entries=int(os.environ.get("CHAT_CACHE_SIZE", 1000)),
+        ttl=float(ttl) if ttl else None,
+    )
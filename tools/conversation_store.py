@@ -0,0 +1,191 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from database.db import get_pool
+
+logger = logging.getLogger(__name__)
+
+Turn = Tuple[str, str]  # (用户消息, 回答)
+
+
+class ConversationStore:
+    """按会话保存的对话历史
+
+    每个会话只保留最近max_turns轮，单条消息超过max_chars时截断；
+    会话按最近访问时间排序，超过max_sessions时淘汰最久未访问的会话，空闲超过ttl秒的会话过期。
+    db_path不为空时同时写入SQLite，会话被淘汰或进程重启后仍可从磁盘恢复，并由多个worker共享：
+    此时磁盘上的记录为准，每次读取历史都查询一次磁盘（按会话索引，最多max_turns行），内存中的副本只在读取失败时使用。
+    """
+
+    def __init__(self, max_turns: int = 20, max_sessions: int = 10000, ttl: float = 1800,
+                 max_chars: int = 4000, db_path: Optional[str] = None):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.db_path = db_path
+        # 会话ID -> (最近访问时间, 最近的对话)，按访问时间从旧到新排列
+        self._sessions: "OrderedDict[str, Tuple[float, Deque[Turn]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.evicted = 0
+        self.expired = 0
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self.pool = get_pool(db_path)
+            self._init_db()
+
+    def _init_db(self):
+        """初始化对话历史表"""
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_turns (
+                    session_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    user_message TEXT NOT NULL,
+                    bot_message TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_turns_session
+                ON chat_turns(session_id, created_at)
+            """)
+
+    def _expire(self, now: float):
+        """移除空闲超时的会话（调用方需持有锁），最久未访问的会话在最前面"""
+        while self._sessions:
+            session_id, (last_seen, _) = next(iter(self._sessions.items()))
+            if now - last_seen <= self.ttl:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def _load(self, session_id: str) -> Optional[Deque[Turn]]:
+        """从磁盘读取会话最近的对话，读取失败时返回None（调用方不要持有锁）"""
+        try:
+            with self.pool.connection() as conn:
+                rows = conn.execute("""
+                    SELECT user_message, bot_message FROM chat_turns
+                    WHERE session_id = ? AND created_at > ?
+                    ORDER BY created_at DESC LIMIT ?
+                """, (session_id, time.time() - self.ttl, self.max_turns)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取对话历史失败: {str(e)}")
+            return None
+        return deque(reversed(rows), maxlen=self.max_turns)
+
+    def _touch(self, session_id: str, loaded: Optional[Deque[Turn]] = None) -> Deque[Turn]:
+        """取出会话并标记为最近访问（调用方需持有锁，不做磁盘IO）
+
+        loaded为刚从磁盘读取的对话，替换内存中的副本；没有时使用内存中的副本，内存中也没有时为空会话。
+        """
+        now = time.time()
+        self._expire(now)
+        entry = self._sessions.pop(session_id, None)
+        if loaded is not None:
+            turns = loaded
+        elif entry is not None:
+            turns = entry[1]
+        else:
+            turns = deque(maxlen=self.max_turns)
+        self._sessions[session_id] = (now, turns)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+        return turns
+
+    def history(self, session_id: str) -> List[Turn]:
+        """返回会话最近的对话，按时间从早到晚排列
+
+        启用SQLite时每次都在锁外从磁盘读取，能看到其他worker写入的对话；读取失败时退回内存中的副本。
+        """
+        loaded = self._load(session_id) if self.db_path else None
+        with self._lock:
+            return list(self._touch(session_id, loaded))
+
+    def append(self, session_id: str, user_message: str, bot_message: str):
+        """追加一轮对话"""
+        turn = (user_message[:self.max_chars], bot_message[:self.max_chars])
+        with self._lock:
+            self._touch(session_id).append(turn)
+            self._writes += 1
+            purge = self._writes % 1000 == 0
+
+        if self.db_path:
+            try:
+                with self.pool.transaction() as conn:
+                    conn.execute("""
+                        INSERT INTO chat_turns (session_id, created_at, user_message, bot_message)
+                        VALUES (?, ?, ?, ?)
+                    """, (session_id, time.time(), *turn))
+                    # 磁盘上同样只保留最近max_turns轮
+                    conn.execute("""
+                        DELETE FROM chat_turns WHERE session_id = ? AND rowid NOT IN (
+                            SELECT rowid FROM chat_turns WHERE session_id = ?
+                            ORDER BY created_at DESC LIMIT ?
+                        )
+                    """, (session_id, session_id, self.max_turns))
+            except sqlite3.Error as e:
+                logger.warning(f"写入对话历史失败: {str(e)}")
+            if purge:
+                self.purge_expired()
+
+    def clear(self, session_id: str):
+        """删除会话的全部历史"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if self.db_path:
+            try:
+                with self.pool.transaction() as conn:
+                    conn.execute("DELETE FROM chat_turns WHERE session_id = ?", (session_id,))
+            except sqlite3.Error as e:
+                logger.warning(f"删除对话历史失败: {str(e)}")
+
+    def purge_expired(self) -> int:
+        """删除磁盘上已过期的对话，返回删除的行数"""
+        if not self.db_path:
+            return 0
+        try:
+            with self.pool.transaction() as conn:
+                cursor = conn.execute("""
+                    DELETE FROM chat_turns WHERE session_id IN (
+                        SELECT session_id FROM chat_turns
+                        GROUP BY session_id HAVING MAX(created_at) <= ?
+                    )
+                """, (time.time() - self.ttl,))
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"清理过期对话历史失败: {str(e)}")
+            return 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._expire(time.time())
+            return {
+                "sessions": len(self._sessions),
+                "turns": sum(len(turns) for _, turns in self._sessions.values()),
+                "evicted": self.evicted,
+                "expired": self.expired,
+            }
+
+
+def conversation_store_from_env() -> ConversationStore:
+    """按环境变量创建对话历史存储
+
+    - CHAT_HISTORY_TURNS：每个会话保留的轮数，默认20
+    - CHAT_MAX_SESSIONS：内存中保留的会话数，默认10000
+    - CHAT_SESSION_TTL：会话空闲过期时间（秒），默认1800
+    - CHAT_HISTORY_DB：SQLite路径，不设置则只保存在内存中
+    """
+    return ConversationStore(
+        max_turns=int(os.environ.get("CHAT_HISTORY_TURNS", 20)),
+        max_sessions=int(os.environ.get("CHAT_MAX_SESSIONS", 10000)),
+        ttl=float(os.environ.get("CHAT_SESSION_TTL", 1800)),
+        db_path=os.environ.get("CHAT_HISTORY_DB") or None,
+    )
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.document_loaders import Docx2txtLoader
+from langchain_community.document_loaders import TextLoader
+
+logger = logging.getLogger(__name__)
+
+# 支持的文档类型及对应的加载器
+LOADERS = {
+    ".pdf": PyPDFLoader,
+    ".docx": Docx2txtLoader,
+    ".doc": Docx2txtLoader,
+    ".txt": TextLoader,
+}
+
+
+def file_sha256(path: str) -> str:
+    """计算文件内容的sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentIndex:
+    """docs目录的磁盘持久化索引，启动时直接加载，只对变更的文件重新嵌入
+
+    索引目录结构：
+    - manifest.json：索引配置、每个文件的指纹(sha256/mtime/size)及其分块区间
+    - chunks.json：所有分块的文本和metadata
+    - embeddings.npy：float32向量矩阵，与chunks按行对应，以mmap方式加载
+    """
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        docs_dir: str,
+        embeddings,
+        index_dir: Optional[str] = None,
+        chunk_size: int = 200,
+        chunk_overlap: int = 0,
+    ):
+        self.docs_dir = docs_dir
+        self.embeddings = embeddings
+        self.index_dir = index_dir or os.path.join("data", "doc_index")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+        self.chunks: List[Dict] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.fingerprint: Optional[str] = None  # 索引内容的版本号，sync后更新
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.index_dir, "manifest.json")
+
+    @property
+    def chunks_path(self) -> str:
+        return os.path.join(self.index_dir, "chunks.json")
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.index_dir, "embeddings.npy")
+
+    def _settings(self) -> Dict:
+        """影响分块和向量结果的配置，任一变化都需要全量重建"""
+        return {
+            "version": self.VERSION,
+            "model_name": getattr(
+                self.embeddings, "model_name", type(self.embeddings).__name__
+            ),
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+        }
+
+    def _load(self) -> Dict[str, Dict]:
+        """加载已有索引，返回文件指纹表；索引缺失、损坏或配置不一致时返回空表"""
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("settings") != self._settings():
+                logger.info("文档索引配置已变化，将全量重建")
+                return {}
+            with open(self.chunks_path, "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            vectors = np.load(self.vectors_path, mmap_mode="r")
+            if len(chunks) != manifest.get("total_chunks") or len(chunks) != len(vectors):
+                logger.warning("文档索引文件不一致，将全量重建")
+                return {}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            logger.warning(f"加载文档索引失败，将全量重建: {str(e)}")
+            return {}
+
+        self.chunks = chunks
+        self.vectors = vectors
+        return manifest["files"]
+
+    def _scan(self) -> List[str]:
+        """列出docs目录下支持的文件（排序以保证索引布局稳定）"""
+        return sorted(
+            name
+            for name in os.listdir(self.docs_dir)
+            if os.path.splitext(name)[1].lower() in LOADERS
+        )
+
+    def _split_file(self, name: str) -> List[Document]:
+        path = os.path.join(self.docs_dir, name)
+        loader = LOADERS[os.path.splitext(name)[1].lower()](path)
+        return self.text_splitter.split_documents(loader.load())
+
+    def sync(self) -> "DocumentIndex":
+        """将索引与docs目录同步
+
+        mtime和size均未变化的文件直接复用；有变化时再比较内容哈希，
+        只有内容确实改变的文件才会重新分块和嵌入；已删除的文件从索引中剔除。
+        """
+        old_files = self._load()
+        old_chunks, old_vectors = self.chunks, self.vectors
+
+        files: Dict[str, Dict] = {}
+        chunk_parts: List[List[Dict]] = []
+        vector_parts: List[np.ndarray] = []
+        dirty = False
+        embedded = 0
+
+        for name in self._scan():
+            stat = os.stat(os.path.join(self.docs_dir, name))
+            entry = old_files.get(name)
+            fingerprint = {"mtime": stat.st_mtime, "size": stat.st_size}
+
+            reuse = False
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                reuse = True
+                fingerprint["sha256"] = entry["sha256"]
+            else:
+                fingerprint["sha256"] = file_sha256(os.path.join(self.docs_dir, name))
+                reuse = bool(entry) and entry["sha256"] == fingerprint["sha256"]
+                dirty = True
+
+            if reuse:
+                start, count = entry["start"], entry["count"]
+                chunks = old_chunks[start:start + count]
+                vectors = np.asarray(old_vectors[start:start + count], dtype=np.float32)
+            else:
+                docs = self._split_file(name)
+                chunks = [
+                    {"text": doc.page_content, "metadata": doc.metadata}
+                    for doc in docs
+                ]
+                vectors = np.asarray(
+                    self.embeddings.embed_documents([c["text"] for c in chunks])
+                    if chunks else [],
+                    dtype=np.float32,
+                )
+                embedded += 1
+                logger.info(f"文档已重新嵌入: {name} ({len(chunks)} 个分块)")
+
+            fingerprint["start"] = sum(len(part) for part in chunk_parts)
+            fingerprint["count"] = len(chunks)
+            files[name] = fingerprint
+            chunk_parts.append(chunks)
+            if len(vectors):
+                vector_parts.append(vectors.reshape(len(chunks), -1))
+
+        pruned = set(old_files) - set(files)
+        for name in pruned:
+            logger.info(f"文档已删除，从索引中移除: {name}")
+
+        self.fingerprint = self._fingerprint(files)
+
+        if not dirty and not pruned:
+            logger.info(f"文档索引无变化，直接加载 {len(self.chunks)} 个分块")
+            return self
+
+        self.chunks = [chunk for part in chunk_parts for chunk in part]
+        self.vectors = (
+            np.concatenate(vector_parts) if vector_parts
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+        # 释放旧索引的mmap句柄，否则Windows上无法覆盖embeddings.npy
+        old_chunks = old_vectors = None
+        self._save(files)
+        logger.info(
+            f"文档索引已更新：重新嵌入 {embedded} 个文件，移除 {len(pruned)} 个文件，"
+            f"共 {len(self.chunks)} 个分块"
+        )
+        return self
+
+    def _fingerprint(self, files: Dict[str, Dict]) -> str:
+        """由索引配置和各文件内容哈希计算的版本号，任一文档增删改后都会变化"""
+        digest = hashlib.sha256(json.dumps(self._settings(), sort_keys=True).encode("utf-8"))
+        for name in sorted(files):
+            digest.update(f"{name}\0{files[name]['sha256']}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _save(self, files: Dict[str, Dict]):
+        """原子写入索引文件，manifest最后写入作为提交点"""
+        def replace(path, write):
+            tmp_path = path + ".tmp"
+            write(tmp_path)
+            os.replace(tmp_path, path)
+
+        def write_vectors(path):
+            with open(path, "wb") as f:
+                np.save(f, self.vectors)
+
+        def write_json(data):
+            def write(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+            return write
+
+        replace(self.vectors_path, write_vectors)
+        replace(self.chunks_path, write_json(self.chunks))
+        replace(self.manifest_path, write_json({
+            "settings": self._settings(),
+            "total_chunks": len(self.chunks),
+            "files": files,
+        }))
+
+    def documents(self) -> List[Document]:
+        return [
+            Document(page_content=c["text"], metadata=c["metadata"])
+            for c in self.chunks
+        ]
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+from config.metrics import EMBEDDING_BATCH_SIZE
+from config.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingEmbeddings(Embeddings):
+    """微批处理的Embeddings包装器
+
+    并发到达的embed_query请求会在max_wait_ms的时间窗口内被收集起来，
+    合并为一次embed_documents调用（最多max_batch_size条），再把向量分发回各个调用方。
+    embed_documents本身已是批量调用，直接透传给被包装的模型。
+    调用方最多等待timeout秒（None为不限），后台线程异常退出时下一次调用会重新启动它。
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 timeout: Optional[float] = 60.0):
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+        # 批处理统计
+        self.batches = 0
+        self.batched_items = 0
+
+    def _ensure_worker(self):
+        """按需启动后台线程；fork出的子进程（如gunicorn worker）会重新启动自己的线程"""
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def embed_query(self, text: str) -> List[float]:
+        self._ensure_worker()
+        future: Future = Future()
+        # 包含排队等待合批的时间
+        with span("embedding.embed_query", model=self.model_name):
+            self._queue.put((text, future))
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()  # 仍在排队时后台线程会跳过它
+                raise TimeoutError(f"嵌入请求超过{self.timeout}秒未完成") from None
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步等待合批结果，等待期间不占用线程"""
+        self._ensure_worker()
+        future: Future = Future()
+        with span("embedding.embed_query", model=self.model_name):
+            self._queue.put((text, future))
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"嵌入请求超过{self.timeout}秒未完成") from None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def _collect(self, first) -> List:
+        """从第一个请求开始计时，收集时间窗口内到达的请求"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # 窗口已过期时仍然取走已在队列中的请求，但不再等待
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect(self._queue.get())
+            # 跳过调用方已取消（超时或异步任务被取消）的请求，之后这些future不能再被取消
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._process(batch)
+            except BaseException as e:
+                # 任何异常都要通知本批的调用方，且不能让后台线程退出
+                logger.error(f"批量嵌入失败: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, batch: List):
+        texts = [text for text, _ in batch]
+        EMBEDDING_BATCH_SIZE.observe(len(batch))
+        with span("embedding.batch", model=self.model_name, batch_size=len(batch)):
+            vectors = self.embeddings.embed_documents(texts)
+        if len(vectors) != len(batch):
+            raise ValueError(f"嵌入模型返回了{len(vectors)}个向量，应为{len(batch)}个")
+
+        with self._lock:
+            self.batches += 1
+            self.batched_items += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def stats(self) -> Dict:
+        """返回批处理统计"""
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.batched_items,
+                "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            }
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database.db import get_pool
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """按(模型名, 文本哈希)寻址的向量缓存
+
+    第一层是进程内LRU，第二层是可选的SQLite磁盘缓存（向量以float32二进制存储），
+    磁盘层可在进程重启和多个worker之间共享。
+    """
+
+    def __init__(self, max_entries: int = 10000, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._lru: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 命中统计
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self.pool = get_pool(db_path)
+            self._init_db()
+
+    def _init_db(self):
+        """初始化磁盘缓存表"""
+        with self.pool.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                ) WITHOUT ROWID
+            """)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量查询缓存，未命中的位置返回None"""
+        keys = [(model_name, self.text_hash(text)) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        disk_lookups: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    results[i] = vector.tolist()
+                    self.memory_hits += 1
+                else:
+                    disk_lookups.setdefault(key[1], []).append(i)
+
+        if disk_lookups and self.db_path:
+            found = self._read_disk(model_name, list(disk_lookups))
+            with self._lock:
+                for text_hash, vector in found.items():
+                    self._remember((model_name, text_hash), vector)
+                    for i in disk_lookups.pop(text_hash):
+                        results[i] = vector.tolist()
+                        self.disk_hits += 1
+
+        with self._lock:
+            self.misses += sum(len(indices) for indices in disk_lookups.values())
+        return results
+
+    def put_many(self, model_name: str, texts: List[str], vectors: List[List[float]]):
+        """写入缓存（内存层和磁盘层）"""
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                text_hash = self.text_hash(text)
+                array = np.asarray(vector, dtype=np.float32)
+                self._remember((model_name, text_hash), array)
+                rows.append((model_name, text_hash, array.tobytes()))
+
+        if rows and self.db_path:
+            try:
+                with self.pool.transaction() as conn:
+                    conn.executemany("""
+                        INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector)
+                        VALUES (?, ?, ?)
+                    """, rows)
+            except sqlite3.Error as e:
+                logger.warning(f"写入向量磁盘缓存失败: {str(e)}")
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray):
+        """放入LRU，超出容量时淘汰最久未使用的条目（调用方需持有锁）"""
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _read_disk(self, model_name: str, text_hashes: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        try:
+            with self.pool.connection() as conn:
+                # 分批查询，避免超出SQLite的参数个数上限
+                for start in range(0, len(text_hashes), 500):
+                    batch = text_hashes[start:start + 500]
+                    cursor = conn.execute(f"""
+                        SELECT text_hash, vector FROM embedding_cache
+                        WHERE model = ? AND text_hash IN ({",".join("?" * len(batch))})
+                    """, (model_name, *batch))
+                    for text_hash, blob in cursor:
+                        found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+        except sqlite3.Error as e:
+            logger.warning(f"读取向量磁盘缓存失败: {str(e)}")
+        return found
+
+    def stats(self) -> Dict:
+        """返回命中统计"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "entries": len(self._lru),
+            }
+
+    def clear(self):
+        """清空内存层并重置统计（磁盘层保留）"""
+        with self._lock:
+            self._lru.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> EmbeddingCache:
+    """进程级共享的向量缓存
+
+    通过环境变量配置：
+    - EMBEDDING_CACHE_SIZE：内存层最大条目数，默认10000
+    - EMBEDDING_CACHE_DB：磁盘层SQLite路径，不设置则只使用内存层
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", 10000)),
+                db_path=os.environ.get("EMBEDDING_CACHE_DB") or None,
+            )
+        return _default_cache
@@ -0,0 +1,181 @@
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config.metrics import RETRIEVAL_SECONDS, timer
+from config.tracing import span
+from tools.model_registry import get_cross_encoder
+
+logger = logging.getLogger(__name__)
+
+try:
+    import jieba
+
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:  # 未安装jieba时中文按相邻两字切分
+    jieba = None
+
+MODES = ("hybrid", "dense", "sparse")
+
+_CJK = r"\u4e00-\u9fff"
+# 中文连续片段、英文单词和数字
+_TOKEN = re.compile(rf"[{_CJK}]+|[a-z]+|\d+(?:\.\d+)?")
+# PDF按行提取的文本在中文词语中间断行，切分前先去掉中文之间的空白
+_CJK_GAP = re.compile(rf"(?<=[{_CJK}])\s+(?=[{_CJK}])")
+
+
+def tokenize(text: str) -> List[str]:
+    """适用于中英文混合文本的分词：英文按单词、数字整体保留，中文用jieba分词（未安装时按相邻两字切分）"""
+    tokens = []
+    for run in _TOKEN.findall(_CJK_GAP.sub("", text.lower())):
+        if not "\u4e00" <= run[0] <= "\u9fff":
+            tokens.append(run)
+        elif jieba is not None:
+            tokens.extend(token for token in jieba.lcut_for_search(run) if token.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """内存中的BM25倒排索引，每个词保存出现的分块编号和词频"""
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.size = len(texts)
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((doc, tf))
+
+        average = float(lengths.mean()) if self.size else 0.0
+        # 文档长度归一化项k1*(1-b+b*dl/avgdl)，检索时直接使用
+        self._norm = k1 * (1 - b + b * lengths / average) if average else np.full(self.size, k1, np.float32)
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray, float]] = {}
+        for term, entries in postings.items():
+            docs, tfs = zip(*entries)
+            idf = math.log(1 + (self.size - len(docs) + 0.5) / (len(docs) + 0.5))
+            self._postings[term] = (np.array(docs), np.array(tfs, dtype=np.float32), idf)
+
+    def search(self, query: str, n: int) -> List[int]:
+        """返回得分最高的n个分块编号，不含与查询没有共同词的分块"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self._postings.get(term)
+            if entry is None:
+                continue
+            docs, tfs, idf = entry
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[docs])
+        return _top(scores, n, positive=True)
+
+
+def _top(scores: np.ndarray, n: int, positive: bool = False) -> List[int]:
+    if not len(scores):
+        return []
+    n = min(n, len(scores))
+    candidates = np.argpartition(-scores, n - 1)[:n]
+    ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+    if positive:
+        ranked = ranked[scores[ranked] > 0]
+    return ranked.tolist()
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[int]:
+    """倒数排名融合：每一路排名第r的结果得分1/(k+r)，按总分排序"""
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            scores[doc] += 1 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever:
+    """客服文档的混合检索
+
+    BM25稀疏检索（中文分词）和向量检索各取前candidates个分块，按倒数排名融合(RRF)；
+    设置rerank_model时再用交叉编码器在CPU上对融合后的前candidates个分块重排。
+    mode为dense或sparse时只使用其中一路，用于评估对比。
+
+    向量直接使用DocumentIndex中已计算好的矩阵，在numpy中精确计算余弦相似度。
+    """
+
+    def __init__(self, chunks: List[Dict], vectors, mode: str = "hybrid", candidates: int = 20,
+                 rrf_k: int = 60, rerank_model: Optional[str] = None):
+        if mode not in MODES:
+            raise ValueError(f"未知的检索模式: {mode}，可选 {', '.join(MODES)}")
+        self.chunks = chunks
+        self.mode = mode
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.rerank_model = rerank_model
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True) if vectors.size else None
+        self._vectors = vectors / np.where(norms == 0, 1, norms) if norms is not None else vectors
+        self.bm25 = BM25Index([chunk["text"] for chunk in chunks]) if mode != "dense" else None
+
+    @classmethod
+    def from_index(cls, doc_index, **kwargs) -> "HybridRetriever":
+        return cls(doc_index.chunks, doc_index.vectors, **kwargs)
+
+    def _dense(self, vector, n: int) -> List[int]:
+        if not self._vectors.size:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return _top(self._vectors @ (query / norm if norm else query), n)
+
+    def _rerank(self, query: str, ids: List[int]) -> List[int]:
+        model = get_cross_encoder(self.rerank_model)
+        scores = model.predict([(query, self.chunks[i]["text"]) for i in ids])
+        order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")
+        return [ids[i] for i in order]
+
+    def search_ids(self, query: str, vector=None, k: int = 3) -> List[int]:
+        """返回最相关的k个分块编号；vector为查询的嵌入向量，sparse模式下可以为None"""
+        n = max(k, self.candidates)
+        with span("retrieval.search", mode=self.mode, k=k, rerank=bool(self.rerank_model)) as current:
+            rankings = []
+            if self.mode != "sparse":
+                with timer(RETRIEVAL_SECONDS, stage="dense"):
+                    rankings.append(self._dense(vector, n))
+            if self.mode != "dense":
+                with timer(RETRIEVAL_SECONDS, stage="sparse"):
+                    rankings.append(self.bm25.search(query, n))
+            ids = reciprocal_rank_fusion(rankings, self.rrf_k) if len(rankings) > 1 else rankings[0]
+
+            if self.rerank_model and ids:
+                with span("retrieval.rerank", model=self.rerank_model, candidates=min(len(ids), n)), \
+                        timer(RETRIEVAL_SECONDS, stage="rerank"):
+                    ids = self._rerank(query, ids[:n])
+            current.set_attribute("results", len(ids[:k]))
+        return ids[:k]
+
+    def search(self, query: str, vector=None, k: int = 3) -> List[Dict]:
+        """返回最相关的k个分块（text和metadata）"""
+        return [self.chunks[i] for i in self.search_ids(query, vector, k)]
+
+
+def retriever_from_env(doc_index) -> HybridRetriever:
+    """按环境变量创建客服文档检索器
+
+    - CHAT_RETRIEVAL：hybrid（默认）、dense或sparse
+    - CHAT_RETRIEVAL_CANDIDATES：每一路召回和重排的候选分块数，默认20
+    - CHAT_RERANK_MODEL：交叉编码器模型（如BAAI/bge-reranker-base），不设置则不重排
+    """
+    return HybridRetriever.from_index(
+        doc_index,
+        mode=os.environ.get("CHAT_RETRIEVAL", "hybrid"),
+        candidates=int(os.environ.get("CHAT_RETRIEVAL_CANDIDATES", 20)),
+        rerank_model=os.environ.get("CHAT_RERANK_MODEL") or None,
+    )
@@ -1,21 +1,33 @@
 from typing import Dict, List
 import pandas as pd
 from datetime import datetime
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
-import os
+from database.db import AnalysisCache
+from config.metrics import TOOL_CALLS, TOOL_SECONDS
+from config.tracing import span
+from tools.llm_client import get_chat_model
+import asyncio
+import hashlib
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# 各分析工具的缓存有效期（秒）：天气按季节变化，节假日按季度变化，社交趋势变化较快
+DEFAULT_CACHE_TTLS = {
+    "weather": 6 * 3600,
+    "trends": 1 * 3600,
+    "events": 24 * 3600,
+}
+
 class InventoryTools:
-    def __init__(self, llm=None):
-        """允许注入LLM实例"""
-        self.llm = llm or ChatOpenAI(
-            model=os.environ["LLM_MODELEND"],
-            temperature=0.7
-        )
+    def __init__(self, llm=None, cache: AnalysisCache = None, cache_ttls: Dict[str, float] = None):
+        """允许注入LLM实例和分析结果缓存"""
+        self.llm = llm or get_chat_model("inventory_tools", temperature=0.7)
+        self.cache = cache or AnalysisCache()
+        self.cache_ttls = {**DEFAULT_CACHE_TTLS, **(cache_ttls or {})}
         self._init_tools()
 
     def _init_tools(self):
@@ -52,9 +64,70 @@ class InventoryTools:
             )
         )
 
-    def get_weather_impact(self, product, location, season):
+    def _cache_key(self, tool: str, chain: LLMChain, inputs: Dict) -> str:
+        """由工具名、模型、提示模板哈希和归一化后的输入生成缓存键"""
+        normalized = {
+            key: " ".join(str(value).split()).lower()
+            for key, value in inputs.items()
+        }
+        payload = json.dumps({
+            "tool": tool,
+            "model": getattr(self.llm, "model_name", type(self.llm).__name__),
+            "template": hashlib.sha256(chain.prompt.template.encode("utf-8")).hexdigest(),
+            "inputs": normalized,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _cached_run(self, tool: str, chain: LLMChain, bypass_cache: bool = False, **inputs) -> str:
+        """带TTL缓存地执行分析链；bypass_cache为True时跳过读缓存，但仍会用新结果刷新缓存"""
+        started = time.perf_counter()
+        with span("inventory_tools.run", tool=tool, bypass_cache=bypass_cache) as current:
+            cache_key = self._cache_key(tool, chain, inputs)
+            if not bypass_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"分析缓存命中: {tool} {inputs}")
+                    current.set_attribute("cache_hit", True)
+                    self._record_call(tool, "hit", started)
+                    return cached
+
+            current.set_attribute("cache_hit", False)
+            result = chain.run(**inputs)
+            self.cache.set(cache_key, tool, result, self.cache_ttls[tool])
+            self._record_call(tool, "bypass" if bypass_cache else "miss", started)
+            return result
+
+    async def _acached_run(self, tool: str, chain: LLMChain, bypass_cache: bool = False, **inputs) -> str:
+        """_cached_run的异步版本：LLM调用通过异步客户端发出，等待期间不占用线程"""
+        started = time.perf_counter()
+        with span("inventory_tools.run", tool=tool, bypass_cache=bypass_cache) as current:
+            cache_key = self._cache_key(tool, chain, inputs)
+            if not bypass_cache:
+                # 缓存读写是同步的SQLite操作（写入会等待写锁），放到线程中执行以免阻塞事件循环
+                cached = await asyncio.to_thread(self.cache.get, cache_key)
+                if cached is not None:
+                    logger.info(f"分析缓存命中: {tool} {inputs}")
+                    current.set_attribute("cache_hit", True)
+                    self._record_call(tool, "hit", started)
+                    return cached
+
+            current.set_attribute("cache_hit", False)
+            result = await chain.arun(**inputs)
+            await asyncio.to_thread(self.cache.set, cache_key, tool, result, self.cache_ttls[tool])
+            self._record_call(tool, "bypass" if bypass_cache else "miss", started)
+            return result
+
+    @staticmethod
+    def _record_call(tool: str, cache: str, started: float):
+        TOOL_CALLS.inc(tool=tool, cache=cache)
+        TOOL_SECONDS.observe(time.perf_counter() - started, tool=tool, cache=cache)
+
+    def get_weather_impact(self, product, location, season, bypass_cache=False):
         try:
-            return self.weather_chain.run(
+            return self._cached_run(
+                "weather",
+                self.weather_chain,
+                bypass_cache=bypass_cache,
                 product=product,
                 location=location,
                 season=season
@@ -63,16 +136,63 @@ class InventoryTools:
             logger.error(f"天气分析失败: {str(e)}")
             return "暂无天气分析数据"
 
-    def get_social_trends(self, product):
+    def get_social_trends(self, product, bypass_cache=False):
         try:
-            return self.trends_chain.run(product=product)
+            return self._cached_run(
+                "trends",
+                self.trends_chain,
+                bypass_cache=bypass_cache,
+                product=product
+            )
+        except Exception as e:
+            logger.error(f"社交趋势分析失败: {str(e)}")
+            return "暂无社交趋势数据"
+
+    def get_seasonal_events(self, product, timeframe, bypass_cache=False):
+        try:
+            return self._cached_run(
+                "events",
+                self.events_chain,
+                bypass_cache=bypass_cache,
+                product=product,
+                timeframe=timeframe
+            )
+        except Exception as e:
+            logger.error(f"节假日分析失败: {str(e)}")
+            return "暂无节假日活动数据"
+
+    async def aget_weather_impact(self, product, location, season, bypass_cache=False):
+        try:
+            return await self._acached_run(
+                "weather",
+                self.weather_chain,
+                bypass_cache=bypass_cache,
+                product=product,
+                location=location,
+                season=season
+            )
+        except Exception as e:
+            logger.error(f"天气分析失败: {str(e)}")
+            return "暂无天气分析数据"
+
+    async def aget_social_trends(self, product, bypass_cache=False):
+        try:
+            return await self._acached_run(
+                "trends",
+                self.trends_chain,
+                bypass_cache=bypass_cache,
+                product=product
+            )
         except Exception as e:
             logger.error(f"社交趋势分析失败: {str(e)}")
             return "暂无社交趋势数据"
 
-    def get_seasonal_events(self, product, timeframe):
+    async def aget_seasonal_events(self, product, timeframe, bypass_cache=False):
         try:
-            return self.events_chain.run(
+            return await self._acached_run(
+                "events",
+                self.events_chain,
+                bypass_cache=bypass_cache,
                 product=product,
                 timeframe=timeframe
             )
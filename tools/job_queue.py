@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from config.metrics import JOB_SECONDS, JOBS_FINISHED, JOBS_INFLIGHT, JOBS_SUBMITTED
+from database.db import JobStore
+
+logger = logging.getLogger(__name__)
+
+ABANDONED_ERROR = "任务所在的进程已退出，任务已中断"
+STALE_ERROR = "任务长时间没有进展，可能已中断"
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":  # Windows上os.kill会结束进程，只依赖stale_after判断
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """长耗时请求的后台任务队列
+
+    每类任务有独立的有界线程池（即该类任务的并发上限），提交时立即返回任务ID，
+    状态和结果保存在JobStore中供客户端轮询。相同类型、相同输入且仍在执行中的任务
+    会被合并为同一个任务ID。
+
+    任务只在提交它的进程中执行，进程退出后遗留的排队/执行中任务不会再完成：
+    启动时和定期清理时会把它们（以及超过stale_after秒没有更新的任务）标记为失败。
+    handler返回status为error的结果时任务同样记为失败。
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, result_ttl: float = 3600,
+                 stale_after: float = 1800):
+        self.store = store or JobStore()
+        self.result_ttl = result_ttl  # 结果保留时间（秒）
+        self.stale_after = stale_after  # 超过该时间未完成的任务不再参与去重（秒）
+        self._handlers: Dict[str, Callable[..., dict]] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._inflight: Dict[str, str] = {}  # dedup_key -> job_id
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._fail_abandoned(startup=True)
+
+    def register(self, kind: str, handler: Callable[..., dict], max_concurrency: int = 1):
+        """注册任务类型，handler以payload为关键字参数调用，返回可JSON序列化的结果"""
+        self._handlers[kind] = handler
+        self._executors[kind] = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix=f"job-{kind}"
+        )
+
+    def has_kind(self, kind: str) -> bool:
+        return kind in self._handlers
+
+    @staticmethod
+    def dedup_key(kind: str, payload: dict) -> str:
+        data = json.dumps({"kind": kind, "payload": payload}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def submit(self, kind: str, payload: dict) -> Tuple[str, bool]:
+        """提交任务，返回(任务ID, 是否与进行中的任务合并)"""
+        if kind not in self._handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        self._purge_expired()
+
+        dedup_key = self.dedup_key(kind, payload)
+        with self._lock:
+            # 先查本进程的进行中任务，再在一个写事务内查询并创建，其他进程提交的相同任务同样会被合并
+            existing = self._inflight.get(dedup_key)
+            if not existing:
+                job_id, created = self.store.create_unless_active(
+                    uuid.uuid4().hex, kind, dedup_key, payload, self.stale_after
+                )
+                if created:
+                    self._inflight[dedup_key] = job_id
+                else:
+                    existing = job_id
+            if existing:
+                JOBS_SUBMITTED.inc(kind=kind, deduplicated="true")
+                return existing, True
+
+        JOBS_SUBMITTED.inc(kind=kind, deduplicated="false")
+        JOBS_INFLIGHT.inc(kind=kind)
+        self._executors[kind].submit(self._run, job_id, kind, dedup_key, payload)
+        logger.info(f"任务已提交: {kind} {job_id}")
+        return job_id, False
+
+    def _run(self, job_id: str, kind: str, dedup_key: str, payload: dict):
+        started = time.perf_counter()
+        status = "failed"
+        try:
+            self.store.mark_running(job_id)
+            result = self._handlers[kind](**payload)
+            if isinstance(result, dict) and result.get("status") == "error":
+                # handler通过返回值报告的失败
+                error = result.get("error") or "任务执行失败"
+                logger.warning(f"任务失败: {kind} {job_id}: {error}")
+                self.store.mark_finished(job_id, "failed", self.result_ttl, result=result, error=error)
+            else:
+                self.store.mark_finished(job_id, "succeeded", self.result_ttl, result=result)
+                status = "succeeded"
+                logger.info(f"任务完成: {kind} {job_id}")
+        except Exception as e:
+            logger.error(f"任务失败: {kind} {job_id}: {str(e)}", exc_info=True)
+            self.store.mark_finished(job_id, "failed", self.result_ttl, error=str(e))
+        finally:
+            with self._lock:
+                self._inflight.pop(dedup_key, None)
+            JOBS_INFLIGHT.dec(kind=kind)
+            JOBS_FINISHED.inc(kind=kind, status=status)
+            JOB_SECONDS.observe(time.perf_counter() - started, kind=kind)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def is_stale(self, job: dict) -> bool:
+        """任务仍为排队/执行中，但超过stale_after秒没有更新（所在进程可能已退出）"""
+        return job["status"] in JobStore.ACTIVE_STATUSES and job["updated_at"] < time.time() - self.stale_after
+
+    def _fail_abandoned(self, startup: bool = False):
+        """把已退出进程遗留的任务和长时间没有更新的任务标记为失败
+
+        启动时本进程还没有提交任何任务，记录为本进程ID的任务来自进程ID相同的上一次运行（如容器中的固定PID）。
+        """
+        pid = os.getpid()
+        try:
+            dead = [
+                owner for owner in self.store.active_owners()
+                if owner is None or (owner == pid and startup) or (owner != pid and not _pid_alive(owner))
+            ]
+            failed = self.store.fail_abandoned(ABANDONED_ERROR, self.result_ttl, owners=dead)
+            failed += self.store.fail_abandoned(
+                STALE_ERROR, self.result_ttl, updated_before=time.time() - self.stale_after
+            )
+            if failed:
+                logger.warning(f"已将{failed}个中断的任务标记为失败")
+        except Exception as e:
+            logger.warning(f"检查中断的任务失败: {str(e)}")
+
+    def _purge_expired(self, interval: float = 60):
+        """每隔interval秒清理一次过期结果，并把中断的任务标记为失败（之后按result_ttl过期清理）"""
+        now = time.time()
+        if now - self._last_purge < interval:
+            return
+        self._last_purge = now
+        self._fail_abandoned()
+        try:
+            self.store.purge_expired()
+        except Exception as e:
+            logger.warning(f"清理过期任务失败: {str(e)}")
@@ -0,0 +1,417 @@
+"""共享的LLM客户端工厂
+
+各组件通过get_chat_model()获取ChatOpenAI，不再各自构造：
+- 同一模型的所有ChatOpenAI共用一对连接池化的httpx客户端（同步/异步各一个），
+  连接保持keep-alive，安装了h2时启用HTTP/2，避免每次调用重新建立TCP/TLS连接；
+- 所有模型共享一个全局并发上限，每个模型另有单独的并发上限，超出的请求排队等待名额；
+  名额在进程内由同步和异步请求（包括不同事件循环）共用，请求先取得模型名额再取得全局名额；
+- 接口返回429时按Retry-After（没有时按指数退避加随机抖动）等待后重试，等待期间让出并发名额。
+
+配置（环境变量）：
+    LLM_MAX_CONCURRENCY        全局并发上限，默认64
+    LLM_MODEL_CONCURRENCY      每个模型的并发上限，默认32
+    LLM_MAX_CONNECTIONS        每个客户端的连接池大小，默认100
+    LLM_KEEPALIVE_EXPIRY       空闲连接保留秒数，默认60
+    LLM_RATE_LIMIT_RETRIES     429的最大重试次数，默认5
+    LLM_HTTP2                  设为0时关闭HTTP/2
+
+并发上限的默认值按单个进程、单个API key估算：64个在途请求低于常见模型服务按key限制的并发数，
+也小于连接池大小（超出连接池的请求会在httpx内部排队，名额就失去了意义）；多个worker进程时上限按进程数倍增。
+请求几乎都只用一个模型时，实际的上限是LLM_MODEL_CONCURRENCY。
+ASGI服务需要同时等待几百个LLM请求时，在服务商配额允许的前提下同时调高这两项和LLM_MAX_CONNECTIONS，
+当前生效的值可由concurrency_limits()获取（bench_asgi会记录在结果中）。
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from config.metrics import LLM_INFLIGHT, LLM_RATE_LIMITED, LLM_SLOT_WAIT_SECONDS
+from config.tracing import llm_callbacks
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_SECONDS = 30.0
+
+
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_MODEL_CONCURRENCY = 32
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def concurrency_limits() -> Dict[str, int]:
+    """按环境变量返回生效的并发上限：global为全局上限，per_model为每个模型的上限"""
+    return {
+        "global": _env_int("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY),
+        "per_model": _env_int("LLM_MODEL_CONCURRENCY", DEFAULT_MODEL_CONCURRENCY),
+    }
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    """429后的等待时间：优先使用Retry-After，否则为0.5*2^attempt秒内的随机值"""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass  # HTTP日期格式的Retry-After按指数退避处理
+    return random.uniform(0, min(0.5 * 2 ** attempt, MAX_BACKOFF_SECONDS))
+
+
+class _Slots:
+    """线程和事件循环共用的并发名额，按申请顺序分配
+
+    同步请求在线程中阻塞等待，异步请求等待一个future，不占用线程；
+    归还名额时直接转交给最早的等待者，不同事件循环中的请求也共用同一份名额。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._available = size
+        self._waiters = deque()  # threading.Event或asyncio.Future
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._available and not self._waiters:
+                self._available -= 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def acquire_async(self):
+        with self._lock:
+            if self._available and not self._waiters:
+                self._available -= 1
+                return
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                    raise
+            # 名额已转交给本请求：future被取消时由_wake归还，否则在这里归还
+            if not future.cancelled():
+                self.release()
+            raise
+
+    def _wake(self, future: asyncio.Future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                if self._available >= self.size:
+                    raise ValueError("并发名额归还次数多于申请次数")
+                self._available += 1
+                return
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+            return
+        try:
+            waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+        except RuntimeError:  # 等待者所在的事件循环已关闭
+            self.release()
+
+
+class _ConcurrencyLimits:
+    """全局和单个模型的并发名额，同步和异步请求共用"""
+
+    def __init__(self, global_limit: int, model_limit: int):
+        self.global_limit = global_limit
+        self.model_limit = model_limit
+        self._global = _Slots(global_limit)
+        self._models: Dict[str, _Slots] = {}
+        self._lock = threading.Lock()
+
+    def slots(self, model: str) -> Tuple[_Slots, _Slots]:
+        """返回(模型名额, 全局名额)，按此顺序申请
+
+        先取得模型名额再等待全局名额，排队等待某个已满模型的请求不会占用全局名额而阻塞其他模型。
+        """
+        with self._lock:
+            if model not in self._models:
+                self._models[model] = _Slots(self.model_limit)
+            return self._models[model], self._global
+
+
+_limits: Optional[_ConcurrencyLimits] = None
+_clients: Dict[Tuple, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+_chat_models: Dict[Tuple, object] = {}
+_lock = threading.Lock()
+
+
+def _get_limits() -> _ConcurrencyLimits:
+    global _limits
+    if _limits is None:
+        limits = concurrency_limits()
+        _limits = _ConcurrencyLimits(limits["global"], limits["per_model"])
+    return _limits
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """响应体读完或关闭时才归还并发名额，流式响应在整个流期间占用名额"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+def _once(fn):
+    called = False
+
+    def wrapper():
+        nonlocal called
+        if not called:
+            called = True
+            fn()
+
+    return wrapper
+
+
+class LimitedTransport(httpx.BaseTransport):
+    """在连接池化的传输层外加并发名额和429重试"""
+
+    def __init__(self, inner: httpx.BaseTransport, model: str, limits: _ConcurrencyLimits, retries: int):
+        self._inner = inner
+        self._model = model
+        self._slots = limits.slots(model)
+        self._retries = retries
+
+    def _acquire(self):
+        started = time.perf_counter()
+        model_slots, global_slots = self._slots
+        model_slots.acquire()
+        try:
+            global_slots.acquire()
+        except BaseException:
+            model_slots.release()
+            raise
+        LLM_SLOT_WAIT_SECONDS.observe(time.perf_counter() - started, model=self._model)
+        LLM_INFLIGHT.inc(model=self._model)
+
+    def _release(self):
+        LLM_INFLIGHT.dec(model=self._model)
+        model_slots, global_slots = self._slots
+        global_slots.release()
+        model_slots.release()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                response = self._inner.handle_request(request)
+            except BaseException:
+                self._release()
+                raise
+            if response.status_code != 429 or attempt >= self._retries:
+                if response.status_code == 429:
+                    LLM_RATE_LIMITED.inc(model=self._model, outcome="gave_up")
+                return httpx.Response(
+                    status_code=response.status_code,
+                    headers=response.headers,
+                    stream=_ReleasingStream(response.stream, _once(self._release)),
+                    extensions=response.extensions,
+                )
+            LLM_RATE_LIMITED.inc(model=self._model, outcome="retried")
+            response.close()
+            self._release()
+            delay = _retry_delay(response, attempt)
+            logger.warning(f"LLM接口限流(429)，{delay:.2f}秒后第{attempt + 1}次重试: {self._model}")
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self._inner.close()
+
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    """LimitedTransport的异步版本，排队和退避时不占用线程"""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, model: str, limits: _ConcurrencyLimits, retries: int):
+        self._inner = inner
+        self._model = model
+        self._slots = limits.slots(model)
+        self._retries = retries
+
+    async def _acquire(self):
+        started = time.perf_counter()
+        model_slots, global_slots = self._slots
+        await model_slots.acquire_async()
+        try:
+            await global_slots.acquire_async()
+        except BaseException:
+            model_slots.release()
+            raise
+        LLM_SLOT_WAIT_SECONDS.observe(time.perf_counter() - started, model=self._model)
+        LLM_INFLIGHT.inc(model=self._model)
+
+        def release():
+            LLM_INFLIGHT.dec(model=self._model)
+            global_slots.release()
+            model_slots.release()
+
+        return release
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            release = await self._acquire()
+            try:
+                response = await self._inner.handle_async_request(request)
+            except BaseException:
+                release()
+                raise
+            if response.status_code != 429 or attempt >= self._retries:
+                if response.status_code == 429:
+                    LLM_RATE_LIMITED.inc(model=self._model, outcome="gave_up")
+                return httpx.Response(
+                    status_code=response.status_code,
+                    headers=response.headers,
+                    stream=_AsyncReleasingStream(response.stream, _once(release)),
+                    extensions=response.extensions,
+                )
+            LLM_RATE_LIMITED.inc(model=self._model, outcome="retried")
+            await response.aclose()
+            release()
+            delay = _retry_delay(response, attempt)
+            logger.warning(f"LLM接口限流(429)，{delay:.2f}秒后第{attempt + 1}次重试: {self._model}")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+def _http2_enabled() -> bool:
+    if os.environ.get("LLM_HTTP2", "1") == "0":
+        return False
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_http_clients(model: str, base_url: Optional[str] = None) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """获取model对应的共享(同步, 异步)httpx客户端，首次使用时创建"""
+    base_url = base_url or os.environ.get("OPENAI_BASE_URL") or ""
+    key = (base_url, model)
+    clients = _clients.get(key)
+    if clients is not None:
+        return clients
+
+    with _lock:
+        clients = _clients.get(key)
+        if clients is None:
+            pool = httpx.Limits(
+                max_connections=_env_int("LLM_MAX_CONNECTIONS", 100),
+                max_keepalive_connections=_env_int("LLM_MAX_CONNECTIONS", 100),
+                keepalive_expiry=float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60")),
+            )
+            http2 = _http2_enabled()
+            retries = _env_int("LLM_RATE_LIMIT_RETRIES", 5)
+            limits = _get_limits()
+            clients = (
+                httpx.Client(transport=LimitedTransport(
+                    httpx.HTTPTransport(limits=pool, http2=http2), model, limits, retries)),
+                httpx.AsyncClient(transport=AsyncLimitedTransport(
+                    httpx.AsyncHTTPTransport(limits=pool, http2=http2), model, limits, retries)),
+            )
+            _clients[key] = clients
+            logger.info(f"已创建LLM客户端: {model}（HTTP/2: {http2}）")
+    return clients
+
+
+def get_chat_model(component: str, temperature: float = 0.7, model: Optional[str] = None,
+                   streaming: bool = False):
+    """获取共享的ChatOpenAI，component为指标和追踪中区分调用方的标签
+
+    同一(component, model, temperature, streaming)返回同一实例；ChatOpenAI本身无状态，可在线程间共享。
+    streaming为True时invoke也以流式请求模型，逐token触发回调（on_llm_new_token），并在流中返回用量。
+    """
+    # 调用时再取ChatOpenAI，基准测试替换langchain_openai.ChatOpenAI后同样生效
+    import langchain_openai
+
+    model = model or os.environ["LLM_MODELEND"]
+    key = (component, model, temperature, streaming)
+    chat_model = _chat_models.get(key)
+    if chat_model is not None:
+        return chat_model
+
+    http_client, http_async_client = get_http_clients(model)
+    with _lock:
+        chat_model = _chat_models.get(key)
+        if chat_model is None:
+            chat_model = _chat_models[key] = langchain_openai.ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                callbacks=llm_callbacks(component),
+                http_client=http_client,
+                http_async_client=http_async_client,
+                streaming=streaming,
+                stream_usage=streaming,
+            )
+    return chat_model
+
+
+def close_clients():
+    """关闭所有共享的同步客户端并清空缓存（异步客户端随事件循环结束释放）"""
+    with _lock:
+        for client, _ in _clients.values():
+            client.close()
+        _clients.clear()
+        _chat_models.clear()
+
+
+def _after_fork_in_child():
+    # 子进程不能复用父进程连接池中的socket，也不能继承可能被其他线程持有的锁
+    global _lock, _limits
+    _lock = threading.Lock()
+    _limits = None
+    _clients.clear()
+    _chat_models.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,122 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 进程级模型注册表：每个模型只加载一次，由所有组件共享
+_models: Dict[str, object] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_shared(key: str, load):
+    """按key获取共享的模型，首次使用时调用load()加载
+
+    同一模型的并发加载请求会等待同一次加载完成，不会重复加载。
+    """
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        model = _models.get(key)
+        if model is None:
+            start = time.perf_counter()
+            model = load()
+            _models[key] = model
+            logger.info(f"模型已加载: {key}，耗时 {time.perf_counter() - start:.2f}s")
+    return model
+
+
+def get_sentence_model(model_name: str):
+    """获取共享的SentenceTransformer模型，首次使用时才加载"""
+    def load():
+        # 延迟导入，未使用嵌入模型的进程不需要加载torch
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(model_name)
+
+    return _get_shared(model_name, load)
+
+
+def get_cross_encoder(model_name: str):
+    """获取共享的CrossEncoder重排模型（在CPU上运行），首次使用时才加载"""
+    def load():
+        from sentence_transformers import CrossEncoder
+
+        return CrossEncoder(model_name, device="cpu")
+
+    return _get_shared(f"cross-encoder:{model_name}", load)
+
+
+def embedding_model_name() -> str:
+    """文档检索、问答缓存和分流共用的嵌入模型，由EMBEDDING_MODEL配置，默认all-MiniLM-L6-v2
+
+    docs目录以中文文档为主时建议使用中文或多语言模型，如BAAI/bge-small-zh-v1.5、
+    paraphrase-multilingual-MiniLM-L12-v2；更换模型后文档索引会自动全量重建。
+    """
+    return os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+
+def warm_up(model_names: Iterable[str], background: bool = True) -> Optional[threading.Thread]:
+    """预加载模型；background为True时在后台线程中加载，不阻塞启动"""
+    model_names = list(model_names)
+
+    def load():
+        for name in model_names:
+            try:
+                get_sentence_model(name)
+            except Exception as e:
+                logger.error(f"预加载模型失败 {name}: {str(e)}")
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def loaded_models() -> List[str]:
+    return list(_models)
+
+
+def rss_mb() -> Optional[float]:
+    """当前进程的常驻内存(MB)，无法获取时返回None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+
+        # 非Linux平台退化为峰值内存；macOS单位为字节，Linux为KB
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+
+@contextmanager
+def startup_timer(component: str):
+    """记录组件初始化耗时和常驻内存增量"""
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    rss_after = rss_mb()
+    if rss_before is not None and rss_after is not None:
+        logger.info(
+            f"{component} 初始化完成：耗时 {elapsed:.2f}s，"
+            f"常驻内存 {rss_after:.0f}MB（+{rss_after - rss_before:.0f}MB）"
+        )
+    else:
+        logger.info(f"{component} 初始化完成：耗时 {elapsed:.2f}s")
@@ -0,0 +1,129 @@
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ("rag", "math", "plan")
+
+# 带标注的示例问题：新问题取最相似示例的路由
+EXEMPLARS: Dict[str, List[str]] = {
+    "rag": [
+        "玫瑰的花语是什么？",
+        "配送范围有哪些城市？",
+        "鲜花如何保鲜？",
+        "可以开发票吗？",
+        "订单多久能送达？",
+        "收到的花有损坏可以退换吗？",
+        "员工手册里关于请假的规定是什么？",
+        "门店的营业时间是几点？",
+    ],
+    "math": [
+        "3束玫瑰每束99元一共多少钱？",
+        "120加上35等于多少？",
+        "200元的花束打八折要多少钱？",
+        "计算15乘以8",
+        "每天卖出40束花，一周能卖多少束？",
+    ],
+    "plan": [
+        "比较玫瑰和百合的花语，并根据300元预算推荐一个组合",
+        "先查一下配送范围，再算一下运费一共多少",
+        "帮我制定一个母亲节送花方案，包括花材选择和预算分配",
+        "根据员工手册，计算员工请假三天要扣多少工资",
+        "分别说明康乃馨和郁金香的保鲜方法，然后对比它们的价格",
+    ],
+}
+
+# 纯算式，如"12*8+5等于多少"
+_EXPRESSION = re.compile(r"^[\d\s.+\-*/×÷()（）=]+(等于多少|是多少|得多少)?[?？。]?$")
+# 多步问题的标志：需要拆分为多个子任务再汇总。
+# "比较"多作副词（"送什么花比较好"），只有带比较对象时才算；"方案"需要制定/规划等动词；"先生"不是"先…再"
+_MULTI_STEP = re.compile(
+    r"然后|并且|分别|对比"
+    r"|比较(一下)?.{0,20}(和|与|跟)|(和|与|跟).{0,20}(相比|比较一下|作比较|做比较)"
+    r"|(制定|规划|设计|策划).{0,15}(方案|计划)"
+    r"|先(?!生).+再"
+)
+
+
+class QueryRouter:
+    """在Plan-and-Execute之前对客服问题分流
+
+    - rag：单跳的文档问答，一次检索加一次LLM调用即可回答；
+    - math：纯计算问题，直接交给LLMMathChain；
+    - plan：需要多个步骤的问题，仍由Plan-and-Execute处理。
+
+    先用规则识别明显的纯算式和多步问题，其余问题取嵌入最相似的标注示例的路由；
+    与所有示例的相似度都低于min_similarity时保守地走plan。
+    """
+
+    def __init__(self, embeddings, exemplars: Optional[Dict[str, List[str]]] = None,
+                 min_similarity: float = 0.5, enabled: bool = True):
+        self.embeddings = embeddings
+        self.exemplars = exemplars or EXEMPLARS
+        self.min_similarity = min_similarity
+        self.enabled = enabled
+        self._labels: List[str] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _exemplar_vectors(self) -> np.ndarray:
+        """首次分流时嵌入全部示例（经过向量缓存，重启后不重复编码）"""
+        if self._vectors is None:
+            with self._lock:
+                if self._vectors is None:
+                    labels, texts = [], []
+                    for route, questions in self.exemplars.items():
+                        labels += [route] * len(questions)
+                        texts += questions
+                    vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+                    self._labels = labels
+                    self._vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return self._vectors
+
+    @staticmethod
+    def rule_route(question: str) -> Optional[str]:
+        """规则能确定时返回路由，否则返回None"""
+        text = question.strip()
+        if _EXPRESSION.match(text.replace("计算", "", 1)) and re.search(r"\d", text):
+            return "math"
+        if _MULTI_STEP.search(text):
+            return "plan"
+        return None
+
+    def route(self, question: str, vector=None) -> str:
+        """返回question的路由；vector为问题的嵌入向量，调用方已计算时可直接传入"""
+        if not self.enabled:
+            return "plan"
+        route = self.rule_route(question)
+        if route is not None:
+            return route
+
+        exemplars = self._exemplar_vectors()
+        query = np.asarray(vector if vector is not None else self.embeddings.embed_query(question),
+                           dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return "plan"
+        scores = exemplars @ (query / norm)
+        best = int(np.argmax(scores))
+        if scores[best] < self.min_similarity:
+            return "plan"
+        return self._labels[best]
+
+
+def router_from_env(embeddings) -> QueryRouter:
+    """按环境变量创建分流器
+
+    - CHAT_ROUTER：设为0时关闭分流，所有问题都走Plan-and-Execute
+    - CHAT_ROUTER_MIN_SIMILARITY：按示例分流所需的最低相似度，默认0.5
+    """
+    return QueryRouter(
+        embeddings,
+        min_similarity=float(os.environ.get("CHAT_ROUTER_MIN_SIMILARITY", 0.5)),
+        enabled=os.environ.get("CHAT_ROUTER", "1") != "0",
+    )
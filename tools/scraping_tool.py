@@ -3,6 +3,9 @@ import json
 import requests
 import time
 
+from config.metrics import EXTERNAL_REQUEST_ERRORS, EXTERNAL_REQUEST_SECONDS, timer
+from config.tracing import span
+
 
 # 定义爬取微博用户信息的函数
 def scrape_weibo(url: str):
@@ -12,7 +15,14 @@ def scrape_weibo(url: str):
         "Referer": "https://weibo.com",
     }
     cookies = {"cookie": """SCF=AnUzeQzjh7AX_VDB0m8UjTIxbZHDKcZElXsQkamb6VuDdE7_gBQ_rsrVNv1n7bqBPTop3x-_w29nSgmz2tiCXfk.; XSRF-TOKEN=WkKt7llubQWrQtq-XY-Hdvum; PC_TOKEN=d2811fbe5c; SUB=_2A25Kb8tBDeRhGeFG61ER8yrOyDuIHXVpBUKJrDV8PUNbmtANLXeikW9NfpfsY0C4Oo0IZ_M-TlUCE0Ghwd5dsUYc; SUBP=0033WrSXqPxfM725Ws9jqgMF55529P9D9WFpbT4.rz6mTmB23r5.Pd8H5NHD95QN1h50eheXeoeNWs4DqcjCi--Ni-iWi-zRi--NiK.NiKnE; ALF=02_1737705489; WBPSESS=CEfLktBdsHSxronavg1XOKRJa_vcf3m6VUtKqLVHAAvzltnR4b_YpjivFbnOt8aoEAodacq0aINkW7URFCAboD3TmXF6GhVv7LtCXWwS7a_7tOTSoDn2VfXmB79ing5F97es_oVsNkNjxNQwuqEGYQ=="""}
-    response = requests.get(url, headers=headers, cookies=cookies)
+    with span("scrape.weibo", url=url) as current, timer(EXTERNAL_REQUEST_SECONDS, service="weibo"):
+        try:
+            response = requests.get(url, headers=headers, cookies=cookies)
+        except requests.RequestException:
+            EXTERNAL_REQUEST_ERRORS.inc(service="weibo")
+            raise
+        current.set_attribute("http.status_code", response.status_code)
+        current.set_attribute("response_bytes", len(response.content))
     time.sleep(3)  # 加上3s 的延时防止被反爬
     return response.text
 
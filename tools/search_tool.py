@@ -1,6 +1,9 @@
 # 导入SerpAPIWrapper
 from langchain.utilities import SerpAPIWrapper
 
+from config.metrics import EXTERNAL_REQUEST_ERRORS, EXTERNAL_REQUEST_SECONDS, timer
+from config.tracing import span
+
 
 # 重新定制SerpAPIWrapper，重构_process_response，返回URL
 class CustomSerpAPIWrapper(SerpAPIWrapper):
@@ -108,5 +111,10 @@ class CustomSerpAPIWrapper(SerpAPIWrapper):
 def get_UID(flower: str):
     # search = SerpAPIWrapper()
     search = CustomSerpAPIWrapper()
-    res = search.run(f"{flower}")
+    with span("search.serpapi", query=flower), timer(EXTERNAL_REQUEST_SECONDS, service="serpapi"):
+        try:
+            res = search.run(f"{flower}")
+        except Exception:
+            EXTERNAL_REQUEST_ERRORS.inc(service="serpapi")
+            raise
     return res
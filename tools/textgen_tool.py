@@ -1,11 +1,12 @@
 # 导入所需要的库
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from tools.parsing_tool import TextParsing
-import os
+from config.tracing import traced
+from tools.llm_client import get_chat_model
 
 # 生成文案的函数
+@traced("textgen.generate_letter")
 def generate_letter(information):
     # 设置输出解析器
     parser = PydanticOutputParser(pydantic_object=TextParsing)
@@ -55,7 +56,7 @@ def generate_letter(information):
     )
 
     # llm = ChatOpenAI(model_name="gpt-3.5-turbo")
-    llm = ChatOpenAI(model=os.environ.get("LLM_MODELEND"))
+    llm = get_chat_model("textgen")
 
     # 构建并执行chain
     chain = prompt | llm | parser